@@ -8,6 +8,10 @@ locals {
   bastion_server_name = length(local.bastion_server_names) > 0 ? local.bastion_server_names[0] : ""
   bastion_public_ip = local.bastion_server_name != "" ? kamatera_server.servers[local.bastion_server_name].public_ips[0] : ""
   bastion_public_port = random_integer.bastion_ssh_port.result
+  rke2_artifact_cache_server_name = var.rke2_artifact_cache_port == 0 ? "" : (local.bastion_server_name != "" ? local.bastion_server_name : local.first_controlplane_name)
+  rke2_artifact_cache_url = local.rke2_artifact_cache_server_name == "" ? "" : "http://${kamatera_server.servers[local.rke2_artifact_cache_server_name].private_ips[0]}:${var.rke2_artifact_cache_port}"
+  # the cache is filled in the background, nodes install from upstream until it is ready
+  rke2_artifact_cache_command = "{ systemctl stop rke2-artifact-cache-fill 2>/dev/null; systemctl reset-failed rke2-artifact-cache-fill 2>/dev/null; systemd-run --unit=rke2-artifact-cache-fill bash /root/server_startup_script.sh artifact_cache ${local.private_ip_prefix} ${var.rke2_artifact_cache_port} ${var.rke2_version}; }"
 }
 
 resource "terraform_data" "init_bastion" {
@@ -34,7 +38,7 @@ resource "terraform_data" "init_bastion" {
       if [ "$OK" == "true" ]; then
         echo "${filebase64("${path.module}/../server_startup_script.sh")}" | base64 --decode | \
           $SSHCMD $SSHSERVER "cat >/root/server_startup_script.sh" &&\
-        $SSHCMD $SSHSERVER "bash /root/server_startup_script.sh bastion ${local.bastion_public_port}" &&\
+        $SSHCMD $SSHSERVER "bash /root/server_startup_script.sh bastion ${local.bastion_public_port}${local.rke2_artifact_cache_server_name == local.bastion_server_name ? " && ${local.rke2_artifact_cache_command}" : ""}" &&\
         ssh-keyscan -p ${local.bastion_public_port} ${local.bastion_public_ip} > "${path.module}/ssh_known_hosts.bastion"
       else
         echo "Error: SSH is not available on bastion after multiple attempts."
@@ -40,7 +40,7 @@ locals {
         echo "${filebase64("${path.module}/../server_startup_script.sh")}" | base64 --decode | \
           $SSHCMD_INITIAL $SSHSERVER "cat >/root/server_startup_script.sh" &&\
         $SSHCMD_INITIAL $SSHSERVER "
-          NODE_NAME=__NAME__ CLUSTER_TOKEN=$(cat "${abspath("${path.module}/../.cluster_token")}") bash /root/server_startup_script.sh rke2 __RKE2_ARGS__
+          NODE_NAME=__NAME__ ${local.rke2_artifact_cache_url == "" ? "" : "SSS_ARTIFACT_CACHE_URL=${local.rke2_artifact_cache_url} "}CLUSTER_TOKEN=$(cat "${abspath("${path.module}/../.cluster_token")}") bash /root/server_startup_script.sh rke2 __RKE2_ARGS__
         " &&\
         if [ "${local.bastion_public_ip}" == "" ]; then
           ssh-keyscan -p ${local.servers_ssh_port} __SSH_IP__ > "${path.module}/ssh_known_hosts.__NAME__"
@@ -58,6 +58,14 @@ locals {
     for name, server in var.servers : name
     if server.role == "rke2" && try(tobool(server.role_config.is_first_controlplane), false) == true
   ][0]
+  # all server-role nodes, the first controlplane first
+  controlplane_node_names = concat(
+    [local.first_controlplane_name],
+    [
+      for name, server in var.servers : name
+      if server.role == "rke2" && try(server.role_config.rke2_type, "") == "server" && name != local.first_controlplane_name
+    ]
+  )
   first_controlplane_rke2_config = <<-EOT
     node-name: ${local.first_controlplane_name}
     node-ip: $PRIVATE_IP
@@ -105,6 +113,9 @@ resource "terraform_data" "init_rke2_firstcontrolplane" {
       fi
       ${local.first_controlplane_ssh_command}
       $SSHCMD $SSHSERVER "cat /var/lib/rancher/rke2/server/node-token" > "${abspath("${path.module}/../.cluster_token")}"
+      %{~ if local.rke2_artifact_cache_server_name == local.first_controlplane_name }
+      $SSHCMD $SSHSERVER "${local.rke2_artifact_cache_command}"
+      %{~ endif }
     EOT
   }
   provisioner "local-exec" {
@@ -113,23 +124,34 @@ resource "terraform_data" "init_rke2_firstcontrolplane" {
   }
 }
 
+locals {
+  nodes_bootstrap = {
+    for name, server in var.servers :
+    name => {
+      ssh_ip = local.bastion_public_ip == "" ? kamatera_server.servers[name].public_ips[0] : kamatera_server.servers[name].private_ips[0]
+      rke2_args = join(" ", [
+        local.private_ip_prefix,
+        local.servers_ssh_port,
+        server.role_config.rke2_type,
+        var.rke2_version,
+        base64encode(server.role_config.rke2_type == "server" ? local.secondary_controlplanes_rke2_config : local.nodes_rke2_config),
+        local.bastion_public_ip == "" ? "no" : "yes"
+      ])
+    }
+    if server.role == "rke2" && name != local.first_controlplane_name
+  }
+}
+
 resource "terraform_data" "init_rke2" {
   depends_on = [terraform_data.init_rke2_firstcontrolplane]
-  for_each = {
-    for name, server in var.servers :
+  # when bootstrap_command is set, all nodes are bootstrapped by terraform_data.init_rke2_bootstrap instead
+  for_each = var.bootstrap_command != "" ? {} : {
+    for name, node in local.nodes_bootstrap :
     name => replace(replace(replace(replace(local.init_rke2_server_script,
         "__PRIVATE_IP__", kamatera_server.servers[name].private_ips[0]),
         "__NAME__", name),
-        "__RKE2_ARGS__", join(" ", [
-          local.private_ip_prefix,
-          local.servers_ssh_port,
-          server.role_config.rke2_type,
-          var.rke2_version,
-          base64encode(server.role_config.rke2_type == "server" ? local.secondary_controlplanes_rke2_config : local.nodes_rke2_config),
-          local.bastion_public_ip == "" ? "no" : "yes"
-        ])),
-        "__SSH_IP__", local.bastion_public_ip == "" ? kamatera_server.servers[name].public_ips[0] : kamatera_server.servers[name].private_ips[0])
-    if server.role == "rke2" && name != local.first_controlplane_name
+        "__RKE2_ARGS__", node.rke2_args),
+        "__SSH_IP__", node.ssh_ip)
   }
   triggers_replace = {
     command = each.value
@@ -139,3 +161,36 @@ resource "terraform_data" "init_rke2" {
     interpreter = ["bash", "-c"]
   }
 }
+
+resource "local_file" "bootstrap_spec" {
+  count = var.bootstrap_command != "" ? 1 : 0
+  filename = "${path.module}/bootstrap.json"
+  content = jsonencode({
+    bastion = local.bastion_public_ip == "" ? null : {
+      host = local.bastion_public_ip
+      port = local.bastion_public_port
+    }
+    servers_ssh_port = local.servers_ssh_port
+    startup_script_path = abspath("${path.module}/../server_startup_script.sh")
+    cluster_token_path = abspath("${path.module}/../.cluster_token")
+    known_hosts_dir = abspath(path.module)
+    artifact_cache_url = local.rke2_artifact_cache_url
+    nodes = local.nodes_bootstrap
+  })
+}
+
+resource "terraform_data" "init_rke2_bootstrap" {
+  # one resource per node, so that adding or changing a server only bootstraps that server
+  # the command is not part of the triggers, so that it can change (e.g. a different python interpreter) without bootstrapping again
+  for_each = var.bootstrap_command != "" ? local.nodes_bootstrap : {}
+  depends_on = [terraform_data.init_rke2_firstcontrolplane, local_file.bootstrap_spec]
+  triggers_replace = {
+    node = jsonencode(each.value)
+    bastion = local.bastion_public_ip == "" ? "" : "${local.bastion_public_ip}:${local.bastion_public_port}"
+    startup_script = filesha256("${path.module}/../server_startup_script.sh")
+  }
+  provisioner "local-exec" {
+    command = "${var.bootstrap_command} --spec ${abspath("${path.module}/bootstrap.json")} --node ${each.key}"
+    interpreter = ["bash", "-c"]
+  }
+}
@@ -1,5 +1,5 @@
 resource "terraform_data" "ssh_known_hosts" {
-  depends_on = [terraform_data.init_rke2]
+  depends_on = [terraform_data.init_rke2, terraform_data.init_rke2_bootstrap]
   triggers_replace = {
     server_names = [for name, server in var.servers : name]
     command = <<-EOT
@@ -21,7 +21,7 @@ resource "terraform_data" "ssh_known_hosts" {
 }
 
 resource "local_file" "ssh_config" {
-  depends_on = [terraform_data.init_rke2]
+  depends_on = [terraform_data.init_rke2, terraform_data.init_rke2_bootstrap]
   filename = "${path.module}/../ssh_config"
   content = join(
     "\n",
@@ -45,6 +45,15 @@ resource "local_file" "ssh_config" {
             UserKnownHostsFile ${abspath("${path.module}/../ssh_known_hosts")}
         EOT
         if server.role == "rke2"
+      ],
+      # multiplexed connections, the settings are passed by the python tests package so that they match its session pool
+      var.ssh_control_path == "" ? [] : [
+        <<-EOT
+          Host *
+            ControlMaster auto
+            ControlPath ${var.ssh_control_path}
+            ControlPersist ${var.ssh_control_persist_seconds == null ? "no" : var.ssh_control_persist_seconds}
+        EOT
       ]
     )
   )
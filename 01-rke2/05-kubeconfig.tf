@@ -1,12 +1,47 @@
+locals {
+  # a cluster / context per control plane server, the first controlplane is the default one
+  # the tests' API client fails over between the servers of the default@* clusters
+  kubeconfig_cluster_names = {
+    for name in local.controlplane_node_names : name => name == local.first_controlplane_name ? "default" : "default@${name}"
+  }
+}
+
 resource "terraform_data" "kubeconfig" {
   depends_on = [local_file.ssh_config, terraform_data.ssh_known_hosts]
   triggers_replace = {
     command = <<-EOT
       set -euo pipefail
       FILENAME="${path.module}/../.kubeconfig"
-      ssh -F ${abspath("${path.module}/../ssh_config")} ${var.name_prefix}-${local.first_controlplane_name} \
-        "cat /etc/rancher/rke2/rke2.yaml" > "$FILENAME"
-      sed -i 's|https://127.0.0.1:6443|https://${kamatera_server.servers[local.first_controlplane_name].public_ips[0]}:6443|' "$FILENAME"
+      RKE2_YAML="$(ssh -F ${abspath("${path.module}/../ssh_config")} ${var.name_prefix}-${local.first_controlplane_name} \
+        "cat /etc/rancher/rke2/rke2.yaml")"
+      get_field() {
+        echo "$RKE2_YAML" | awk -v key="$1:" '$1 == key {print $2; exit}'
+      }
+      cat > "$FILENAME" <<EOF
+      apiVersion: v1
+      kind: Config
+      clusters:
+      %{ for name in local.controlplane_node_names ~}
+      - name: ${local.kubeconfig_cluster_names[name]}
+        cluster:
+          certificate-authority-data: $(get_field certificate-authority-data)
+          server: https://${kamatera_server.servers[name].public_ips[0]}:6443
+      %{ endfor ~}
+      contexts:
+      %{ for name in local.controlplane_node_names ~}
+      - name: ${local.kubeconfig_cluster_names[name]}
+        context:
+          cluster: ${local.kubeconfig_cluster_names[name]}
+          user: default
+      %{ endfor ~}
+      current-context: default
+      preferences: {}
+      users:
+      - name: default
+        user:
+          client-certificate-data: $(get_field client-certificate-data)
+          client-key-data: $(get_field client-key-data)
+      EOF
     EOT
   }
   provisioner "local-exec" {
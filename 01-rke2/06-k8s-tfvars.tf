@@ -10,18 +10,13 @@ resource "local_file" "autoscaler_tfvars" {
     servers_ssh_port = local.servers_ssh_port
     rke2_config = local.nodes_rke2_config
     with_bastion = local.bastion_public_ip != ""
+    rke2_artifact_cache_url = local.rke2_artifact_cache_url
   })
 }
 
 resource "local_file" "taint_tfvars" {
   filename = "${path.module}/../02-k8s/taints.auto.tfvars.json"
   content = jsonencode({
-    controlplane_node_names = concat(
-      [local.first_controlplane_name],
-      [
-        for name, server in var.servers : name
-        if server.role == "rke2" && try(server.role_config.rke2_type, "") == "server" && name != local.first_controlplane_name
-      ]
-    )
+    controlplane_node_names = local.controlplane_node_names
   })
 }
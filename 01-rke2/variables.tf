@@ -71,3 +71,27 @@ variable "kamatera_api_secret" {
   type        = string
   sensitive = true
 }
+
+variable "rke2_artifact_cache_port" {
+  description = "Port of the RKE2 artifact cache on the private network (e.g. 52080). The cache is hosted on the bastion, or on the first controlplane when there is no bastion. Nodes install the RKE2 installer and release artifacts from it, with fallback to upstream. Disabled when 0."
+  type        = number
+  default     = 0
+}
+
+variable "bootstrap_command" {
+  description = "Command to bootstrap the nodes (except the first controlplane) over multiplexed SSH connections, called for each node with --spec <path to bootstrap.json> --node <name>. If not set, each node is bootstrapped by its own local-exec script. See the bootstrap command of the python tests package."
+  type        = string
+  default     = ""
+}
+
+variable "ssh_control_path" {
+  description = "ControlPath of multiplexed SSH connections in the generated ssh_config (e.g. ~/.ssh/ktb-%C), so that ssh -F ssh_config shares the control masters of the python tests package, which sets it from SSH_CONTROL_PATH. Multiplexing is not configured if not set."
+  type        = string
+  default     = ""
+}
+
+variable "ssh_control_persist_seconds" {
+  description = "ControlPersist of multiplexed SSH connections in the generated ssh_config, used with ssh_control_path. The python tests package sets it from SSH_CONTROL_PERSIST_SECONDS. If not set, the control master exits with its first connection."
+  type        = number
+  default     = null
+}
@@ -22,7 +22,13 @@ locals {
     cat >/etc/rancher/rke2/config.yaml.d/99-extra-config.yaml <<-EOF
     __RKE2_EXTRA_CONFIG__
     EOF
+    %{~ if var.registry_mirror_enabled }
+    ${local.registry_mirror_node_script}
+    %{~ endif }
     export SSS_SLACK_WEBHOOK_URL="${var.cluster_autoscaler_slack_webhook_url}"
+    %{~ if var.rke2_artifact_cache_url != "" }
+    export SSS_ARTIFACT_CACHE_URL="${var.rke2_artifact_cache_url}"
+    %{~ endif }
     bash /root/server_startup_script.sh rke2 "${var.private_ip_prefix}" "${var.servers_ssh_port}" "agent" "${var.rke2_version}" "${base64encode(var.rke2_config)}" "${var.with_bastion ? "yes" : "no"}"
   EOT
 
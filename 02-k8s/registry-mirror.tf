@@ -0,0 +1,208 @@
+// optional pull-through cache of docker.io images, hosted on a controlplane node
+// nodes reach it via the node port on localhost, containerd falls back to the upstream registry if it is not available
+
+locals {
+  registry_mirror_registries_yaml = <<-EOT
+    mirrors:
+      docker.io:
+        endpoint:
+          - "http://127.0.0.1:${var.registry_mirror_node_port}"
+  EOT
+  registry_mirror_rke2_config = <<-EOT
+    private-registry: /etc/rancher/rke2/registries-mirror.yaml
+  EOT
+  # writes the registries config and the rke2 config.yaml.d file which points to it
+  registry_mirror_node_script = !var.registry_mirror_enabled ? "" : <<-EOT
+    mkdir -p /etc/rancher/rke2/config.yaml.d
+    echo '${base64encode(local.registry_mirror_registries_yaml)}' | base64 --decode > /etc/rancher/rke2/registries-mirror.yaml
+    echo '${base64encode(local.registry_mirror_rke2_config)}' | base64 --decode > /etc/rancher/rke2/config.yaml.d/50-registry-mirror.yaml
+  EOT
+}
+
+resource "kubernetes_deployment_v1" "registry_mirror" {
+  count = var.registry_mirror_enabled ? 1 : 0
+  metadata {
+    name = "registry-mirror"
+    namespace = "kube-system"
+    labels = {
+      app = "registry-mirror"
+    }
+  }
+  spec {
+    replicas = 1
+    strategy {
+      type = "Recreate"
+    }
+    selector {
+      match_labels = {
+        app = "registry-mirror"
+      }
+    }
+    template {
+      metadata {
+        labels = {
+          app = "registry-mirror"
+        }
+      }
+      spec {
+        container {
+          name = "registry"
+          image = var.registry_mirror_image
+          env {
+            name = "REGISTRY_PROXY_REMOTEURL"
+            value = var.registry_mirror_remote_url
+          }
+          env {
+            name = "REGISTRY_HTTP_DEBUG_ADDR"
+            value = "0.0.0.0:5001"
+          }
+          env {
+            name = "REGISTRY_HTTP_DEBUG_PROMETHEUS_ENABLED"
+            value = "true"
+          }
+          port {
+            name = "registry"
+            container_port = 5000
+          }
+          port {
+            name = "debug"
+            container_port = 5001
+          }
+          resources {
+            requests = {
+              cpu = "100m"
+              memory = "256Mi"
+            }
+            limits = {
+              memory = "512Mi"
+            }
+          }
+          readiness_probe {
+            http_get {
+              path = "/"
+              port = 5000
+            }
+          }
+          volume_mount {
+            name = "storage"
+            mount_path = "/var/lib/registry"
+          }
+        }
+        volume {
+          name = "storage"
+          host_path {
+            path = "/var/lib/registry-mirror"
+            type = "DirectoryOrCreate"
+          }
+        }
+        toleration {
+          key = "CriticalAddonsOnly"
+          operator = "Exists"
+          effect = "NoExecute"
+        }
+        node_selector = {
+          "node-role.kubernetes.io/control-plane": "true"
+        }
+      }
+    }
+  }
+}
+
+resource "kubernetes_service_v1" "registry_mirror" {
+  count = var.registry_mirror_enabled ? 1 : 0
+  metadata {
+    name = "registry-mirror"
+    namespace = "kube-system"
+    annotations = {
+      "prometheus.io/scrape" = "true"
+      "prometheus.io/port" = "5001"
+      "prometheus.io/path" = "/metrics"
+    }
+  }
+  spec {
+    type = "NodePort"
+    selector = {
+      app = "registry-mirror"
+    }
+    port {
+      name = "registry"
+      port = 5000
+      target_port = 5000
+      node_port = var.registry_mirror_node_port
+    }
+    # cache hits / misses at /debug/vars, prometheus metrics at /metrics
+    port {
+      name = "debug"
+      port = 5001
+      target_port = 5001
+    }
+  }
+}
+
+# nodes created by the autoscaler get the registries config from the autoscaler script,
+# the static nodes are configured over ssh one at a time, restarting rke2 to apply it (rolling, only on nodes where the config changed)
+# each node must be Ready, and for servers its API server /readyz (including etcd) must pass, before the next node is restarted
+# runs after the rest of the stack, so that other resources don't use the API server while it restarts
+# if a node fails the resource is tainted and the next apply continues the roll, already configured nodes are not restarted again
+resource "terraform_data" "registry_mirror_static_nodes" {
+  count = var.registry_mirror_enabled ? 1 : 0
+  depends_on = [
+    kubernetes_service_v1.registry_mirror,
+    kubernetes_deployment_v1.registry_mirror,
+    terraform_data.apply_autoscaler_rbac,
+    kubernetes_secret_v1.autoscaler,
+    kubernetes_deployment_v1.autoscaler,
+    terraform_data.apply_kamatera_controller_rbac,
+    kubernetes_secret_v1.kamatera_controller,
+    kubernetes_deployment_v1.kamatera_controller,
+  ]
+  triggers_replace = {
+    command = <<-EOT
+      set -euo pipefail
+      SSH_CONFIG="${abspath("${path.module}/../ssh_config")}"
+      export KUBECONFIG="${abspath("${path.module}/../.kubeconfig")}"
+      for host in $(awk '$1 == "Host" && $2 != "*" && $2 !~ /-bastion$/ {print $2}' "$SSH_CONFIG"); do
+        node="$${host#${var.name_prefix}-}"
+        echo "Configuring registry mirror on $host"
+        role="$(ssh -F "$SSH_CONFIG" "$host" "
+          set -euo pipefail
+          OLD_CONFIG=\"\$(cat /etc/rancher/rke2/registries-mirror.yaml /etc/rancher/rke2/config.yaml.d/50-registry-mirror.yaml 2>/dev/null || true)\"
+          ${local.registry_mirror_node_script}
+          NEW_CONFIG=\"\$(cat /etc/rancher/rke2/registries-mirror.yaml /etc/rancher/rke2/config.yaml.d/50-registry-mirror.yaml)\"
+          if systemctl is-active --quiet rke2-server.service; then
+            SERVICE=rke2-server
+          else
+            SERVICE=rke2-agent
+          fi
+          if [ \"\$OLD_CONFIG\" != \"\$NEW_CONFIG\" ]; then
+            systemctl restart \$SERVICE.service >&2
+            echo \$SERVICE
+          fi
+        ")"
+        if [ "$role" == "" ]; then
+          echo "Registry mirror already configured on $host"
+          continue
+        fi
+        if [ "$role" == "rke2-server" ]; then
+          context="default@$node"
+          kubectl config get-contexts "$context" >/dev/null 2>&1 || context=default
+          echo "Waiting for the API server on $node to be ready"
+          for i in $(seq 1 60); do
+            if kubectl --context "$context" get --raw /readyz >/dev/null 2>&1; then
+              break
+            elif [ "$i" == "60" ]; then
+              echo "API server on $node is not ready"
+              exit 1
+            fi
+            sleep 10
+          done
+        fi
+        kubectl wait "node/$node" --for=condition=Ready --timeout=600s
+      done
+    EOT
+  }
+  provisioner "local-exec" {
+    command = self.triggers_replace.command
+    interpreter = ["bash", "-c"]
+  }
+}
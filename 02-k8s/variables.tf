@@ -109,6 +109,36 @@ variable "with_bastion" {
   default     = true
 }
 
+variable "rke2_artifact_cache_url" {
+  description = "URL of the RKE2 artifact cache on the private network, autoscaler nodes install RKE2 from it with fallback to upstream"
+  type        = string
+  default     = ""
+}
+
+variable "registry_mirror_enabled" {
+  description = "Deploy a pull-through cache of docker.io images on a controlplane node, all nodes pull through it"
+  type        = bool
+  default     = false
+}
+
+variable "registry_mirror_image" {
+  description = "Image of the registry mirror"
+  type        = string
+  default     = "registry:2"
+}
+
+variable "registry_mirror_remote_url" {
+  description = "Upstream registry of the registry mirror"
+  type        = string
+  default     = "https://registry-1.docker.io"
+}
+
+variable "registry_mirror_node_port" {
+  description = "Node port of the registry mirror, nodes pull from it on localhost"
+  type        = number
+  default     = 30500
+}
+
 variable "kamatera_controller_rbac_url" {
   description = "Optionally, URL for the Kamatera Cloud Controller Manager RBAC manifest"
   type        = string
@@ -22,6 +22,9 @@ fi
 SSS_LOG_FILE_DEFAULT="${ROOT_PATH}/root/server_startup_script.log"
 SSS_LOG_FILE="${SSS_LOG_FILE:-${SSS_LOG_FILE_DEFAULT}}"
 export SSS_LOG_FILE
+# per phase timing records, one JSON line per phase of each attempt
+SSS_TIMING_FILE="${SSS_TIMING_FILE:-${ROOT_PATH}/root/server_startup_script.timing.jsonl}"
+export SSS_TIMING_FILE
 
 function sss_setup_logging {
   mkdir -p "$(dirname "${SSS_LOG_FILE}")" 2>/dev/null || true
@@ -42,6 +45,35 @@ function sss_json_escape {
   printf '%s' "${str}"
 }
 
+function sss_now {
+  date +%s.%3N
+}
+
+function sss_record_phase {
+  local phase="${1}"
+  local start="${2}"
+  local end="${3}"
+  local exit_code="${4}"
+  local host
+  host="$(hostname 2>/dev/null || echo "unknown")"
+  mkdir -p "$(dirname "${SSS_TIMING_FILE}")" 2>/dev/null || true
+  printf '{"host":"%s","node":"%s","role":"%s","attempt":%s,"phase":"%s","start":%s,"end":%s,"duration":%s,"exit_code":%s}\n' \
+    "$(sss_json_escape "${host}")" "$(sss_json_escape "${NODE_NAME:-${host}}")" "${ROLE:-unknown}" "${SSS_ATTEMPT:-0}" \
+    "${phase}" "${start}" "${end}" "$(awk "BEGIN {printf \"%.3f\", ${end} - ${start}}")" "${exit_code}" \
+    >> "${SSS_TIMING_FILE}" 2>/dev/null || true
+}
+
+function sss_phase {
+  # runs the command and records its timing as phase, returns the exit code of the command
+  local phase="${1}"
+  local start
+  local exit_code=0
+  start="$(sss_now)"
+  "${@:2}" || exit_code=$?
+  sss_record_phase "${phase}" "${start}" "$(sss_now)" "${exit_code}"
+  return "${exit_code}"
+}
+
 function sss_slack_notify_failure {
   local exit_code="${1}"
   local webhook_url="${SSS_SLACK_WEBHOOK_URL:-}"
@@ -154,9 +186,128 @@ EOT
     fi
 }
 
+# private network cache of the RKE2 installer and release artifacts, served by the artifact_cache role
+RKE2_ARTIFACT_CACHE_DIR="/var/lib/rke2-artifact-cache"
+RKE2_ARTIFACTS="sha256sum-amd64.txt rke2.linux-amd64.tar.gz rke2-images.linux-amd64.tar.zst"
+
+function resolve_rke2_version {
+  local rke2_version="${1}"
+  if [[ "${rke2_version}" == *+* ]]; then
+    echo "${rke2_version}"
+  else
+    curl -w "%{url_effective}" -L -sSf -o /dev/null "https://update.rke2.io/v1-release/channels/${rke2_version}" | sed -e 's|.*/||'
+  fi
+}
+
+function verify_rke2_artifacts {
+  local artifacts_path="${1}"
+  local sha256sum_file="${2}"
+  for artifact in ${RKE2_ARTIFACTS}; do
+    if [ "${artifact}" != "sha256sum-amd64.txt" ]; then
+      local expected="$(awk -v artifact="${artifact}" '$2 == artifact {print $1}' "${sha256sum_file}")"
+      local actual="$(sha256sum "${artifacts_path}/${artifact}" | awk '{print $1}')"
+      if [ -z "${expected}" ] || [ "${expected}" != "${actual}" ]; then
+        echo "ERROR! Checksum mismatch for ${artifact}"
+        return 1
+      fi
+    fi
+  done
+}
+
+function fill_rke2_artifact_cache {
+  local rke2_version="${1}"
+  local cache_path="${ROOT_PATH}${RKE2_ARTIFACT_CACHE_DIR}"
+  local version
+  version="$(resolve_rke2_version "${rke2_version}")" || return 1
+  if [ -z "${version}" ]; then
+    echo "ERROR! Could not resolve RKE2 version: ${rke2_version}"
+    return 1
+  fi
+  if [ -f "${cache_path}/${version}/sha256sum-amd64.txt" ] && verify_rke2_artifacts "${cache_path}/${version}" "${cache_path}/${version}/sha256sum-amd64.txt"; then
+    echo "RKE2 ${version} artifacts already cached"
+  else
+    echo "Downloading RKE2 ${version} artifacts to ${cache_path}"
+    local partial_path="${cache_path}/.partial"
+    rm -rf "${partial_path}"
+    mkdir -p "${partial_path}/${version}"
+    curl -sfL https://get.rke2.io -o "${partial_path}/install.sh" || return 1
+    for artifact in ${RKE2_ARTIFACTS}; do
+      curl -sfL "https://github.com/rancher/rke2/releases/download/${version}/${artifact}" -o "${partial_path}/${version}/${artifact}" || return 1
+    done
+    verify_rke2_artifacts "${partial_path}/${version}" "${partial_path}/${version}/sha256sum-amd64.txt" || return 1
+    rm -rf "${cache_path}/${version}"
+    mv "${partial_path}/${version}" "${cache_path}/${version}"
+    mv "${partial_path}/install.sh" "${cache_path}/install.sh"
+    rm -rf "${partial_path}"
+  fi
+  # nodes look up the version here, so it is written only after the artifacts are complete
+  mkdir -p "${cache_path}/resolved"
+  echo "${version}" > "${cache_path}/resolved/${rke2_version}"
+}
+
+function download_cached_rke2_artifacts {
+  # on success, sets RKE2_ARTIFACT_VERSION to the cached version
+  local cache_url="${1}"
+  local rke2_version="${2}"
+  local artifacts_path="${3}"
+  local version
+  version="$(curl -sf --connect-timeout 3 "${cache_url}/resolved/${rke2_version}")" || return 1
+  if [ -z "${version}" ]; then
+    return 1
+  fi
+  echo "Downloading RKE2 ${version} artifacts from ${cache_url}"
+  rm -rf "${artifacts_path}"
+  mkdir -p "${artifacts_path}"
+  curl -sf --connect-timeout 3 "${cache_url}/install.sh" -o rke2_install.sh || return 1
+  for artifact in ${RKE2_ARTIFACTS}; do
+    curl -sf --connect-timeout 3 "${cache_url}/${version}/${artifact}" -o "${artifacts_path}/${artifact}" || return 1
+  done
+  # the upstream checksums are small, verifying with them detects a corrupted or tampered cache
+  if curl -sfL --connect-timeout 3 --max-time 15 "https://github.com/rancher/rke2/releases/download/${version}/sha256sum-amd64.txt" -o "${artifacts_path}/sha256sum-upstream.txt"; then
+    mv "${artifacts_path}/sha256sum-upstream.txt" "${artifacts_path}/sha256sum-amd64.txt"
+  else
+    echo "WARNING: Unable to download upstream checksums, verifying with the cached checksums"
+  fi
+  verify_rke2_artifacts "${artifacts_path}" "${artifacts_path}/sha256sum-amd64.txt" || return 1
+  RKE2_ARTIFACT_VERSION="${version}"
+}
+
+function init_artifact_cache {
+    local private_ip_prefix="${1}"
+    local port="${2}"
+    local rke2_version="${3}"
+    local private_ip="$(find_ip_by_prefix "${private_ip_prefix}")"
+    if [ -z "${private_ip}" ]; then
+      echo "ERROR! Could not find private IP with prefix: ${private_ip_prefix}"
+      return 1
+    fi
+    echo "Initializing RKE2 artifact cache on ${private_ip}:${port}"
+    mkdir -p "${ROOT_PATH}${RKE2_ARTIFACT_CACHE_DIR}" "${ROOT_PATH}/etc/systemd/system"
+    cat >"${ROOT_PATH}/etc/systemd/system/rke2-artifact-cache.service" <<EOT
+[Unit]
+Description=RKE2 artifact cache
+After=network-online.target
+
+[Service]
+ExecStart=/usr/bin/python3 -m http.server ${port} --bind ${private_ip} --directory ${RKE2_ARTIFACT_CACHE_DIR}
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+EOT
+    if dry_run; then
+      echo "Dry run: would enable and restart rke2-artifact-cache.service"
+    else
+      systemctl daemon-reload || return 1
+      systemctl enable rke2-artifact-cache.service || return 1
+      systemctl restart rke2-artifact-cache.service || return 1
+    fi
+    sss_phase artifact_cache_fill fill_rke2_artifact_cache "${rke2_version}" || return 1
+}
+
 function init_bastion {
     local bastion_public_port="${1}"
-    init_ssh "0.0.0.0" "${bastion_public_port}" || return 1
+    sss_phase init_ssh init_ssh "0.0.0.0" "${bastion_public_port}" || return 1
 }
 
 function set_rke2_node_settings {
@@ -175,7 +326,7 @@ EOF
     if dry_run; then
       echo "Dry run: would apply sysctl settings"
     else
-      sysctl --system || return 1
+      sss_phase sysctl sysctl --system || return 1
     fi
     rm -f "${ROOT_PATH}/etc/systemd/system/systemd-networkd-wait-online.service.d/override.conf"
     if dry_run; then
@@ -198,18 +349,24 @@ export KUBECONFIG="/etc/rancher/rke2/rke2.yaml"
 EOF
 }
 
-function verify_rke2 {
-  echo "Verifying RKE2 installation"
-  export PATH="/var/lib/rancher/rke2/bin/:$PATH"
-  local calico_kubeconfig=/etc/cni/net.d/calico-kubeconfig
+function wait_for_calico_kubeconfig {
+  local calico_kubeconfig="${1}"
   for i in {1..120}; do
     if [ -f "${calico_kubeconfig}" ]; then
-      break
+      return 0
     else
       echo "Waiting for Calico kubeconfig to be created..."
       sleep 1
     fi
   done
+  return 1
+}
+
+function verify_rke2 {
+  echo "Verifying RKE2 installation"
+  export PATH="/var/lib/rancher/rke2/bin/:$PATH"
+  local calico_kubeconfig=/etc/cni/net.d/calico-kubeconfig
+  sss_phase calico_wait wait_for_calico_kubeconfig "${calico_kubeconfig}" || true
   if ! [ -f "${calico_kubeconfig}" ]; then
     echo "ERROR! Calico kubeconfig file not found after 2 minutes."
     return 1
@@ -225,6 +382,16 @@ function verify_rke2 {
   echo "RKE2 installation verified successfully"
 }
 
+function start_rke2_service {
+    local rke2_type="${1}"
+    if systemctl is-active --quiet "rke2-${rke2_type}.service"; then
+      systemctl restart "rke2-${rke2_type}.service" || return 1
+    else
+      systemctl enable "rke2-${rke2_type}.service" || return 1
+      systemctl start "rke2-${rke2_type}.service" || return 1
+    fi
+}
+
 function init_rke2 {
     local private_ip_prefix="${1}"
     local ssh_port="${2}"
@@ -233,7 +400,7 @@ function init_rke2 {
     local rke2_config_b64="${5}"
     local with_bastion="${6}"
     local private_ip="$(find_ip_by_prefix "${private_ip_prefix}")"
-    local public_ip="$(find_public_ip)"
+    local public_ip="$(sss_phase find_public_ip find_public_ip)"
     if [ -z "${private_ip}" ]; then
       echo "ERROR! Could not find private IP with prefix: ${private_ip_prefix}"
       return 1
@@ -249,8 +416,8 @@ function init_rke2 {
     else
       local ssh_ip="0.0.0.0"
     fi
-    init_ssh "${ssh_ip}" "${ssh_port}" || return 1
-    set_rke2_node_settings || return 1
+    sss_phase init_ssh init_ssh "${ssh_ip}" "${ssh_port}" || return 1
+    sss_phase node_settings set_rke2_node_settings || return 1
     echo "Installing RKE2 type=${rke2_type} version=${rke2_version}"
     mkdir -p "${ROOT_PATH}/etc/rancher/rke2"
     export PRIVATE_IP="${private_ip}"
@@ -262,19 +429,31 @@ function init_rke2 {
     else
       export INSTALL_RKE2_CHANNEL="${rke2_version}"
     fi
+    local artifacts_path="${ROOT_PATH}/var/lib/rancher/rke2-artifacts"
+    if [ -n "${SSS_ARTIFACT_CACHE_URL:-}" ] && sss_phase rke2_cache_download download_cached_rke2_artifacts "${SSS_ARTIFACT_CACHE_URL}" "${rke2_version}" "${artifacts_path}"; then
+      echo "Installing RKE2 ${RKE2_ARTIFACT_VERSION} from artifact cache ${SSS_ARTIFACT_CACHE_URL}"
+      export INSTALL_RKE2_ARTIFACT_PATH="${artifacts_path}"
+      export INSTALL_RKE2_VERSION="${RKE2_ARTIFACT_VERSION}"
+      unset INSTALL_RKE2_CHANNEL
+    else
+      if [ -n "${SSS_ARTIFACT_CACHE_URL:-}" ]; then
+        echo "WARNING: RKE2 artifact cache is not available, installing from upstream"
+      fi
+      rm -rf "${artifacts_path}"
+      unset INSTALL_RKE2_ARTIFACT_PATH
+      if dry_run; then
+        echo "Dry run: would download RKE2 installer"
+      else
+        sss_phase rke2_download bash -c "curl -sfL https://get.rke2.io > rke2_install.sh" || return 1
+      fi
+    fi
     if dry_run; then
       echo "Dry run: would install RKE2"
     else
-      curl -sfL https://get.rke2.io > rke2_install.sh || return 1
       chmod +x rke2_install.sh
-      ./rke2_install.sh || return 1
-      if systemctl is-active --quiet "rke2-${rke2_type}.service"; then
-        systemctl restart "rke2-${rke2_type}.service" || return 1
-      else
-        systemctl enable "rke2-${rke2_type}.service" || return 1
-        systemctl start "rke2-${rke2_type}.service" || return 1
-      fi
-      verify_rke2 || return 1
+      sss_phase rke2_install ./rke2_install.sh || return 1
+      sss_phase rke2_service_start start_rke2_service "${rke2_type}" || return 1
+      sss_phase verify_rke2 verify_rke2 || return 1
     fi
 }
 
@@ -283,6 +462,8 @@ if [ "${ROLE}" == "bastion" ]; then
   init_func="init_bastion"
 elif [ "${ROLE}" == "rke2" ]; then
   init_func="init_rke2"
+elif [ "${ROLE}" == "artifact_cache" ]; then
+  init_func="init_artifact_cache"
 fi
 if [ "${init_func}" == "" ]; then
   echo "ERROR! Unknown role: ${ROLE}"
@@ -294,7 +475,7 @@ retries=${SSS_RETRIES:-5}
 export SSS_RETRIES="${retries}"
 for ((i=1; i<=retries; i++)); do
   export SSS_ATTEMPT="${i}"
-  if $init_func "${@:2}"; then
+  if sss_phase attempt $init_func "${@:2}"; then
     initialized=true
     break
   else
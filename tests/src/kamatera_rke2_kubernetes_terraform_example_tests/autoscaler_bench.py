@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import datetime
+import threading
+import dataclasses
+
+from ruamel.yaml import YAML
+
+from . import util, k8s_api, inventory
+
+
+yaml = YAML(typ='safe', pure=True)
+
+# phase times are seconds from the scale-up trigger (demo deployment applied)
+SCALE_UP_PHASES = ["pod_pending", "server_created", "node_registered", "node_ready", "pod_running", "all_pods_running"]
+# phase times are seconds from the scale-down trigger (demo deployment scaled to 0)
+# server_stopped is either terminated or powered off (with CA_POWEROFF_ON_SCALE_DOWN)
+SCALE_DOWN_PHASES = ["node_cordoned", "server_stopped", "node_deleted", "scaled_down"]
+PHASES = SCALE_UP_PHASES + SCALE_DOWN_PHASES
+
+
+def is_node_ready(node):
+    return any(
+        condition["type"] == "Ready" and condition["status"] == "True"
+        for condition in node.get("status", {}).get("conditions", [])
+    )
+
+
+def is_kubelet_reporting(node):
+    # the node controller sets the Ready condition to Unknown when the kubelet stops posting status, e.g. a powered off server
+    return any(
+        condition["type"] == "Ready" and condition["status"] in ("True", "False")
+        for condition in node.get("status", {}).get("conditions", [])
+    )
+
+
+@dataclasses.dataclass
+class Cycle:
+    replicas: int
+    baseline_nodes: dict  # autoscaler node name -> is ready
+    baseline_servers: dict  # autoscaler server name -> power
+    # baseline nodes of powered off servers, with CA_POWERON_ON_SCALE_UP they register again when their server is powered on
+    stopped_nodes: set = dataclasses.field(default_factory=set)
+    scale_up_time: float = None
+    scale_down_time: float = None
+    phases: dict = dataclasses.field(default_factory=dict)
+    nodes: dict = dataclasses.field(default_factory=dict)
+    pods: dict = dataclasses.field(default_factory=dict)
+    seen_nodes: set = dataclasses.field(default_factory=set)
+    powered_on_servers: set = dataclasses.field(default_factory=set)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def mark(self, phase, now=None):
+        # only the first occurrence of each phase is recorded
+        now = now or time.time()
+        start_time = self.scale_down_time if phase in SCALE_DOWN_PHASES else self.scale_up_time
+        if start_time is not None and phase not in self.phases:
+            self.phases[phase] = round(now - start_time, 3)
+
+    def observe_nodes(self, nodes, now=None):
+        with self.lock:
+            self.nodes = {node["metadata"]["name"]: node for node in nodes}
+            self.seen_nodes |= self.nodes.keys()
+            if self.scale_down_time is None:
+                for name, node in self.nodes.items():
+                    if name not in self.baseline_nodes or (name in self.stopped_nodes and is_kubelet_reporting(node)):
+                        self.mark("node_registered", now)
+                        if is_node_ready(node):
+                            self.mark("node_ready", now)
+            else:
+                if any(node.get("spec", {}).get("unschedulable") for node in self.nodes.values()):
+                    self.mark("node_cordoned", now)
+                if self.seen_nodes - self.nodes.keys():
+                    self.mark("node_deleted", now)
+                if self.is_scaled_down():
+                    self.mark("scaled_down", now)
+
+    def observe_pods(self, pods, now=None):
+        with self.lock:
+            self.pods = {pod["metadata"]["name"]: pod for pod in pods}
+            if self.scale_down_time is not None:
+                return
+            phases = [pod.get("status", {}).get("phase") for pod in self.pods.values()]
+            if "Pending" in phases:
+                self.mark("pod_pending", now)
+            if "Running" in phases:
+                self.mark("pod_running", now)
+            if self.is_scaled_up():
+                self.mark("all_pods_running", now)
+
+    def observe_servers(self, servers, now=None):
+        # with CA_POWERON_ON_SCALE_UP a powered off server is powered on instead of creating a new one
+        with self.lock:
+            powered_on = {server["name"] for server in servers if server.get("power") != "off"}
+            if self.scale_down_time is None:
+                if any(self.baseline_servers.get(name) in (None, "off") for name in powered_on):
+                    self.mark("server_created", now)
+            elif self.powered_on_servers - powered_on:
+                self.mark("server_stopped", now)
+            self.powered_on_servers |= powered_on
+
+    def is_scaled_up(self):
+        return len(self.pods) == self.replicas and all(
+            pod.get("status", {}).get("phase") == "Running" for pod in self.pods.values()
+        )
+
+    def is_scaled_down(self):
+        # with min-size > 0 some nodes remain, scale down is complete once the ready autoscaler nodes are back to the baseline
+        ready_nodes = sum(1 for node in self.nodes.values() if is_node_ready(node))
+        return self.scale_down_time is not None and ready_nodes <= sum(self.baseline_nodes.values())
+
+
+def get_summary(cycles, labels=None):
+    summary = {
+        "labels": labels or {},
+        "cycles": [cycle.phases for cycle in cycles],
+        "phases": {},
+    }
+    for phase in PHASES:
+        values = [cycle.phases[phase] for cycle in cycles if phase in cycle.phases]
+        summary["phases"][phase] = {
+            "count": len(values),
+            **{f"p{p}": util.percentile(values, p) for p in (50, 90, 95, 99)},
+            "max": max(values) if values else None,
+        }
+    return summary
+
+
+def get_demo_app_objects(replicas):
+    with open(os.path.join(os.path.dirname(__file__), "k8s_demo_app.yaml")) as f:
+        objects = [obj for obj in yaml.load_all(f) if obj["kind"] in ("Namespace", "Deployment")]
+    for obj in objects:
+        if obj["kind"] == "Deployment":
+            obj["spec"]["replicas"] = replicas
+            obj["spec"]["template"]["spec"]["nodeSelector"] = {"role": "autoscaler"}
+    return objects
+
+
+def get_labels(client):
+    # the settings which affect autoscaler latency, so that benchmark runs can be compared
+    labels = {
+        "CA_POWERON_ON_SCALE_UP": os.getenv("CA_POWERON_ON_SCALE_UP") == "yes",
+        "CA_POWEROFF_ON_SCALE_DOWN": os.getenv("CA_POWEROFF_ON_SCALE_DOWN") == "yes",
+    }
+    try:
+        deployment = client.get("deployments", "cluster-autoscaler", "kube-system")
+    except k8s_api.ApiError:
+        pass
+    else:
+        labels["ca_args"] = [
+            arg for container in deployment["spec"]["template"]["spec"]["containers"]
+            for arg in [*container.get("command", []), *container.get("args", [])]
+            if arg.startswith("--scale-down-") or arg.startswith("--max-node-provision-time")
+        ]
+    return labels
+
+
+def run_cycle(client, name_prefix, replicas, timeout_seconds, server_poll_seconds, print_function=print):
+    nodes = client.list("nodes", label_selector="role=autoscaler")["items"]
+    cycle = Cycle(
+        replicas,
+        {node["metadata"]["name"]: is_node_ready(node) for node in nodes},
+        {server["name"]: server.get("power") for server in inventory.list_servers(f"{name_prefix}-autoscaler-", ttl_seconds=0)},
+        {node["metadata"]["name"] for node in nodes if not is_kubelet_reporting(node)},
+    )
+    stop_event = threading.Event()
+    errors = []
+
+    def watch(resource, namespace, label_selector, observe):
+        try:
+            for event_type, obj, objects in k8s_api.watch_objects(client, resource, namespace, label_selector, stop_event=stop_event):
+                observe(list(objects.values()))
+        except Exception as e:
+            errors.append(e)
+
+    def poll_servers():
+        while not stop_event.is_set():
+            try:
+                cycle.observe_servers(inventory.list_servers(f"{name_prefix}-autoscaler-", ttl_seconds=0))
+            except Exception as e:
+                print_function(f'failed to list servers: {e}')
+            stop_event.wait(server_poll_seconds)
+
+    def check(condition):
+        assert not errors, errors
+        with cycle.lock:
+            return condition()
+
+    threads = [
+        threading.Thread(target=watch, args=("nodes", None, "role=autoscaler", cycle.observe_nodes), daemon=True),
+        threading.Thread(target=watch, args=("pods", "demo", None, cycle.observe_pods), daemon=True),
+        threading.Thread(target=poll_servers, daemon=True),
+    ]
+    try:
+        # observations are ignored until the scale-up time is set
+        for thread in threads:
+            thread.start()
+        with cycle.lock:
+            cycle.scale_up_time = time.time()
+        for obj in get_demo_app_objects(replicas):
+            client.apply(obj)
+        util.wait_for(
+            f"{replicas} demo pods running on autoscaler nodes", lambda: check(cycle.is_scaled_up),
+            timeout_seconds=timeout_seconds, poll_seconds=1, progress=None, print_function=print_function
+        )
+        with cycle.lock:
+            cycle.scale_down_time = time.time()
+        client.scale("deployments", "demo", 0, "demo")
+        util.wait_for(
+            "autoscaler nodes scaled down", lambda: check(cycle.is_scaled_down),
+            timeout_seconds=timeout_seconds, poll_seconds=1, progress=None, print_function=print_function
+        )
+        # give the server poller a chance to observe the server termination, the phase is left empty if it doesn't
+        try:
+            util.wait_for(
+                "autoscaler server stopped", lambda: check(lambda: "server_stopped" in cycle.phases),
+                timeout_seconds=server_poll_seconds * 3, poll_seconds=1, progress=None, print_function=print_function
+            )
+        except AssertionError:
+            print_function('autoscaler server stop was not observed')
+    finally:
+        stop_event.set()
+    return cycle
+
+
+def main(name_prefix, cycles=3, replicas=2, timeout_seconds=3600, server_poll_seconds=10, output=None, label=None, print_function=print):
+    client = k8s_api.get_client(util.get_kubeconfig())
+    labels = {**get_labels(client), **dict(l.split("=", 1) for l in (label or []))}
+    print_function(f'Benchmarking {cycles} autoscaler cycles of {replicas} demo pods: {json.dumps(labels)}')
+    autoscaler_replicas = client.get("deployments", "cluster-autoscaler", "kube-system")["spec"]["replicas"]
+    client.scale("deployments", "cluster-autoscaler", 1, "kube-system")
+    results = []
+    try:
+        for i in range(cycles):
+            print_function(f'cycle {i + 1}/{cycles} start time: {datetime.datetime.now().isoformat()}')
+            cycle = run_cycle(client, name_prefix, replicas, timeout_seconds, server_poll_seconds, print_function)
+            print_function(f'cycle {i + 1}/{cycles}: {json.dumps(cycle.phases)}')
+            results.append(cycle)
+    finally:
+        # leave the cluster as it was, the autoscaler nodes are scaled down by the autoscaler once the demo namespace is deleted
+        client.delete("namespaces", "demo", ignore_not_found=True)
+        if autoscaler_replicas != 1:
+            client.scale("deployments", "cluster-autoscaler", autoscaler_replicas, "kube-system")
+    summary = get_summary(results, labels)
+    if output:
+        with open(output, "w") as f:
+            json.dump(summary, f, indent=2)
+    print_function(json.dumps(summary, indent=2))
+    return summary
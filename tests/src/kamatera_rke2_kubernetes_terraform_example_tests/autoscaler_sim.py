@@ -0,0 +1,387 @@
+import re
+import json
+import random
+import dataclasses
+
+from . import util
+
+
+# cluster autoscaler defaults for the flags which affect scale up / scale down timing
+DEFAULT_FLAGS = {
+    "scan-interval": "10s",
+    "scale-down-unneeded-time": "10m",
+    "scale-down-delay-after-add": "10m",
+    "scale-down-utilization-threshold": "0.5",
+    "initial-node-group-backoff-duration": "5m",
+    "max-node-group-backoff-duration": "30m",
+    "node-group-backoff-reset-timeout": "3h",
+    "max-node-provision-time": "15m",
+}
+
+DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(h|ms|m|s)')
+DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+MEMORY_UNITS = {"Ki": 1 / 1024, "Mi": 1, "Gi": 1024, "Ti": 1024 * 1024, "K": 1 / 1000, "M": 1, "G": 1000}
+
+
+def parse_duration(value):
+    # go duration string (e.g. 5m, 1h30m, 10s) to seconds
+    seconds = sum(float(number) * DURATION_UNITS[unit] for number, unit in DURATION_RE.findall(value))
+    assert seconds or value.strip("0") == "", f"invalid duration: {value}"
+    return seconds
+
+
+def parse_cpu(value):
+    # kubernetes cpu quantity (500m, 2) or kamatera cpu (2B = 2 cores of type B) to cores
+    value = str(value).strip()
+    if value.endswith("m"):
+        return int(value[:-1]) / 1000
+    return float(value.rstrip("ABDT"))
+
+
+def parse_memory(value):
+    # kubernetes memory quantity (512Mi, 1Gi) to MB, plain numbers are MB like the kamatera ram setting
+    value = str(value).strip()
+    for unit, mb in MEMORY_UNITS.items():
+        if value.endswith(unit):
+            return float(value[:-len(unit)]) * mb
+    return float(value)
+
+
+def parse_ini(text):
+    # the cloud-config format used by the kamatera cloud provider: sections with key = value, keys may repeat
+    sections = {}
+    section = sections.setdefault("global", {})
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(("#", ";")):
+            continue
+        match = re.match(r'^\[(\w+)(?:\s+"([^"]+)")?\]$', line)
+        if match:
+            section = sections.setdefault(match.group(2) or match.group(1), {})
+            continue
+        key, _, value = line.partition("=")
+        section.setdefault(key.strip(), []).append(value.strip().strip('"'))
+    return sections
+
+
+@dataclasses.dataclass
+class NodeGroup:
+    name: str
+    min_size: int
+    max_size: int
+    cpu: float
+    ram: float
+    labels: dict
+
+    @classmethod
+    def from_config(cls, name, config):
+        # config is the parsed ini section of the nodegroup, values are lists
+        return cls(
+            name=name,
+            min_size=int(config.get("min-size", ["0"])[-1]),
+            max_size=int(config.get("max-size", ["10"])[-1]),
+            cpu=parse_cpu(config.get("cpu", ["1A"])[-1]),
+            ram=parse_memory(config.get("ram", ["1024"])[-1]),
+            labels=dict(label.split("=", 1) for label in config.get("template-label", [])),
+        )
+
+
+def parse_nodegroup_configs(nodegroup_configs):
+    # nodegroup name -> ini fragment, as in K8STfvarsConfig.ca_nodegroup_configs / cluster_autoscaler_nodegroup_configs
+    return [NodeGroup.from_config(name, parse_ini(config)["global"]) for name, config in sorted(nodegroup_configs.items())]
+
+
+def parse_cloud_config(cloud_config):
+    # the rendered cloud-config secret (02-k8s/autoscaler.tf)
+    return [NodeGroup.from_config(name, config) for name, config in parse_ini(cloud_config).items() if name != "global"]
+
+
+def parse_flags(extra_args):
+    flags = dict(DEFAULT_FLAGS)
+    for arg in extra_args or []:
+        key, _, value = arg.lstrip("-").partition("=")
+        flags[key] = value or "true"
+    return {
+        key: float(value) if key == "scale-down-utilization-threshold" else parse_duration(value)
+        for key, value in flags.items() if key in DEFAULT_FLAGS
+    }
+
+
+@dataclasses.dataclass
+class Node:
+    name: str
+    nodegroup: str
+    cpu: float
+    ram: float
+    labels: dict
+    created_time: float
+    ready_time: float = None
+    deleting_time: float = None
+    deleted_time: float = None
+    failed: bool = False
+    unneeded_since: float = None
+
+    def is_ready(self, now):
+        return not self.failed and self.ready_time is not None and self.ready_time <= now and self.deleting_time is None
+
+
+@dataclasses.dataclass
+class Pod:
+    name: str
+    deployment: str
+    cpu: float
+    ram: float
+    node_selector: dict
+    anti_affinity: bool
+    created_time: float
+    scheduled_time: float = None
+    node: str = None
+    deleted_time: float = None
+
+
+def get_demo_trace(replicas=2, scale_down_after_seconds=1800):
+    # the demo app test: demo pods with anti-affinity on autoscaler nodes, scaled to 0 after the cluster is stable
+    demo = {"deployment": "demo", "cpu": "100m", "memory": "128Mi", "node_selector": {"role": "autoscaler"}, "anti_affinity": True}
+    return [{"time": 0, "replicas": replicas, **demo}, {"time": scale_down_after_seconds, "replicas": 0, **demo}]
+
+
+class Simulator:
+    # discrete time simulation of the cluster autoscaler loop, one step per scan interval
+
+    def __init__(self, nodegroups, flags, provision_seconds=300, delete_seconds=60, provision_failure_rate=0, seed=0):
+        self.nodegroups = {nodegroup.name: nodegroup for nodegroup in nodegroups}
+        self.flags = flags
+        self.provision_seconds = provision_seconds
+        self.delete_seconds = delete_seconds
+        self.provision_failure_rate = provision_failure_rate
+        self.random = random.Random(seed)
+        self.nodes = []
+        self.pods = []
+        self.deployments = {}
+        self.events = []
+        self.backoff = {}  # nodegroup -> (backoff until, backoff duration, last failure time)
+        self.last_scale_up_time = None
+        self.peak_nodes = 0
+        self.node_counter = 0
+        for nodegroup in nodegroups:
+            for _ in range(nodegroup.min_size):
+                self.add_node(nodegroup, 0, ready_time=0)
+
+    def log(self, now, message):
+        self.events.append((now, message))
+
+    def add_node(self, nodegroup, now, ready_time=None):
+        self.node_counter += 1
+        node = Node(f'{nodegroup.name}-{self.node_counter}', nodegroup.name, nodegroup.cpu, nodegroup.ram, nodegroup.labels, now, ready_time)
+        self.nodes.append(node)
+        return node
+
+    def get_live_nodes(self, nodegroup=None):
+        return [node for node in self.nodes if node.deleted_time is None and not node.failed and (not nodegroup or node.nodegroup == nodegroup)]
+
+    def get_node_pods(self, node):
+        return [pod for pod in self.pods if pod.node == node.name and pod.deleted_time is None]
+
+    def fits(self, pod, node, node_pods):
+        return (
+            all(node.labels.get(key) == value for key, value in pod.node_selector.items())
+            and sum(p.cpu for p in node_pods) + pod.cpu <= node.cpu
+            and sum(p.ram for p in node_pods) + pod.ram <= node.ram
+            and not (pod.anti_affinity and any(p.deployment == pod.deployment for p in node_pods))
+        )
+
+    def set_replicas(self, event, now):
+        deployment = event["deployment"]
+        pods = [pod for pod in self.pods if pod.deployment == deployment and pod.deleted_time is None]
+        for pod in pods[event["replicas"]:]:
+            pod.deleted_time = now
+        for i in range(len(pods), event["replicas"]):
+            self.deployments[deployment] = self.deployments.get(deployment, 0) + 1
+            self.pods.append(Pod(
+                f'{deployment}-{self.deployments[deployment]}', deployment, parse_cpu(event.get("cpu", "0")),
+                parse_memory(event.get("memory", "0")), event.get("node_selector") or {}, bool(event.get("anti_affinity")), now
+            ))
+        self.log(now, f'deployment {deployment} scaled to {event["replicas"]} replicas')
+
+    def schedule(self, now):
+        ready_nodes = [node for node in self.get_live_nodes() if node.is_ready(now)]
+        for pod in self.pods:
+            if pod.node is None and pod.deleted_time is None:
+                node = next((node for node in ready_nodes if self.fits(pod, node, self.get_node_pods(node))), None)
+                if node:
+                    pod.node, pod.scheduled_time = node.name, now
+
+    def update_nodes(self, now):
+        for node in self.nodes:
+            if node.deleting_time is not None and node.deleted_time is None and now - node.deleting_time >= self.delete_seconds:
+                node.deleted_time = now
+                self.log(now, f'node {node.name} deleted')
+            elif node.failed and node.deleted_time is None and now >= node.ready_time:
+                # failed servers are removed by the autoscaler once the provisioning timed out
+                node.deleted_time = now
+                self.set_backoff(node.nodegroup, now)
+                self.log(now, f'node {node.name} failed to provision, nodegroup {node.nodegroup} backed off')
+
+    def set_backoff(self, nodegroup, now):
+        _, duration, last_failure_time = self.backoff.get(nodegroup, (None, None, None))
+        if duration is None or now - last_failure_time > self.flags["node-group-backoff-reset-timeout"]:
+            duration = self.flags["initial-node-group-backoff-duration"]
+        else:
+            duration = min(duration * 2, self.flags["max-node-group-backoff-duration"])
+        self.backoff[nodegroup] = (now + duration, duration, now)
+
+    def scale_up(self, now):
+        pending = [pod for pod in self.pods if pod.node is None and pod.deleted_time is None]
+        if not pending:
+            return
+        # pending pods are first assigned to nodes which are still provisioning, the rest to new nodes
+        upcoming = {node.name: [] for node in self.get_live_nodes() if not node.is_ready(now) and node.deleting_time is None}
+        upcoming_nodes = [node for node in self.get_live_nodes() if node.name in upcoming]
+        new_nodes = {}
+        for pod in pending:
+            upcoming_node = next((node for node in upcoming_nodes if self.fits(pod, node, upcoming[node.name])), None)
+            if upcoming_node:
+                upcoming[upcoming_node.name].append(pod)
+                continue
+            for nodegroup in self.nodegroups.values():
+                if self.backoff.get(nodegroup.name, (0,))[0] > now:
+                    continue
+                template = Node("template", nodegroup.name, nodegroup.cpu, nodegroup.ram, nodegroup.labels, now)
+                if not self.fits(pod, template, []):
+                    continue
+                group_new_nodes = new_nodes.setdefault(nodegroup.name, [])
+                target = next((pods for pods in group_new_nodes if self.fits(pod, template, pods)), None)
+                if target is not None:
+                    target.append(pod)
+                    break
+                if len(self.get_live_nodes(nodegroup.name)) + len(group_new_nodes) < nodegroup.max_size:
+                    group_new_nodes.append([pod])
+                    break
+        for name, group_new_nodes in new_nodes.items():
+            if not group_new_nodes:
+                continue
+            self.last_scale_up_time = now
+            self.log(now, f'scale up nodegroup {name} by {len(group_new_nodes)} nodes')
+            for _ in group_new_nodes:
+                if self.random.random() < self.provision_failure_rate:
+                    node = self.add_node(self.nodegroups[name], now, ready_time=now + self.flags["max-node-provision-time"])
+                    node.failed = True
+                else:
+                    self.add_node(self.nodegroups[name], now, ready_time=now + self.provision_seconds)
+
+    def scale_down(self, now):
+        if self.last_scale_up_time is not None and now - self.last_scale_up_time < self.flags["scale-down-delay-after-add"]:
+            return
+        ready_nodes = [node for node in self.get_live_nodes() if node.is_ready(now)]
+        for node in ready_nodes:
+            pods = self.get_node_pods(node)
+            utilization = max(sum(p.cpu for p in pods) / node.cpu, sum(p.ram for p in pods) / node.ram)
+            # pods of an unneeded node must fit on the other ready nodes
+            other_nodes = [n for n in ready_nodes if n is not node and n.unneeded_since is None]
+            movable = all(any(self.fits(pod, n, self.get_node_pods(n)) for n in other_nodes) for pod in pods)
+            if utilization < self.flags["scale-down-utilization-threshold"] and movable:
+                if node.unneeded_since is None:
+                    node.unneeded_since = now
+            else:
+                node.unneeded_since = None
+        for nodegroup in self.nodegroups.values():
+            candidates = [
+                node for node in ready_nodes
+                if node.nodegroup == nodegroup.name and node.unneeded_since is not None
+                and now - node.unneeded_since >= self.flags["scale-down-unneeded-time"]
+            ]
+            removable = max(0, len([n for n in self.get_live_nodes(nodegroup.name) if n.deleting_time is None]) - nodegroup.min_size)
+            # empty nodes are deleted in bulk, non-empty nodes one at a time
+            empty = [node for node in candidates if not self.get_node_pods(node)]
+            non_empty = [node for node in candidates if node not in empty]
+            to_delete = empty[:removable] or non_empty[:min(1, removable)]
+            for node in to_delete:
+                for pod in self.get_node_pods(node):
+                    pod.node, pod.scheduled_time = None, None
+                node.deleting_time = now
+                self.log(now, f'scale down node {node.name}')
+
+    def run(self, trace, duration_seconds=None):
+        trace = sorted(trace, key=lambda event: event["time"])
+        scan_interval = self.flags["scan-interval"]
+        duration_seconds = duration_seconds or (trace[-1]["time"] if trace else 0) + 3600
+        now = 0
+        while now <= duration_seconds:
+            while trace and trace[0]["time"] <= now:
+                self.set_replicas(trace.pop(0), now)
+            self.update_nodes(now)
+            self.schedule(now)
+            self.scale_up(now)
+            self.scale_down(now)
+            self.peak_nodes = max(self.peak_nodes, len([node for node in self.nodes if node.deleted_time is None]))
+            now += scan_interval
+        return self.get_summary(duration_seconds)
+
+    def get_summary(self, end_time):
+        latencies = [pod.scheduled_time - pod.created_time for pod in self.pods if pod.scheduled_time is not None]
+        return {
+            "node_hours": round(sum((node.deleted_time if node.deleted_time is not None else end_time) - node.created_time for node in self.nodes) / 3600, 3),
+            "node_hours_by_nodegroup": {
+                name: round(sum(
+                    (node.deleted_time if node.deleted_time is not None else end_time) - node.created_time
+                    for node in self.nodes if node.nodegroup == name
+                ) / 3600, 3) for name in self.nodegroups
+            },
+            "peak_nodes": self.peak_nodes,
+            "final_nodes": len([node for node in self.nodes if node.deleted_time is None]),
+            "failed_provisions": len([node for node in self.nodes if node.failed]),
+            "pods": len(self.pods),
+            "unscheduled_pods": len([pod for pod in self.pods if pod.scheduled_time is None and pod.deleted_time is None]),
+            "pending_seconds": {
+                **{f"p{p}": util.percentile(latencies, p) for p in (50, 90, 95, 99)},
+                "max": max(latencies) if latencies else None,
+            },
+        }
+
+
+def load_nodegroups(tfvars=None, cloud_config=None):
+    # defaults to the nodegroups of the demo app test
+    # returns the nodegroups and the autoscaler extra args
+    if cloud_config:
+        with open(cloud_config) as f:
+            return parse_cloud_config(f.read()), []
+    elif tfvars:
+        with open(tfvars) as f:
+            tfvars = json.load(f)
+        return parse_nodegroup_configs(tfvars.get("cluster_autoscaler_nodegroup_configs") or {}), tfvars.get("cluster_autoscaler_extra_args")
+    else:
+        from . import k8s_demo_app
+        k8s_tfvars_config = k8s_demo_app.get_k8s_tfvars(None, 1)
+        return parse_nodegroup_configs(k8s_tfvars_config.ca_nodegroup_configs), k8s_tfvars_config.ca_extra_args
+
+
+def get_timing_from_bench_summary(bench_summary):
+    # provision / delete times measured by bench-autoscaler
+    with open(bench_summary) as f:
+        phases = json.load(f)["phases"]
+    return phases["node_ready"]["p50"], phases["node_deleted"]["p50"]
+
+
+def main(
+    trace=None, tfvars=None, cloud_config=None, extra_arg=None, provision_seconds=300, delete_seconds=60,
+    bench_summary=None, provision_failure_rate=0, duration_seconds=None, output=None
+):
+    nodegroups, extra_args = load_nodegroups(tfvars, cloud_config)
+    flags = parse_flags([*(extra_args or []), *(extra_arg or [])])
+    if bench_summary:
+        provision_seconds, delete_seconds = get_timing_from_bench_summary(bench_summary)
+    if trace:
+        with open(trace) as f:
+            trace = json.load(f)
+    else:
+        trace = get_demo_trace()
+    print(f'Simulating {len(trace)} workload events on nodegroups: {", ".join(f"{ng.name} ({ng.min_size}-{ng.max_size} x {ng.cpu:g} cpu {ng.ram:g}MB)" for ng in nodegroups)}')
+    simulator = Simulator(nodegroups, flags, provision_seconds, delete_seconds, provision_failure_rate)
+    summary = simulator.run(trace, duration_seconds)
+    for event_time, message in simulator.events:
+        print(f'  {event_time:8.0f}s {message}')
+    print(json.dumps(summary, indent=2))
+    if output:
+        with open(output, "w") as f:
+            json.dump(summary, f, indent=2)
+    return summary
@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import shlex
+import shutil
+import tempfile
+import threading
+import subprocess
+import concurrent.futures
+
+from . import config
+
+
+SSH_OPTIONS = [
+    "-o", "StrictHostKeyChecking=no",
+    "-o", "UserKnownHostsFile=/dev/null",
+    "-o", "BatchMode=yes",
+    "-o", "ConnectTimeout=3",
+    "-o", "ServerAliveInterval=15",
+    "-o", "LogLevel=ERROR",
+]
+
+_print_lock = threading.Lock()
+
+
+def print_prefixed(prefix, line, print_function=print):
+    with _print_lock:
+        print_function(f'[{prefix}] {line}')
+
+
+class SSHConnection:
+    # ssh connection multiplexed over a control master, the handshake is done once and all commands reuse it
+
+    def __init__(self, name, host, port, control_dir, proxy=None, user="root"):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.user = user
+        self.proxy = proxy
+        # unix socket paths are limited to ~100 characters, so the control dir should be short
+        self.control_path = os.path.join(control_dir, name)
+
+    def get_args(self, *options, command=None):
+        proxy_args = ["-o", f"ProxyCommand={self.proxy.get_forward_command()}"] if self.proxy else []
+        return [
+            "ssh", *SSH_OPTIONS, "-o", f"ControlPath={self.control_path}", *proxy_args, "-p", str(self.port), *options,
+            f"{self.user}@{self.host}", *([command] if command else [])
+        ]
+
+    def get_forward_command(self):
+        # stdio forwarding over the existing master connection, used as ProxyCommand for connections to nodes behind it
+        return shlex.join(["ssh", *SSH_OPTIONS, "-o", f"ControlPath={self.control_path}", "-p", str(self.port), "-W", "%h:%p", f"{self.user}@{self.host}"])
+
+    def open(self):
+        return subprocess.run(
+            self.get_args("-o", "ControlMaster=yes", "-o", "ControlPersist=yes", "-N", "-f"),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL,
+        ).returncode == 0
+
+    def wait_open(self, ports, attempts=60, sleep_seconds=1, print_function=print):
+        # servers start with ssh on port 22 and the startup script moves it to the servers ssh port
+        for attempt in range(1, attempts + 1):
+            for port in ports:
+                self.port = port
+                if self.open():
+                    return True
+            print_prefixed(self.name, f'Waiting for SSH to become available (attempt #{attempt})...', print_function)
+            time.sleep(sleep_seconds)
+        return False
+
+    def run(self, command, input=None, capture=False, print_function=print):
+        # streams the output lines prefixed with the connection name, unless capture is set
+        proc = subprocess.Popen(
+            self.get_args(command=command), text=True, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        )
+        if input is not None:
+            proc.stdin.write(input)
+            proc.stdin.close()
+        output = []
+        for line in proc.stdout:
+            if capture:
+                output.append(line)
+            else:
+                print_prefixed(self.name, line.rstrip("\n"), print_function)
+        returncode = proc.wait()
+        return (returncode, "".join(output)) if capture else returncode
+
+    def close(self):
+        subprocess.run(self.get_args("-O", "exit"), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def load_spec(spec_path):
+    # written by 01-rke2/03-init-rke2.tf (local_file.bootstrap_spec)
+    with open(spec_path) as f:
+        return json.load(f)
+
+
+def bootstrap_node(name, node, spec, control_dir, bastion=None, print_function=print):
+    start_time = time.time()
+    conn = SSHConnection(name, node["ssh_ip"], 22, control_dir, proxy=bastion)
+    if not conn.wait_open([22, spec["servers_ssh_port"]], print_function=print_function):
+        raise Exception(f"SSH is not available on server {name} after multiple attempts")
+    try:
+        with open(spec["startup_script_path"]) as f:
+            assert conn.run("cat >/root/server_startup_script.sh", input=f.read(), print_function=print_function) == 0
+        with open(spec["cluster_token_path"]) as f:
+            cluster_token = f.read().strip()
+        env = f'NODE_NAME={shlex.quote(name)} CLUSTER_TOKEN={shlex.quote(cluster_token)}'
+        if spec.get("artifact_cache_url"):
+            env += f' SSS_ARTIFACT_CACHE_URL={shlex.quote(spec["artifact_cache_url"])}'
+        returncode = conn.run(f'{env} bash /root/server_startup_script.sh rke2 {node["rke2_args"]}', print_function=print_function)
+        assert returncode == 0, f"startup script failed on server {name} (exit code {returncode})"
+    finally:
+        conn.close()
+    keyscan = f'ssh-keyscan -p {spec["servers_ssh_port"]} {node["ssh_ip"]}'
+    if bastion:
+        returncode, known_hosts = bastion.run(keyscan, capture=True)
+    else:
+        p = subprocess.run(shlex.split(keyscan), capture_output=True, text=True)
+        returncode, known_hosts = p.returncode, p.stdout
+    assert returncode == 0, f"ssh-keyscan failed for server {name}"
+    with open(os.path.join(spec["known_hosts_dir"], f"ssh_known_hosts.{name}"), "w") as f:
+        f.write(known_hosts)
+    seconds = time.time() - start_time
+    print_prefixed(name, f'bootstrap complete in {seconds:.1f} seconds', print_function)
+    return seconds
+
+
+def main(spec, width=config.BOOTSTRAP_WIDTH, node=None, print_function=print):
+    spec = load_spec(spec)
+    nodes = {name: n for name, n in spec["nodes"].items() if not node or name in node}
+    print_function(f'Bootstrapping {len(nodes)} nodes with width {width}{" through the bastion" if spec.get("bastion") else ""}')
+    start_time = time.time()
+    control_dir = tempfile.mkdtemp(prefix="ktb-")
+    bastion = None
+    try:
+        if spec.get("bastion"):
+            # single control connection to the bastion, all node connections are forwarded over it
+            bastion = SSHConnection("bastion", spec["bastion"]["host"], spec["bastion"]["port"], control_dir)
+            if not bastion.wait_open([spec["bastion"]["port"]], print_function=print_function):
+                raise Exception("SSH is not available on bastion after multiple attempts")
+        results, errors = {}, {}
+        with concurrent.futures.ThreadPoolExecutor(max(1, width)) as executor:
+            futures = {
+                executor.submit(bootstrap_node, name, n, spec, control_dir, bastion, print_function): name
+                for name, n in nodes.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print_prefixed(name, f'bootstrap failed: {e}', print_function)
+                    errors[name] = str(e)
+    finally:
+        if bastion:
+            bastion.close()
+        shutil.rmtree(control_dir, ignore_errors=True)
+    print_function(f'Bootstrap of {len(nodes)} nodes took {time.time() - start_time:.1f} seconds')
+    for name, seconds in sorted(results.items(), key=lambda item: -item[1]):
+        print_function(f'  {seconds:8.1f}s {name}')
+    if errors:
+        raise Exception("Errors occurred during bootstrap:\n" + "\n".join(f'{name}: {error}' for name, error in sorted(errors.items())))
+    return results
@@ -0,0 +1,184 @@
+import os
+import json
+import tempfile
+import datetime
+
+from . import util, inventory
+
+
+# written by server_startup_script.sh
+TIMING_FILE = "/root/server_startup_script.timing.jsonl"
+
+
+def parse_records(text):
+    records = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                print(f'invalid timing record: {line}')
+    return records
+
+
+def get_ssh_host_config(ssh_config, host):
+    # the options of a Host block in the ssh config, keys are lower case
+    options = {}
+    current = None
+    with open(ssh_config) as f:
+        for line in f:
+            parts = line.split(None, 1)
+            if len(parts) != 2:
+                continue
+            if parts[0] == "Host":
+                current = parts[1].strip()
+            elif current == host:
+                options[parts[0].lower()] = parts[1].strip()
+    return options
+
+
+def get_autoscaler_ssh_config(ssh_config, name_prefix):
+    # autoscaler nodes are not in the ssh config, they are reached the same way as controlplane1
+    controlplane = get_ssh_host_config(ssh_config, f"{name_prefix}-controlplane1")
+    network_type = "lan" if controlplane.get("proxyjump") else "wan"
+    hosts = []
+    for name in sorted(inventory.get_servers(f"{name_prefix}-autoscaler-", ttl_seconds=0)):
+        hosts.append("\n".join([
+            f"Host {name}",
+            f"  HostName {inventory.get_server_ip(name, network_type, name_prefix=f'{name_prefix}-autoscaler-')}",
+            "  User root",
+            f'  Port {controlplane.get("port", "22")}',
+            *([f'  ProxyJump {controlplane["proxyjump"]}'] if controlplane.get("proxyjump") else []),
+            "  StrictHostKeyChecking no",
+            "  UserKnownHostsFile /dev/null",
+        ]))
+    if not hosts:
+        return None
+    path = os.path.join(tempfile.mkdtemp(prefix="ktb-timeline-"), "ssh_config")
+    with open(path, "w") as f:
+        f.write("\n\n".join(hosts) + f"\n\nInclude {os.path.realpath(ssh_config)}\n")
+    return path
+
+
+def collect(ssh_config=None, selector=None, include_autoscaler=True):
+    # timing records of all nodes, including the nodes created by the cluster autoscaler
+    ssh_config = ssh_config or util.get_ssh_config()
+    pools = [util.get_ssh_pool(ssh_config)]
+    if include_autoscaler:
+        name_prefix = next((host[:-len("-controlplane1")] for host in pools[0].get_hosts() if host.endswith("-controlplane1")), None)
+        autoscaler_ssh_config = get_autoscaler_ssh_config(ssh_config, name_prefix) if name_prefix else None
+        if autoscaler_ssh_config:
+            pools.append(util.SSHSessionPool(autoscaler_ssh_config))
+    records = []
+    for i, pool in enumerate(pools):
+        pool_selector = selector if i == 0 else (selector or "*-autoscaler-*")
+        for host, p in pool.run_on_nodes(f"cat {TIMING_FILE}", pool_selector).items():
+            if p.returncode != 0:
+                print(f'[{host}] no timing records: {p.stderr.decode().strip()}')
+                continue
+            for record in parse_records(p.stdout.decode()):
+                record["ssh_host"] = host
+                records.append(record)
+    return records
+
+
+def is_nested(record, attempt_records):
+    # phases may run inside other phases of the same attempt (e.g. sysctl inside node_settings)
+    return any(
+        other is not record and other["phase"] != "attempt"
+        and other["start"] <= record["start"] and record["end"] <= other["end"] and other["duration"] > record["duration"]
+        for other in attempt_records
+    )
+
+
+def get_nodes(records):
+    # node name -> {start, end, attempts, succeeded, top level phases of the last attempt}
+    last_attempts = {}
+    attempt_records = {}
+    for record in records:
+        last_attempts[record["node"]] = max(last_attempts.get(record["node"], 0), record["attempt"])
+        attempt_records.setdefault((record["node"], record["attempt"]), []).append(record)
+    nodes = {}
+    for record in sorted(records, key=lambda r: r["start"]):
+        node = nodes.setdefault(record["node"], {
+            "role": record["role"], "start": record["start"], "end": record["end"],
+            "attempts": last_attempts[record["node"]], "succeeded": None, "phases": {},
+        })
+        node["end"] = max(node["end"], record["end"])
+        if record["phase"] == "attempt":
+            node["succeeded"] = record["exit_code"] == 0
+        elif record["attempt"] == last_attempts[record["node"]] and not is_nested(record, attempt_records[record["node"], record["attempt"]]):
+            node["phases"][record["phase"]] = record["duration"]
+    return nodes
+
+
+def get_critical_path(nodes, first_node=None):
+    # the cluster is bootstrapped when the last node finished, nodes joining the cluster depend on the first node
+    # returns a list of (node, phase, seconds) ordered by time
+    if not nodes:
+        return []
+    last_name, last = max(nodes.items(), key=lambda item: item[1]["end"])
+    first_node = first_node or min(nodes, key=lambda name: nodes[name]["start"])
+    path = []
+    if last_name != first_node and first_node in nodes and nodes[first_node]["end"] > last["start"]:
+        # the last node started before the first node was ready, so the first node's bootstrap is on the critical path
+        path += [(first_node, phase, seconds) for phase, seconds in nodes[first_node]["phases"].items()]
+    path += [(last_name, phase, seconds) for phase, seconds in last["phases"].items()]
+    return path
+
+
+def get_phase_stats(records):
+    stats = {}
+    for record in records:
+        if record["phase"] != "attempt":
+            stats.setdefault(record["phase"], []).append(record["duration"])
+    return {
+        phase: {"count": len(values), "p50": util.percentile(values, 50), "p95": util.percentile(values, 95), "max": max(values)}
+        for phase, values in stats.items()
+    }
+
+
+def render(records, width=60, print_function=print):
+    nodes = get_nodes(records)
+    if not nodes:
+        print_function("No timing records")
+        return {}
+    start = min(node["start"] for node in nodes.values())
+    end = max(node["end"] for node in nodes.values())
+    scale = width / max(end - start, 1)
+    print_function(f'Bootstrap timeline of {len(nodes)} nodes, {end - start:.1f} seconds from {datetime.datetime.fromtimestamp(start).isoformat()}')
+    name_width = max(len(name) for name in nodes)
+    for name, node in sorted(nodes.items(), key=lambda item: item[1]["start"]):
+        offset = int((node["start"] - start) * scale)
+        length = max(1, int((node["end"] - node["start"]) * scale))
+        retries = f' ({node["attempts"]} attempts)' if node["attempts"] > 1 else ""
+        print_function(f'  {name:<{name_width}} |{" " * offset}{"=" * length}{" " * max(0, width - offset - length)}| {node["end"] - node["start"]:7.1f}s{retries}')
+    stats = get_phase_stats(records)
+    print_function("Phase durations (seconds):")
+    for phase, phase_stats in sorted(stats.items(), key=lambda item: -item[1]["max"]):
+        print_function(f'  {phase:<20} count={phase_stats["count"]:<4} p50={phase_stats["p50"]:<8.1f} p95={phase_stats["p95"]:<8.1f} max={phase_stats["max"]:.1f}')
+    critical_path = get_critical_path(nodes)
+    print_function("Critical path:")
+    for name, phase, seconds in critical_path:
+        print_function(f'  {seconds:8.1f}s {name} {phase}')
+    return {
+        "start": start,
+        "duration_seconds": round(end - start, 3),
+        "nodes": {name: {**node, "start": round(node["start"] - start, 3), "end": round(node["end"] - start, 3)} for name, node in nodes.items()},
+        "phases": stats,
+        "critical_path": critical_path,
+    }
+
+
+def main(records_file=None, selector=None, include_autoscaler=True, output=None, print_function=print):
+    if records_file:
+        with open(records_file) as f:
+            records = parse_records(f.read())
+    else:
+        records = collect(selector=selector, include_autoscaler=include_autoscaler)
+    timeline = render(records, print_function=print_function)
+    if output:
+        with open(output, "w") as f:
+            json.dump({**timeline, "records": records}, f, indent=2)
+    return timeline
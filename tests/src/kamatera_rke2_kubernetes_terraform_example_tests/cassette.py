@@ -0,0 +1,281 @@
+import json
+import time
+import threading
+import contextvars
+import subprocess
+import collections
+
+from . import config
+
+
+# cloudcli, kubectl and terraform calls are recorded to a cassette file (json lines, one per call),
+# which can be replayed to test the harness logic offline, otherwise call / popen / wait have no effect
+_cassette = None
+_lock = threading.Lock()
+# replay clock offset of the current context, a mutable [seconds] which is shared by the contexts that didn't fork
+_clock_offset = contextvars.ContextVar("clock_offset", default=None)
+
+
+class CassetteError(Exception):
+    pass
+
+
+class RecordedError(Exception):
+    # replayed exception which was raised by the recorded call, other than CalledProcessError
+    pass
+
+
+class Clock:
+    # replaces the time module of the harness modules while replaying, sleeps only advance the clock
+    # so waits and timeouts behave as recorded without actually waiting
+    # concurrent waits run with forked offsets (see forked), so they don't advance each other's clock
+
+    def __init__(self):
+        self.root_offset = [0]
+        self.lock = threading.Lock()
+
+    def get_offset(self):
+        return _clock_offset.get() or self.root_offset
+
+    @property
+    def offset_seconds(self):
+        return self.get_offset()[0]
+
+    def time(self):
+        return time.time() + self.get_offset()[0]
+
+    def sleep(self, seconds):
+        offset = self.get_offset()
+        with self.lock:
+            offset[0] += seconds
+        time.sleep(0)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class Cassette:
+
+    def __init__(self, path, replay=False):
+        self.path = path
+        self.replay = replay
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.clock = None
+        self.patched_modules = []
+        self.num_calls = 0
+        if replay:
+            self.recorded_calls = collections.defaultdict(collections.deque)
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        recorded_call = json.loads(line)
+                        self.recorded_calls[get_key(recorded_call["kind"], recorded_call["args"], recorded_call["options"])].append(recorded_call)
+            self.file = None
+        else:
+            self.file = open(path, "w")
+
+    def start_clock(self):
+        from . import util, destroy, terraform, inventory, k8s_demo_app
+        self.clock = Clock()
+        for module in (util, destroy, terraform, inventory, k8s_demo_app):
+            self.patched_modules.append(module)
+            module.time = self.clock
+
+    def close(self):
+        for module in self.patched_modules:
+            module.time = time
+        self.patched_modules = []
+        if self.file:
+            self.file.close()
+
+    def write(self, kind, args, options, start_time, **result):
+        with self.lock:
+            self.num_calls += 1
+            self.file.write(json.dumps({
+                "kind": kind, "args": list(args), "options": options,
+                "start_seconds": round(start_time - self.start_time, 3), "duration_seconds": round(time.time() - start_time, 3),
+                **result
+            }) + "\n")
+            self.file.flush()
+
+    def pop(self, kind, args, options):
+        # recorded calls with the same arguments are served in the recorded order
+        with self.lock:
+            recorded_calls = self.recorded_calls.get(get_key(kind, args, options))
+            if not recorded_calls:
+                raise CassetteError(f'no recorded call left: {kind} {" ".join(args)} {options}')
+            self.num_calls += 1
+            recorded_call = recorded_calls.popleft()
+        if self.clock:
+            self.clock.sleep(recorded_call["duration_seconds"])
+        return recorded_call
+
+    def call(self, kind, args, func, options):
+        if self.replay:
+            recorded_call = self.pop(kind, args, options)
+            if "error" in recorded_call:
+                raise get_error(recorded_call["error"])
+            return get_result(recorded_call["result"])
+        start_time = time.time()
+        try:
+            res = func()
+        except Exception as e:
+            self.write(kind, args, options, start_time, error=get_error_json(e))
+            raise
+        self.write(kind, args, options, start_time, result=get_result_json(res))
+        return res
+
+    def popen(self, kind, args, func, options):
+        if self.replay:
+            recorded_call = self.pop(kind, args, options)
+            return ReplayedProcess(recorded_call["process"]["stdout"], recorded_call["process"]["returncode"])
+        return RecordingProcess(self, kind, args, options, func())
+
+
+class RecordingProcess:
+    # popen with text stdout, the output is recorded when the process is waited for
+
+    def __init__(self, cassette, kind, args, options, proc):
+        self.cassette = cassette
+        self.kind = kind
+        self.args = args
+        self.options = options
+        self.proc = proc
+        self.start_time = time.time()
+        self.lines = []
+        self.recorded = False
+
+    @property
+    def stdout(self):
+        for line in self.proc.stdout:
+            self.lines.append(line)
+            yield line
+
+    def wait(self):
+        returncode = self.proc.wait()
+        if not self.recorded:
+            self.recorded = True
+            self.cassette.write(self.kind, self.args, self.options, self.start_time, process={"stdout": "".join(self.lines), "returncode": returncode})
+        return returncode
+
+    def __getattr__(self, name):
+        return getattr(self.proc, name)
+
+
+class ReplayedProcess:
+
+    def __init__(self, stdout, returncode):
+        self.stdout = stdout.splitlines(keepends=True)
+        self.returncode = returncode
+
+    def wait(self):
+        return self.returncode
+
+    def poll(self):
+        return self.returncode
+
+    def send_signal(self, signal):
+        pass
+
+    def kill(self):
+        pass
+
+
+def get_key(kind, args, options):
+    return json.dumps([kind, list(args), options], sort_keys=True)
+
+
+def get_result_json(res):
+    if isinstance(res, subprocess.CompletedProcess):
+        return {"completed_process": {"args": res.args, "returncode": res.returncode, "stdout": res.stdout, "stderr": res.stderr}}
+    return {"value": res}
+
+
+def get_result(result):
+    if "completed_process" in result:
+        return subprocess.CompletedProcess(**result["completed_process"])
+    return result["value"]
+
+
+def get_error_json(e):
+    if isinstance(e, subprocess.CalledProcessError):
+        return {"called_process_error": {"returncode": e.returncode, "cmd": e.cmd, "output": e.output, "stderr": e.stderr}}
+    return {"type": type(e).__name__, "message": str(e)}
+
+
+def get_error(error):
+    if "called_process_error" in error:
+        return subprocess.CalledProcessError(**error["called_process_error"])
+    return RecordedError(f'{error["type"]}: {error["message"]}')
+
+
+def start(path, replay=False):
+    global _cassette
+    with _lock:
+        if _cassette is None:
+            _cassette = Cassette(path, replay)
+            if replay:
+                _cassette.start_clock()
+        return _cassette
+
+
+def stop():
+    global _cassette
+    with _lock:
+        cassette, _cassette = _cassette, None
+    if cassette:
+        cassette.close()
+    return cassette
+
+
+def get_cassette():
+    # started from the environment on the first call, so that all harness modules are already imported
+    if _cassette is None and (config.CASSETTE_RECORD or config.CASSETTE_REPLAY):
+        start(config.CASSETTE_REPLAY or config.CASSETTE_RECORD, replay=bool(config.CASSETTE_REPLAY))
+    return _cassette
+
+
+def call(kind, args, func, **options):
+    # func runs the call, kind / args / options identify it in the cassette and must be json serializable
+    cassette = get_cassette()
+    return cassette.call(kind, args, func, options) if cassette else func()
+
+
+def popen(kind, args, func, **options):
+    # func returns a Popen with text stdout, which is recorded / replayed as a whole
+    cassette = get_cassette()
+    return cassette.popen(kind, args, func, options) if cassette else func()
+
+
+def forked(func):
+    # for functions which run concurrently with others in threads, while replaying each call gets its own clock offset
+    # starting from the caller's clock at the time of forking, when it returns the caller's clock is advanced to it,
+    # like the wall clock of a join
+    cassette = _cassette
+    if cassette is None or cassette.clock is None:
+        return func
+    parent_offset = cassette.clock.get_offset()
+    start_seconds = parent_offset[0]
+
+    def wrapper(*args, **kwargs):
+        offset = [start_seconds]
+        token = _clock_offset.set(offset)
+        try:
+            res = func(*args, **kwargs)
+        finally:
+            _clock_offset.reset(token)
+        with cassette.clock.lock:
+            parent_offset[0] = max(parent_offset[0], offset[0])
+        return res
+
+    return wrapper
+
+
+def wait(event, seconds):
+    # event.wait, while replaying the clock is advanced instead of waiting
+    cassette = _cassette
+    if cassette is None or cassette.clock is None:
+        return event.wait(seconds)
+    cassette.clock.sleep(seconds)
+    return event.is_set()
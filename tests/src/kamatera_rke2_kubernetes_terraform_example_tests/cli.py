@@ -1,3 +1,5 @@
+import os
+import sys
 import json
 
 import click
@@ -5,8 +7,24 @@ import click
 
 
 @click.group()
-def main():
-    pass
+@click.option("--workspace", "workspace_name_prefix", help="Run the command in the isolated workspace of this name prefix (created if missing)")
+@click.pass_context
+def main(ctx, workspace_name_prefix):
+    if workspace_name_prefix:
+        from . import workspace
+        ctx.with_resource(workspace.use(workspace_name_prefix))
+
+
+def daemon_request(command, **kwargs):
+    # routes the command through the serve daemon if it's running, returns None to handle the command locally
+    # once the daemon received the command it's not run locally again, it may have been partially applied
+    from . import daemon
+    workspace_name_prefix = click.get_current_context().find_root().params.get("workspace_name_prefix")
+    try:
+        response = daemon.request(command, workspace_name_prefix, **kwargs)
+    except daemon.DaemonError as e:
+        raise click.ClickException(f"serve daemon failed: {e}")
+    return None if response is daemon.NOT_RUNNING else response
 
 
 @main.command()
@@ -37,14 +55,30 @@ def destroy(**kwargs):
     destroy.main(**kwargs)
 
 
+@main.command()
+@click.option("--datacenter-id", required=True, help="Comma-separated list of datacenter IDs")
+@click.option("--prefix", default="kca", help="Prefix of generated cluster name prefixes")
+@click.option("--max-age-hours", type=float, default=24, help="Delete clusters created more than this many hours ago")
+@click.option("--keep", multiple=True, help="Name prefix of a cluster to keep, can be used multiple times")
+@click.option("--dry-run", is_flag=True)
+@click.option("--force", is_flag=True)
+def gc(**kwargs):
+    from . import garbage_collect
+    garbage_collect.main(**kwargs)
+
+
 @main.command()
 @click.option('--name-prefix')
 @click.option("--bastion-port")
 @click.option("--nodes-port")
 @click.option('--identity-file')
 def get_kubeconfig(**kwargs):
-    from . import util
-    print(util.get_kubeconfig(**kwargs))
+    response = daemon_request("get-kubeconfig", **kwargs)
+    if response:
+        print(response["result"])
+    else:
+        from . import util
+        print(util.get_kubeconfig(**kwargs))
 
 
 @main.command()
@@ -53,12 +87,178 @@ def get_kubeconfig(**kwargs):
 @click.option("--nodes-port")
 @click.option('--identity-file')
 def get_ssh_config(**kwargs):
-    from . import util
-    print(util.get_ssh_config(**kwargs))
+    response = daemon_request("get-ssh-config", **kwargs)
+    if response:
+        print(response["result"])
+    else:
+        from . import util
+        print(util.get_ssh_config(**kwargs))
+
+
+def kubectl_reads_stdin(args):
+    return any(
+        arg in ("-f=-", "--filename=-") or (arg in ("-f", "--filename") and next_arg == "-")
+        for arg, next_arg in zip(args, [*args[1:], None])
+    )
 
 
 @main.command()
 @click.argument('args', nargs=-1)
 def kubectl(args):
+    # the daemon runs the command in its own process, so the working directory and stdin are sent with it
+    kwargs = {"cwd": os.getcwd()}
+    if kubectl_reads_stdin(args):
+        kwargs["input"] = sys.stdin.read()
+    response = daemon_request("kubectl", args=args, **kwargs)
+    if response and response["handled"]:
+        print(response["output"], end="")
+    else:
+        from . import util
+        if "input" in kwargs:
+            # stdin was already read, it's passed to the kubectl binary
+            click.get_current_context().exit(util.kubectl(*args, run=True, input=kwargs["input"]).returncode)
+        util.kubectl(*args)
+
+
+@main.command()
+@click.option("--socket", "socket_path", help="Unix socket to listen on, defaults to DAEMON_SOCKET or ~/.ktb-daemon.sock")
+@click.option("--cache-ttl-seconds", type=int, help="Reuse fetched kubeconfigs / ssh configs for this long")
+def serve(**kwargs):
+    from . import daemon
+    daemon.main(**kwargs)
+
+
+@main.command()
+@click.option("--ips", help="Comma-separated list of IPs, defaults to the external IPs of all worker nodes")
+@click.option("--concurrency", type=int, default=10)
+@click.option("--duration-seconds", type=float, default=10)
+@click.option("--host", default="demo.example.com")
+@click.option("--port", type=int, default=80)
+@click.option("--output", help="Write the JSON summary to this file")
+def bench_ingress(**kwargs):
+    from . import ingress_bench
+    ingress_bench.main(**kwargs)
+
+
+@main.command()
+@click.option("--name-prefix", required=True)
+@click.option("--cycles", type=int, default=3)
+@click.option("--replicas", type=int, default=2, help="Demo pods to schedule on autoscaler nodes in each cycle")
+@click.option("--timeout-seconds", type=int, default=3600, help="Timeout for each scale up / scale down")
+@click.option("--server-poll-seconds", type=int, default=10)
+@click.option("--output", help="Write the JSON summary to this file")
+@click.option("--label", multiple=True, help="key=value to add to the summary labels, can be used multiple times")
+def bench_autoscaler(**kwargs):
+    from . import autoscaler_bench
+    autoscaler_bench.main(**kwargs)
+
+
+@main.command()
+@click.option("--trace", help="JSON list of workload events: {time, deployment, replicas, cpu, memory, node_selector, anti_affinity}, defaults to the demo app test")
+@click.option("--tfvars", help="02-k8s tfvars json with the nodegroup configs and autoscaler extra args, defaults to the demo app test config")
+@click.option("--cloud-config", help="Rendered autoscaler cloud-config to read the nodegroups from")
+@click.option("--extra-arg", multiple=True, help="Cluster autoscaler flag (e.g. --scale-down-unneeded-time=5m), can be used multiple times")
+@click.option("--provision-seconds", type=float, default=300, help="Time from scale up to a ready node")
+@click.option("--delete-seconds", type=float, default=60)
+@click.option("--bench-summary", help="Take the provision / delete times from a bench-autoscaler summary")
+@click.option("--provision-failure-rate", type=float, default=0)
+@click.option("--duration-seconds", type=float)
+@click.option("--output", help="Write the JSON summary to this file")
+def simulate_autoscaler(**kwargs):
+    from . import autoscaler_sim
+    autoscaler_sim.main(**kwargs)
+
+
+@main.command()
+@click.option("--scenarios-file", help="JSON list of {name, env} or a github workflow with a dotenvs matrix, defaults to the CI workflow")
+@click.option("--max-clusters", type=int, help="Maximum number of clusters in flight")
+@click.option("--only", multiple=True, help="Name of a scenario to run, can be used multiple times")
+def schedule(**kwargs):
+    from . import config, scheduler
+    if not kwargs["max_clusters"]:
+        kwargs["max_clusters"] = config.SCHEDULER_MAX_CLUSTERS
+    scheduler.main(**kwargs)
+
+
+@main.command()
+def list_workspaces():
+    from . import workspace
+    for name_prefix in workspace.list_workspaces():
+        print(name_prefix)
+
+
+@main.command()
+@click.option("--size", type=int, default=1, help="Number of clusters to keep for each profile")
+@click.option("--use-scenarios", is_flag=True, help="Keep clusters for the profiles of all CI matrix scenarios instead of the profile from env")
+@click.option("--scenarios-file", help="Use the profiles of the scenarios in this file, see the schedule command")
+@click.option("--poll-seconds", type=int, default=60)
+@click.option("--once", is_flag=True, help="Run a single pass and wait for it to complete")
+def cluster_pool(**kwargs):
+    from . import cluster_pool
+    cluster_pool.main(**kwargs)
+
+
+@main.command()
+@click.option("--add", type=int, default=0, help="Number of agent servers to create and join to the cluster")
+@click.option("--remove", type=int, default=0, help="Number of workers added by scale-workers to remove, newest first")
+@click.option("--cpu-cores", type=int)
+@click.option("--ram-mb", type=int)
+@click.option("--width", type=int, default=10, help="Maximum number of servers to create / terminate concurrently")
+@click.option("--no-wait", is_flag=True, help="Don't wait for the new workers to be ready")
+@click.option("--timeout-seconds", type=int)
+@click.option("--drain-timeout-seconds", type=int, help="Timeout of draining the removed workers")
+def scale_workers(no_wait, **kwargs):
+    from . import config, scale_workers
+    if not kwargs["timeout_seconds"]:
+        kwargs["timeout_seconds"] = config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS
+    if not kwargs["drain_timeout_seconds"]:
+        kwargs["drain_timeout_seconds"] = config.SCALE_WORKERS_DRAIN_TIMEOUT_SECONDS
+    scale_workers.main(wait=not no_wait, **kwargs)
+
+
+@main.command()
+@click.option("--spec", required=True, help="Path to the bootstrap.json written by the 01-rke2 terraform stack")
+@click.option("--width", type=int, help="Maximum number of nodes to bootstrap concurrently")
+@click.option("--node", multiple=True, help="Only bootstrap this node, can be used multiple times")
+def bootstrap(**kwargs):
+    from . import config, bootstrap
+    if not kwargs["width"]:
+        kwargs["width"] = config.BOOTSTRAP_WIDTH
+    bootstrap.main(**kwargs)
+
+
+@main.command()
+@click.argument('command')
+@click.option("--selector", help="Glob pattern of the ssh config hosts to run on, defaults to all nodes except the bastion")
+def run_on_nodes(command, selector):
     from . import util
-    util.kubectl(*args)
+    failed = []
+    for host, p in util.get_ssh_pool().run_on_nodes(command, selector).items():
+        for line in (p.stdout + p.stderr).decode().splitlines():
+            print(f'[{host}] {line}')
+        if p.returncode != 0:
+            failed.append(host)
+    if failed:
+        raise click.ClickException(f'command failed on: {", ".join(failed)}')
+
+
+@main.command()
+@click.option("--records-file", help="Render the timeline from a local JSON lines file instead of collecting from the nodes")
+@click.option("--selector", help="Glob pattern of the ssh config hosts to collect from")
+@click.option("--no-autoscaler", is_flag=True, help="Don't collect from the nodes created by the cluster autoscaler")
+@click.option("--output", help="Write the timeline and all records as JSON to this file")
+def bootstrap_timeline(records_file, selector, no_autoscaler, output):
+    from . import bootstrap_timeline
+    bootstrap_timeline.main(records_file, selector, not no_autoscaler, output)
+
+
+@main.command()
+@click.option("--namespace", help="Namespace of the image pull events, defaults to all namespaces")
+@click.option("--output", help="Write the metrics as JSON to this file")
+def registry_mirror_metrics(**kwargs):
+    from . import registry_mirror
+    registry_mirror.main(**kwargs)
+
+
+if __name__ == "__main__":
+    main()
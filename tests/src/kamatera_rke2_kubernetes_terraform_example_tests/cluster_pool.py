@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import fcntl
+import socket
+import secrets
+import datetime
+import traceback
+import contextlib
+import concurrent.futures
+
+from . import config, setup, destroy, workspace, k8s_demo_app
+
+
+# cluster status lifecycle:
+# provisioning -> ready -> leased -> dirty -> resetting -> ready
+# any failure -> broken -> destroying (removed from the pool once destroyed)
+PROFILE_FIELDS = [
+    "k8s_version", "datacenter_id", "high_availability", "with_bastion", "cluster_autoscaler_image",
+    "with_kamatera_controller", "ca_poweron_on_scale_up", "ca_poweroff_on_scale_down",
+]
+
+
+def get_profile(options):
+    # the options which affect provisioning, clusters are only leased for the same profile
+    return {field: getattr(options, field) for field in PROFILE_FIELDS}
+
+
+def get_profile_name(profile):
+    return f'k8s{profile["k8s_version"]}-{profile["datacenter_id"]}{"-ha" if profile["high_availability"] else ""}'
+
+
+def get_owner():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def is_owner_alive(owner):
+    hostname, pid = owner.rsplit(":", 1)
+    if hostname != socket.gethostname():
+        # can't check processes on other hosts
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def get_state_path():
+    return os.path.join(workspace.get_workspaces_dir(), "cluster_pool.json")
+
+
+@contextlib.contextmanager
+def locked_state():
+    # the state file is shared by the pool daemon and all test sessions, access is serialized with an exclusive flock
+    path = get_state_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.lock', "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(path):
+                with open(path) as f:
+                    state = json.load(f)
+            else:
+                state = {"clusters": {}}
+            yield state
+            with open(f'{path}.tmp', "w") as f:
+                json.dump(state, f, indent=2)
+            os.replace(f'{path}.tmp', path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def set_status(name_prefix, status, **kwargs):
+    with locked_state() as state:
+        cluster = state["clusters"].get(name_prefix)
+        if cluster:
+            cluster.update(status=status, updated_at=time.time(), **kwargs)
+        return cluster
+
+
+def get_name_prefixes():
+    # all clusters managed by the pool, in any status, these are never garbage collected
+    if not os.path.exists(get_state_path()):
+        return set()
+    with locked_state() as state:
+        return set(state["clusters"])
+
+
+def lease(options, timeout_seconds=config.CLUSTER_POOL_LEASE_TIMEOUT_SECONDS, poll_seconds=10, print_function=print):
+    # returns the name prefix of a clean cluster of the options profile
+    # a dirty cluster is reset by the caller if no ready cluster is available, which is still much faster than provisioning
+    profile = get_profile(options)
+    lease_id = secrets.token_hex(4)
+    start_time = time.time()
+    print_function(f'leasing a cluster of profile {get_profile_name(profile)}')
+    while True:
+        with locked_state() as state:
+            candidates = [
+                (name_prefix, cluster) for name_prefix, cluster in sorted(state["clusters"].items(), key=lambda item: item[1]["updated_at"])
+                if cluster["profile"] == profile and cluster["status"] in ("ready", "dirty")
+            ]
+            # prefer clusters which are ready to use
+            candidates.sort(key=lambda item: item[1]["status"] != "ready")
+            if candidates:
+                name_prefix, cluster = candidates[0]
+                is_dirty = cluster["status"] == "dirty"
+                cluster.update(
+                    status="resetting" if is_dirty else "leased", owner=get_owner(), lease_id=lease_id,
+                    leased_at=time.time(), updated_at=time.time()
+                )
+            else:
+                name_prefix = None
+        if name_prefix:
+            break
+        if time.time() - start_time > timeout_seconds:
+            raise AssertionError(f"timeout waiting for a cluster of profile {get_profile_name(profile)}, is the cluster pool running?")
+        time.sleep(poll_seconds)
+    if is_dirty:
+        print_function(f'no ready cluster available, resetting dirty cluster {name_prefix}')
+        if not reset(name_prefix, print_function=print_function, next_status="leased"):
+            return lease(options, max(1, timeout_seconds - (time.time() - start_time)), poll_seconds, print_function)
+    print_function(f'leased cluster {name_prefix} in {time.time() - start_time:.1f} seconds')
+    return name_prefix
+
+
+def release(name_prefix):
+    # the cluster is reset by the pool daemon (or by the next lease if no ready cluster is available)
+    set_status(name_prefix, "dirty", owner=None, lease_id=None, leased_at=None)
+
+
+@contextlib.contextmanager
+def leased(options, print_function=print):
+    name_prefix = lease(options, print_function=print_function)
+    try:
+        yield name_prefix
+    finally:
+        release(name_prefix)
+
+
+def reset(name_prefix, print_function=print, next_status="ready"):
+    # returns False and marks the cluster as broken if the reset could not be verified
+    try:
+        with locked_state() as state:
+            expected_nodes = state["clusters"][name_prefix]["expected_nodes"]
+        with workspace.use(name_prefix, create_if_missing=False):
+            k8s_demo_app.reset_cluster(name_prefix, expected_nodes, print_function=print_function)
+    except Exception:
+        traceback.print_exc()
+        set_status(name_prefix, "broken", owner=None)
+        return False
+    else:
+        set_status(name_prefix, next_status, owner=get_owner() if next_status == "leased" else None)
+        return True
+
+
+def provision(name_prefix, options, print_function=print):
+    try:
+        with workspace.use(name_prefix):
+            expected_nodes = k8s_demo_app.provision_cluster(name_prefix, options, print_function=print_function)
+    except Exception:
+        traceback.print_exc()
+        set_status(name_prefix, "broken", owner=None)
+        return False
+    else:
+        set_status(name_prefix, "ready", owner=None, expected_nodes=expected_nodes)
+        return True
+
+
+def remove(name_prefix, datacenter_id):
+    try:
+        with workspace.use(name_prefix, create_if_missing=True):
+            destroy.main(name_prefix=name_prefix, datacenter_id=datacenter_id)
+    except Exception:
+        traceback.print_exc()
+        set_status(name_prefix, "broken", owner=None)
+        return False
+    else:
+        with locked_state() as state:
+            state["clusters"].pop(name_prefix, None)
+        return True
+
+
+def maintain(profile_options, size, executor, lease_seconds=config.CLUSTER_POOL_MAX_LEASE_SECONDS, print_function=print):
+    # single pass of the pool daemon, schedules background provisioning, resets and destroys on the executor
+    # returns the list of scheduled futures
+    now = time.time()
+    owner = get_owner()
+    tasks = []
+    with locked_state() as state:
+        clusters = state["clusters"]
+        for name_prefix, cluster in clusters.items():
+            if cluster["status"] == "leased" and now - cluster["leased_at"] > lease_seconds:
+                print_function(f'lease of cluster {name_prefix} expired')
+                cluster.update(status="dirty", owner=None, lease_id=None, leased_at=None, updated_at=now)
+            elif cluster["status"] in ("provisioning", "resetting", "destroying", "leased") and cluster.get("owner") and not is_owner_alive(cluster["owner"]):
+                print_function(f'owner of cluster {name_prefix} ({cluster["status"]}) is not running anymore')
+                cluster.update(status="dirty" if cluster["status"] == "leased" else "broken", owner=None, updated_at=now)
+            if cluster["status"] == "dirty":
+                cluster.update(status="resetting", owner=owner, updated_at=now)
+                tasks.append((reset, name_prefix, print_function))
+            elif cluster["status"] == "broken":
+                cluster.update(status="destroying", owner=owner, updated_at=now)
+                tasks.append((remove, name_prefix, cluster["profile"]["datacenter_id"]))
+        for options in profile_options:
+            profile = get_profile(options)
+            num_clusters = sum(
+                1 for cluster in clusters.values()
+                if cluster["profile"] == profile and cluster["status"] not in ("broken", "destroying")
+            )
+            for _ in range(size - num_clusters):
+                name_prefix = setup.generate_name_prefix()
+                print_function(f'provisioning cluster {name_prefix} of profile {get_profile_name(profile)}')
+                clusters[name_prefix] = {
+                    "profile": profile, "status": "provisioning", "owner": owner,
+                    "created_at": now, "updated_at": now, "expected_nodes": None,
+                }
+                tasks.append((provision, name_prefix, options, print_function))
+    return [executor.submit(*task) for task in tasks]
+
+
+def print_status(print_function=print):
+    with locked_state() as state:
+        clusters = state["clusters"]
+    print_function(f'{datetime.datetime.now().isoformat()} cluster pool: {len(clusters)} clusters')
+    for name_prefix, cluster in sorted(clusters.items()):
+        print_function(f'  {cluster["status"]:<12} {name_prefix} {get_profile_name(cluster["profile"])}')
+    return clusters
+
+
+def main(size=1, scenarios_file=None, use_scenarios=False, poll_seconds=60, once=False, print_function=print):
+    # pool daemon, keeps size clusters for each profile and resets released clusters in the background
+    if use_scenarios or scenarios_file:
+        from . import scheduler
+        profile_options = [k8s_demo_app.DemoAppOptions.from_env(scenario.env) for scenario in scheduler.load_scenarios(scenarios_file)]
+    else:
+        profile_options = [k8s_demo_app.DemoAppOptions.from_env()]
+    print_function(f'cluster pool of {size} clusters for profiles: {", ".join(get_profile_name(get_profile(o)) for o in profile_options)}')
+    with concurrent.futures.ThreadPoolExecutor(config.CLUSTER_POOL_MAX_WORKERS) as executor:
+        futures = []
+        while True:
+            futures = [future for future in futures if not future.done()]
+            futures += maintain(profile_options, size, executor, print_function=print_function)
+            print_status(print_function)
+            if once:
+                concurrent.futures.wait(futures)
+                return print_status(print_function)
+            time.sleep(poll_seconds)
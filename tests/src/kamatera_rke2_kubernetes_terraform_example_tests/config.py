@@ -9,4 +9,69 @@ dotenv.load_dotenv()
 KAMATERA_API_CLIENT_ID = os.getenv("KAMATERA_API_CLIENT_ID")
 KAMATERA_API_SECRET = os.getenv("KAMATERA_API_SECRET")
 
-DEFAULT_WAIT_FOR_TIMEOUT_SECONDS = os.getenv("DEFAULT_WAIT_FOR_TIMEOUT_SECONDS") or 1200  # 20 minutes
+DEFAULT_WAIT_FOR_TIMEOUT_SECONDS = int(os.getenv("DEFAULT_WAIT_FOR_TIMEOUT_SECONDS") or 1200)  # 20 minutes
+
+INVENTORY_TTL_SECONDS = int(os.getenv("INVENTORY_TTL_SECONDS") or 60)
+
+K8S_NATIVE_CLIENT = os.getenv("K8S_NATIVE_CLIENT") != "no"
+K8S_API_TIMEOUT_SECONDS = int(os.getenv("K8S_API_TIMEOUT_SECONDS") or 60)
+K8S_WATCH = os.getenv("K8S_WATCH") != "no"
+# nodes / pods are listed in pages of this size, so that memory per poll doesn't grow with the cluster size
+K8S_LIST_PAGE_SIZE = int(os.getenv("K8S_LIST_PAGE_SIZE") or 500)
+# with several control plane servers in the kubeconfig, requests go to the fastest ready one (probed with /readyz)
+K8S_ENDPOINT_PROBE_TIMEOUT_SECONDS = int(os.getenv("K8S_ENDPOINT_PROBE_TIMEOUT_SECONDS") or 5)
+K8S_ENDPOINT_RESELECT_SECONDS = int(os.getenv("K8S_ENDPOINT_RESELECT_SECONDS") or 60)
+
+# at least as long as the 10 consecutive 60 seconds polls of the polling check, so that a premature autoscaler scale down
+# (--scale-down-delay-after-add=2m + --scale-down-unneeded-time=5m) is detected within the window
+STABILITY_QUIET_SECONDS = int(os.getenv("STABILITY_QUIET_SECONDS") or 600)  # 10 minutes
+STABILITY_TIMEOUT_SECONDS = int(os.getenv("STABILITY_TIMEOUT_SECONDS") or 1800)  # 30 minutes
+
+TEARDOWN_MAX_WORKERS = int(os.getenv("TEARDOWN_MAX_WORKERS") or 10)
+TEARDOWN_RETRIES = int(os.getenv("TEARDOWN_RETRIES") or 3)
+
+WORKSPACES_DIR = os.getenv("WORKSPACES_DIR")
+SCHEDULER_MAX_CLUSTERS = int(os.getenv("SCHEDULER_MAX_CLUSTERS") or 3)
+
+CLUSTER_POOL_LEASE_TIMEOUT_SECONDS = int(os.getenv("CLUSTER_POOL_LEASE_TIMEOUT_SECONDS") or 3600)
+CLUSTER_POOL_MAX_LEASE_SECONDS = int(os.getenv("CLUSTER_POOL_MAX_LEASE_SECONDS") or 14400)  # 4 hours
+CLUSTER_POOL_MAX_WORKERS = int(os.getenv("CLUSTER_POOL_MAX_WORKERS") or 5)
+
+TERRAFORM_STREAMING = os.getenv("TERRAFORM_STREAMING") != "no"
+TERRAFORM_APPLY_RETRIES = int(os.getenv("TERRAFORM_APPLY_RETRIES") or 5)
+
+# bootstrap nodes with the python orchestrator over multiplexed SSH instead of a local-exec per node
+BOOTSTRAP_ORCHESTRATOR = os.getenv("BOOTSTRAP_ORCHESTRATOR") == "yes"
+BOOTSTRAP_WIDTH = int(os.getenv("BOOTSTRAP_WIDTH") or 20)
+# nodes install RKE2 from an artifact cache on the bastion (or first controlplane) instead of downloading from upstream
+# opt-in, enabling it on an existing cluster changes the bootstrap command of all nodes
+RKE2_ARTIFACT_CACHE = os.getenv("RKE2_ARTIFACT_CACHE") == "yes"
+RKE2_ARTIFACT_CACHE_PORT = int(os.getenv("RKE2_ARTIFACT_CACHE_PORT") or 52080)
+# deploy a pull-through cache of docker.io images, all nodes pull through it
+REGISTRY_MIRROR = os.getenv("REGISTRY_MIRROR") == "yes"
+
+# write a chrome / perfetto trace of the run (setup, terraform, waits, kubectl, cloudcli, destroy) to this file
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_SUMMARY_TOP = int(os.getenv("TRACE_SUMMARY_TOP") or 20)
+
+# record the cloudcli / kubectl / terraform calls of a run to this cassette file, or replay them offline from it
+CASSETTE_RECORD = os.getenv("CASSETTE_RECORD")
+CASSETTE_REPLAY = os.getenv("CASSETTE_REPLAY")
+
+# ssh connections to cluster nodes are multiplexed over persistent control masters, shared with ssh_config users
+SSH_CONTROL_PATH = os.getenv("SSH_CONTROL_PATH") or "~/.ssh/ktb-%C"
+SSH_CONTROL_PERSIST_SECONDS = int(os.getenv("SSH_CONTROL_PERSIST_SECONDS") or 600)
+SSH_MAX_WORKERS = int(os.getenv("SSH_MAX_WORKERS") or 20)
+
+# kamatera api calls are made in-process with pooled connections instead of forking the cloudcli binary
+# opt-in, the endpoints are only verified against tests/fake_kamatera_api.py
+KAMATERA_NATIVE_API = os.getenv("KAMATERA_NATIVE_API") == "yes"
+KAMATERA_API_URL = os.getenv("KAMATERA_API_URL") or "https://cloudcli.cloudwm.com"
+KAMATERA_API_TIMEOUT_SECONDS = int(os.getenv("KAMATERA_API_TIMEOUT_SECONDS") or 60)
+KAMATERA_API_MAX_CONCURRENCY = int(os.getenv("KAMATERA_API_MAX_CONCURRENCY") or 10)
+
+# workers removed by scale-workers are drained first, the removal fails if the drain doesn't complete in time
+SCALE_WORKERS_DRAIN_TIMEOUT_SECONDS = int(os.getenv("SCALE_WORKERS_DRAIN_TIMEOUT_SECONDS") or 300)
+
+# kubeconfigs / ssh configs fetched by the serve daemon are reused for this long
+DAEMON_CACHE_TTL_SECONDS = int(os.getenv("DAEMON_CACHE_TTL_SECONDS") or 300)
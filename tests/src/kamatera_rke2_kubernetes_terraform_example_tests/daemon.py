@@ -0,0 +1,159 @@
+import io
+import os
+import json
+import time
+import socket
+import signal
+import threading
+import contextlib
+import socketserver
+
+
+# not in config, so that routing a command through the daemon doesn't import config / load the dotenv file
+SOCKET_PATH = os.path.expanduser(os.getenv("DAEMON_SOCKET") or "~/.ktb-daemon.sock")
+CONNECT_TIMEOUT_SECONDS = 0.5
+
+# returned by request if the daemon is not running, the caller then handles the command itself
+NOT_RUNNING = object()
+
+
+class DaemonError(Exception):
+    pass
+
+
+def request(command, workspace_name_prefix=None, socket_path=None, timeout_seconds=None, **kwargs):
+    # newline-delimited json, one request per connection
+    socket_path = socket_path or SOCKET_PATH
+    if not os.path.exists(socket_path):
+        return NOT_RUNNING
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT_SECONDS)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return NOT_RUNNING
+        # the daemon may have started handling the command once it's sent, so errors from here on are not NOT_RUNNING
+        sock.settimeout(timeout_seconds)
+        try:
+            sock.sendall(json.dumps({"command": command, "workspace": workspace_name_prefix, "kwargs": kwargs}).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        except OSError as e:
+            raise DaemonError(f"daemon request failed: {command}: {e}")
+    if not line:
+        raise DaemonError(f"daemon closed the connection without a response: {command}")
+    response = json.loads(line)
+    if not response.get("ok"):
+        raise DaemonError(response.get("error"))
+    return response
+
+
+class Daemon:
+
+    def __init__(self, cache_ttl_seconds=None):
+        from . import config
+        self.cache_ttl_seconds = config.DAEMON_CACHE_TTL_SECONDS if cache_ttl_seconds is None else cache_ttl_seconds
+        self.start_time = time.time()
+        self.requests = 0
+        self.cache = {}
+        self.lock = threading.Lock()
+        # kubectl_native prints its output, it's captured one request at a time
+        self.stdout_lock = threading.Lock()
+
+    def handle(self, request):
+        from . import workspace
+        handler = getattr(self, f'handle_{request["command"].replace("-", "_")}', None)
+        if not handler:
+            raise DaemonError(f'unknown command: {request["command"]}')
+        with self.lock:
+            self.requests += 1
+        name_prefix = request.get("workspace")
+        with workspace.use(name_prefix, create_if_missing=False) if name_prefix else contextlib.nullcontext():
+            return handler(**(request.get("kwargs") or {}))
+
+    def get_cached(self, name, func, kwargs):
+        # the cached files are only reused while they exist, so deleting them forces a refetch
+        from . import workspace
+        key = (name, workspace.get_tfdir(), json.dumps(kwargs, sort_keys=True))
+        with self.lock:
+            cached = self.cache.get(key)
+        if cached and time.time() - cached[0] < self.cache_ttl_seconds and os.path.exists(cached[1]):
+            return cached[1]
+        path = func(**kwargs)
+        with self.lock:
+            self.cache[key] = (time.time(), path)
+        return path
+
+    def handle_ping(self):
+        with self.lock:
+            return {"pid": os.getpid(), "uptime_seconds": round(time.time() - self.start_time, 3), "requests": self.requests, "cached": len(self.cache)}
+
+    def handle_get_kubeconfig(self, **kwargs):
+        from . import util
+        return {"result": self.get_cached("kubeconfig", util.get_kubeconfig, kwargs)}
+
+    def handle_get_ssh_config(self, **kwargs):
+        from . import util
+        return {"result": self.get_cached("ssh_config", util.get_ssh_config, kwargs)}
+
+    def handle_kubectl(self, args, cwd=None, input=None):
+        # commands which kubectl_native doesn't support are not handled, the client runs the kubectl binary for those
+        # relative file names are resolved in the client's working directory, input is the client's stdin for -f -
+        from . import util
+        kwargs = {"cwd": cwd} if cwd else {}
+        if input is not None:
+            kwargs["input"] = input
+        output = io.StringIO()
+        with self.stdout_lock, contextlib.redirect_stdout(output):
+            res = util.kubectl_native(*args, **kwargs)
+        if res is NotImplemented:
+            return {"handled": False}
+        return {"handled": True, "output": output.getvalue()}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            response = {"ok": True, **self.server.daemon.handle(json.loads(line))}
+        except Exception as e:
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+def create_server(socket_path=None, cache_ttl_seconds=None):
+    socket_path = socket_path or SOCKET_PATH
+    if request("ping", socket_path=socket_path) is not NOT_RUNNING:
+        raise DaemonError(f"daemon is already running: {socket_path}")
+    if os.path.exists(socket_path):
+        # left over from a daemon which was killed
+        os.unlink(socket_path)
+    # the daemon acts with the user's cloud and cluster credentials, the socket is created accessible only by the user
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, _RequestHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    server.daemon = Daemon(cache_ttl_seconds)
+    return server
+
+
+def main(socket_path=None, cache_ttl_seconds=None, print_function=print):
+    socket_path = socket_path or SOCKET_PATH
+    server = create_server(socket_path, cache_ttl_seconds)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *args: threading.Thread(target=server.shutdown).start())
+    print_function(f"Serving on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        print_function("Stopped")
@@ -1,12 +1,27 @@
 import os
 import json
+import time
+import shutil
+import threading
 import subprocess
 import traceback
+import dataclasses
+import concurrent.futures
 
-from . import config
+from . import config, inventory, workspace, kamatera_api, tracing, cassette
 
 
+@tracing.traced("cloudcli", ("args",))
 def cloudcli(*args, parse_json=False, run=False, popen=False, **kwargs):
+    if popen or kwargs:
+        return _cloudcli(*args, parse_json=parse_json, run=run, popen=popen, **kwargs)
+    return cassette.call("cloudcli", args, lambda: _cloudcli(*args, parse_json=parse_json, run=run), parse_json=parse_json, run=run)
+
+
+def _cloudcli(*args, parse_json=False, run=False, popen=False, **kwargs):
+    # compatibility shim, commands supported by the native api client are handled in-process without forking cloudcli
+    if config.KAMATERA_NATIVE_API and not popen and not kwargs and kamatera_api.is_cloudcli_supported(args):
+        return kamatera_api.cloudcli(*args, parse_json=parse_json, run=run)
     if parse_json:
         assert not run and not popen
         func = subprocess.check_output
@@ -27,62 +42,128 @@ def cloudcli(*args, parse_json=False, run=False, popen=False, **kwargs):
     return json.loads(res) if parse_json else res
 
 
-def terminate_servers(name_prefix):
-    errors = []
-    poweroff_servers = []
-    terminate_servers = []
-    for server in cloudcli("server", "list", parse_json=True):
-        if server["name"].startswith(name_prefix):
-            if server.get("power") == "on":
-                poweroff_servers.append(server["name"])
-            else:
-                terminate_servers.append(server["name"])
-    print(f'Found {len(poweroff_servers)} servers to power off')
-    print(f'Found {len(terminate_servers)} servers to terminate')
-    processes = {}
-    for server_name in poweroff_servers:
-        print(f"Powering off server {server_name}...")
-        processes[server_name] = cloudcli("server", "poweroff", "--name", server_name, "--wait", popen=True)
-    for server_name, process in processes.items():
-        res = process.wait()
-        if res != 0:
-            errors.append(f'Failed to poweroff server: {server_name} (exit code {res})')
-    processes = {}
-    for server_name in [*terminate_servers, *poweroff_servers]:
+@dataclasses.dataclass
+class TeardownResult:
+    deleted: list = dataclasses.field(default_factory=list)
+    errors: list = dataclasses.field(default_factory=list)
+    steps: list = dataclasses.field(default_factory=list)  # (description, duration seconds, exit code)
+    retry_sleep_seconds: int = 5
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def run_step(self, description, func, deleted=None, error=None, retries=1):
+        # func returns an exit code, the step is retried until it succeeds or retries are exhausted
+        for attempt in range(1, retries + 1):
+            start_time = time.time()
+            try:
+                with tracing.span(description, attempt=attempt) as span:
+                    res = func()
+                    span.set(exit_code=res)
+            except Exception:
+                traceback.print_exc()
+                res = -1
+            with self.lock:
+                self.steps.append((description if attempt == 1 else f'{description} (attempt {attempt})', time.time() - start_time, res))
+            if res == 0:
+                if deleted:
+                    with self.lock:
+                        self.deleted.append(deleted)
+                return True
+            elif attempt < retries:
+                time.sleep(self.retry_sleep_seconds * attempt)
+        if error:
+            with self.lock:
+                self.errors.append(f'{error} (exit code {res})')
+        return False
+
+    def print_summary(self, num_slowest_steps=10):
+        print(f'Deleted {len(self.deleted)} resources, {len(self.errors)} errors')
+        for description, duration_seconds, res in sorted(self.steps, key=lambda step: -step[1])[:num_slowest_steps]:
+            print(f'  {duration_seconds:.1f}s {description}{"" if res == 0 else f" (exit code {res})"}')
+
+
+def terminate_servers(name_prefix, result=None, servers=None, max_workers=config.TEARDOWN_MAX_WORKERS, retries=config.TEARDOWN_RETRIES):
+    # each server is terminated as soon as its own poweroff completed
+    if result is None:
+        result = TeardownResult()
+    if servers is None:
+        servers = inventory.list_servers(name_prefix)
+    print(f'Found {len([s for s in servers if s.get("power") == "on"])} servers to power off')
+    print(f'Found {len(servers)} servers to terminate')
+
+    def teardown_server(server):
+        server_name = server["name"]
+        if server.get("power") == "on":
+            print(f"Powering off server {server_name}...")
+            result.run_step(
+                f'poweroff server {server_name}',
+                lambda: cloudcli("server", "poweroff", "--name", server_name, "--wait", run=True).returncode,
+                error=f'Failed to poweroff server: {server_name}', retries=retries
+            )
         print(f"Terminating server {server_name}...")
-        processes[server_name] = cloudcli("server", "terminate", "--name", server_name, "--force", "--wait", popen=True)
-    for server_name, process in processes.items():
-        res = process.wait()
-        if res != 0:
-            errors.append(f'Failed to terminate server: {server_name} (exit code {res})')
-    return errors
+        result.run_step(
+            f'terminate server {server_name}',
+            lambda: cloudcli("server", "terminate", "--name", server_name, "--force", "--wait", run=True).returncode,
+            deleted=f'server {server_name}', error=f'Failed to terminate server: {server_name}', retries=retries
+        )
+
+    if servers:
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            list(executor.map(tracing.propagate(cassette.forked(teardown_server)), servers))
+    inventory.invalidate(name_prefix)
+    return result.errors
 
 
-def terminate_networks(datacenter_id, name_prefix):
+def terminate_networks(datacenter_id, name_prefix, result=None, networks=None, max_workers=config.TEARDOWN_MAX_WORKERS, retries=config.TEARDOWN_RETRIES):
     print(f"Terminating networks for datacenter_id {datacenter_id}...")
-    errors = []
+    if result is None:
+        result = TeardownResult()
+    if networks is None:
+        networks = inventory.list_networks(datacenter_id, name_prefix)
     network_vlan_ids = set()
     network_ids = set()
-    for network in cloudcli("network", "list", "--datacenter", datacenter_id, parse_json=True):
-        for name in network['names']:
-            if name_prefix in name:
-                network_vlan_ids.add(network["vlanId"])
-                for id_ in network["ids"]:
-                    network_ids.add(id_)
-    for network_vlan_id in network_vlan_ids:
-        for subnet in cloudcli("network", "subnet_list", "--vlanId", str(network_vlan_id), "--datacenter", datacenter_id, parse_json=True):
-            res = cloudcli("network", "subnet_delete", "--subnetId", str(subnet["subnetId"]), run=True)
-            if res.returncode != 0:
-                errors.append(f'Failed to delete subnet {subnet["subnetId"]} in vlan {network_vlan_id} in datacenter {datacenter_id}')
-    for network_id in network_ids:
-        res = cloudcli("network", "delete", "--id", str(network_id), "--datacenter", datacenter_id, run=True)
-        if res.returncode != 0:
-            errors.append(f'Failed to delete network {network_id} in datacenter {datacenter_id}')
-    return errors
+    for network in networks:
+        network_vlan_ids.add(network["vlanId"])
+        for id_ in network["ids"]:
+            network_ids.add(id_)
+
+    def list_subnets(network_vlan_id):
+        subnets = []
+        result.run_step(
+            f'list subnets of vlan {network_vlan_id} in datacenter {datacenter_id}',
+            lambda: subnets.extend(cloudcli("network", "subnet_list", "--vlanId", str(network_vlan_id), "--datacenter", datacenter_id, parse_json=True)) or 0,
+            error=f'Failed to list subnets in vlan {network_vlan_id} in datacenter {datacenter_id}', retries=retries
+        )
+        return [(network_vlan_id, subnet) for subnet in subnets]
+
+    def delete_subnet(network_vlan_id, subnet):
+        result.run_step(
+            f'delete subnet {subnet["subnetId"]} in datacenter {datacenter_id}',
+            lambda: cloudcli("network", "subnet_delete", "--subnetId", str(subnet["subnetId"]), run=True).returncode,
+            deleted=f'subnet {subnet["subnetId"]}',
+            error=f'Failed to delete subnet {subnet["subnetId"]} in vlan {network_vlan_id} in datacenter {datacenter_id}', retries=retries
+        )
+
+    def delete_network(network_id):
+        result.run_step(
+            f'delete network {network_id} in datacenter {datacenter_id}',
+            lambda: cloudcli("network", "delete", "--id", str(network_id), "--datacenter", datacenter_id, run=True).returncode,
+            deleted=f'network {network_id}',
+            error=f'Failed to delete network {network_id} in datacenter {datacenter_id}', retries=retries
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        subnets = [subnet for subnets in executor.map(tracing.propagate(cassette.forked(list_subnets)), network_vlan_ids) for subnet in subnets]
+        list(executor.map(tracing.propagate(cassette.forked(lambda subnet: delete_subnet(*subnet))), subnets))
+        list(executor.map(tracing.propagate(cassette.forked(delete_network)), network_ids))
+    inventory.invalidate(name_prefix, datacenter_id)
+    return result.errors
 
 
+@tracing.traced("destroy", ("name_prefix", "datacenter_id"))
 def main(name_prefix=None, datacenter_id=None, force=False):
-    tfdir = os.path.join(os.path.dirname(__file__), "..", "..", "..")
+    tfdir = workspace.get_tfdir()
+    if tfdir == workspace.ROOT_TFDIR and name_prefix and workspace.exists(name_prefix):
+        tfdir = workspace.get_workspace_tfdir(name_prefix)
     if not name_prefix or not datacenter_id:
         if os.path.exists(os.path.join(tfdir, "01-rke2", "ktb.auto.tfvars.json")):
             with open(os.path.join(tfdir, "01-rke2", "ktb.auto.tfvars.json")) as f:
@@ -93,14 +174,18 @@ def main(name_prefix=None, datacenter_id=None, force=False):
                     datacenter_id = tfvars.get("datacenter_id")
     assert name_prefix
     assert datacenter_id
-    errors = []
-    errors += terminate_servers(name_prefix)
+    start_time = time.time()
+    result = TeardownResult()
+    terminate_servers(name_prefix, result)
     if "," in datacenter_id:
         datacenter_ids = [dc.strip() for dc in datacenter_id.split(",")]
     else:
         datacenter_ids = [datacenter_id]
-    for dc_id in datacenter_ids:
-        errors += terminate_networks(dc_id, name_prefix)
+    with concurrent.futures.ThreadPoolExecutor(len(datacenter_ids)) as executor:
+        list(executor.map(tracing.propagate(cassette.forked(lambda dc_id: terminate_networks(dc_id, name_prefix, result))), datacenter_ids))
+    result.print_summary()
+    print(f'Teardown took {time.time() - start_time:.1f} seconds')
+    errors = result.errors
     if errors and not force:
         raise Exception("Errors occurred during termination:\n" + "\n".join(errors))
     subprocess.check_call(["bash", "-c", '''
@@ -108,8 +193,12 @@ def main(name_prefix=None, datacenter_id=None, force=False):
         rm -rf */terraform.tfstate*
         rm -rf */.terraform*
         rm -rf */ssh_known_hosts.*
+        rm -f 01-rke2/bootstrap.json
         rm -f .kubeconfig ssh_config ssh_known_hosts .cluster_token
     '''], cwd=tfdir)
+    if tfdir != workspace.ROOT_TFDIR:
+        shutil.rmtree(tfdir, ignore_errors=True)
     print("Destroyed all resources.")
     if errors:
         raise Exception("Errors occurred during termination:\n" + "\n".join(errors))
+    return result
@@ -0,0 +1,104 @@
+import re
+import datetime
+
+from . import config, destroy, inventory, workspace, cluster_pool
+
+
+def get_name_prefix_re(prefix):
+    # matches name prefixes generated by setup.generate_name_prefix: <prefix><MMDD><4 hex chars>
+    return re.compile(rf'({re.escape(prefix)}(\d{{2}})(\d{{2}})[0-9a-f]{{4}})(?=-)')
+
+
+def get_name_prefix_date(month, day, now):
+    # the year is not encoded, assume the latest date which is not in the future
+    try:
+        date = datetime.datetime(now.year, month, day)
+    except ValueError:
+        return None
+    if date > now:
+        try:
+            date = date.replace(year=now.year - 1)
+        except ValueError:
+            return None
+    return date
+
+
+def find_clusters(datacenter_ids, prefix="kca", now=None):
+    # single inventory fetch for all servers in the account and one per datacenter for networks
+    now = now or datetime.datetime.now()
+    name_prefix_re = get_name_prefix_re(prefix)
+    clusters = {}
+
+    def get_cluster(match):
+        name_prefix = match.group(1)
+        if name_prefix not in clusters:
+            clusters[name_prefix] = {
+                "date": get_name_prefix_date(int(match.group(2)), int(match.group(3)), now),
+                "servers": [],
+                "networks": {},
+            }
+        return clusters[name_prefix]
+
+    for server in inventory.list_servers(prefix, ttl_seconds=0):
+        match = name_prefix_re.match(server["name"])
+        if match and (not server.get("datacenter") or server["datacenter"] in datacenter_ids):
+            get_cluster(match)["servers"].append(server)
+    for datacenter_id in datacenter_ids:
+        for network in inventory.list_networks(datacenter_id, prefix, ttl_seconds=0):
+            for name in network["names"]:
+                match = name_prefix_re.search(name)
+                if match:
+                    get_cluster(match)["networks"].setdefault(datacenter_id, []).append(network)
+                    break
+    return clusters
+
+
+def is_stale(cluster, max_age_hours, now):
+    if not cluster["date"]:
+        return False
+    # only the date is encoded, so the age is counted from the end of that day
+    age = now - (cluster["date"] + datetime.timedelta(days=1))
+    return age >= datetime.timedelta(hours=max_age_hours)
+
+
+def get_protected_name_prefixes():
+    # pool clusters (warm, leased or being reset) and clusters of workspaces which are currently in use
+    return {
+        **{name_prefix: "pool" for name_prefix in cluster_pool.get_name_prefixes()},
+        **{name_prefix: "in use" for name_prefix in workspace.list_workspaces() if workspace.is_in_use(name_prefix)},
+    }
+
+
+def main(datacenter_id, prefix="kca", max_age_hours=24, keep=None, dry_run=False, force=False, max_workers=config.TEARDOWN_MAX_WORKERS):
+    now = datetime.datetime.now()
+    datacenter_ids = [dc.strip() for dc in datacenter_id.split(",")]
+    clusters = find_clusters(datacenter_ids, prefix, now)
+    protected_name_prefixes = get_protected_name_prefixes()
+    stale_clusters = {
+        name_prefix: cluster for name_prefix, cluster in sorted(clusters.items())
+        if is_stale(cluster, max_age_hours, now) and name_prefix not in (keep or []) and name_prefix not in protected_name_prefixes
+    }
+    print(f'Found {len(clusters)} clusters, {len(stale_clusters)} stale (older than {max_age_hours} hours)')
+    for name_prefix, cluster in sorted(clusters.items()):
+        networks = ", ".join(f'{dc}: {len(networks)}' for dc, networks in cluster["networks"].items())
+        print(
+            f'  {"DELETE" if name_prefix in stale_clusters else "keep  "} {name_prefix} '
+            f'date={cluster["date"].date() if cluster["date"] else "?"} '
+            f'servers={len(cluster["servers"])} networks=({networks})'
+            f'{f" ({protected_name_prefixes[name_prefix]})" if name_prefix in protected_name_prefixes else ""}'
+        )
+    if dry_run or not stale_clusters:
+        return stale_clusters
+    result = destroy.TeardownResult()
+    # the servers of all stale clusters share a single bounded pool, then the networks, which can only be deleted once their servers are gone
+    destroy.terminate_servers(prefix, result, servers=[server for cluster in stale_clusters.values() for server in cluster["servers"]], max_workers=max_workers)
+    for dc_id in datacenter_ids:
+        networks = [network for cluster in stale_clusters.values() for network in cluster["networks"].get(dc_id, [])]
+        if networks:
+            destroy.terminate_networks(dc_id, prefix, result, networks=networks, max_workers=max_workers)
+    for name_prefix in stale_clusters:
+        workspace.remove(name_prefix)
+    result.print_summary()
+    if result.errors and not force:
+        raise Exception("Errors occurred during garbage collection:\n" + "\n".join(result.errors))
+    return stale_clusters
@@ -0,0 +1,118 @@
+import json
+import time
+import threading
+import collections
+import dataclasses
+import http.client
+
+from . import k8s_api, util
+
+
+@dataclasses.dataclass
+class BenchResult:
+    start_time: float = dataclasses.field(default_factory=time.time)
+    end_time: float = None
+    latencies: list = dataclasses.field(default_factory=list)
+    errors: collections.Counter = dataclasses.field(default_factory=collections.Counter)
+    status_codes: collections.Counter = dataclasses.field(default_factory=collections.Counter)
+    pods: collections.Counter = dataclasses.field(default_factory=collections.Counter)
+    ip_pods: dict = dataclasses.field(default_factory=dict)  # ip -> Counter of pod names
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, ip, latency_seconds, status=None, pod=None, error=None):
+        with self.lock:
+            if error:
+                self.errors[error] += 1
+                return
+            self.status_codes[status] += 1
+            if status == 200:
+                self.latencies.append(latency_seconds)
+                self.pods[pod] += 1
+                self.ip_pods.setdefault(ip, collections.Counter())[pod] += 1
+            else:
+                self.errors[f'status {status}'] += 1
+
+    def get_summary(self):
+        with self.lock:
+            duration_seconds = (self.end_time or time.time()) - self.start_time
+            num_requests = sum(self.status_codes.values()) + sum(self.errors[e] for e in self.errors if not e.startswith("status "))
+            num_errors = sum(self.errors.values())
+            return {
+                "duration_seconds": round(duration_seconds, 3),
+                "requests": num_requests,
+                "rps": round(num_requests / duration_seconds, 2) if duration_seconds else None,
+                "error_rate": round(num_errors / num_requests, 4) if num_requests else None,
+                "errors": dict(self.errors),
+                "latency_ms": {
+                    f"p{p}": round(util.percentile(self.latencies, p) * 1000, 2) if self.latencies else None
+                    for p in (50, 95, 99)
+                },
+                "pods": dict(self.pods),
+                "ip_pods": {ip: dict(pods) for ip, pods in self.ip_pods.items()},
+            }
+
+
+def run(
+    ips, concurrency=10, duration_seconds=10, host="demo.example.com", port=80, path="/", timeout_seconds=5,
+    stop_condition=None, result=None
+):
+    # each worker keeps its own keep-alive connection to one of the ips, workers are spread evenly over the ips
+    assert ips
+    result = result or BenchResult()
+    deadline = time.time() + duration_seconds
+    stop_event = threading.Event()
+
+    def worker(ip):
+        conn = None
+        while not stop_event.is_set() and time.time() < deadline:
+            if conn is None:
+                conn = http.client.HTTPConnection(ip, port, timeout=timeout_seconds)
+            start_time = time.time()
+            try:
+                conn.request("GET", path, headers={"Host": host})
+                res = conn.getresponse()
+                body = res.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                conn = None
+                result.add(ip, time.time() - start_time, error=type(e).__name__)
+                # avoid busy looping on connection errors
+                stop_event.wait(0.5)
+                continue
+            result.add(ip, time.time() - start_time, res.status, body.decode(errors="replace").strip())
+            if res.will_close:
+                conn.close()
+                conn = None
+            if stop_condition and stop_condition(result):
+                stop_event.set()
+        if conn:
+            conn.close()
+
+    threads = [threading.Thread(target=worker, args=(ips[i % len(ips)],), daemon=True) for i in range(max(concurrency, len(ips)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.end_time = time.time()
+    return result
+
+
+def get_worker_external_ips():
+    client = k8s_api.get_client(util.get_kubeconfig())
+    return [
+        node["metadata"]["annotations"]["rke2.io/external-ip"]
+        for node in client.list("nodes")["items"]
+        if "node-role.kubernetes.io/control-plane" not in node["metadata"].get("labels", {})
+        and "rke2.io/external-ip" in node["metadata"].get("annotations", {})
+    ]
+
+
+def main(ips=None, concurrency=10, duration_seconds=10, host="demo.example.com", port=80, output=None):
+    ips = [ip.strip() for ip in ips.split(",")] if ips else get_worker_external_ips()
+    print(f'Benchmarking http://{host}{f":{port}" if port != 80 else ""}/ on {", ".join(ips)} with concurrency {concurrency} for {duration_seconds} seconds')
+    summary = run(ips, concurrency=concurrency, duration_seconds=duration_seconds, host=host, port=port).get_summary()
+    if output:
+        with open(output, "w") as f:
+            json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
+    return summary
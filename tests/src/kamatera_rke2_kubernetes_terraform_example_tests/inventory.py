@@ -0,0 +1,113 @@
+import re
+import time
+import threading
+
+from . import config, destroy
+
+
+_lock = threading.RLock()
+_servers_list = None
+_servers_info = {}
+_networks = {}
+
+
+def _is_fresh(entry, ttl_seconds):
+    if ttl_seconds is None:
+        ttl_seconds = config.INVENTORY_TTL_SECONDS
+    return entry is not None and time.time() - entry["time"] < ttl_seconds
+
+
+def _index_server_ips(server):
+    ips = {}
+    for network in server.get("networks", []):
+        network_type = network["network"].split("-", 1)[0]
+        ips.setdefault(network_type, []).extend(network.get("ips", []))
+    return ips
+
+
+def list_servers(name_prefix="", ttl_seconds=None):
+    # server list of the whole account (name, power, datacenter), fetched with a single cloudcli call
+    global _servers_list
+    with _lock:
+        if not _is_fresh(_servers_list, ttl_seconds):
+            _servers_list = {
+                "time": time.time(),
+                "servers": destroy.cloudcli("server", "list", parse_json=True),
+            }
+        return [server for server in _servers_list["servers"] if server["name"].startswith(name_prefix)]
+
+
+def _get_servers_entry(name_prefix, ttl_seconds=None):
+    # a fresh fetch of a shorter prefix is reused to serve lookups of longer prefixes / exact names, expired fetches are dropped
+    assert name_prefix
+    with _lock:
+        for cached_prefix, entry in list(_servers_info.items()):
+            if not _is_fresh(entry, max(ttl_seconds or 0, config.INVENTORY_TTL_SECONDS)):
+                del _servers_info[cached_prefix]
+        for cached_prefix, entry in _servers_info.items():
+            if name_prefix.startswith(cached_prefix) and _is_fresh(entry, ttl_seconds):
+                return entry
+        servers = destroy.cloudcli("server", "info", "--name", f"{re.escape(name_prefix)}.*", parse_json=True)
+        entry = _servers_info[name_prefix] = {
+            "time": time.time(),
+            "servers": {server["name"]: server for server in servers},
+            "ips": {server["name"]: _index_server_ips(server) for server in servers},
+        }
+        return entry
+
+
+def get_servers(name_prefix, ttl_seconds=None):
+    # detailed server info (including networks) for all servers starting with name_prefix
+    entry = _get_servers_entry(name_prefix, ttl_seconds)
+    return {
+        name: server for name, server in entry["servers"].items()
+        if name.startswith(name_prefix)
+    }
+
+
+def get_server(name, name_prefix=None, ttl_seconds=None):
+    server = get_servers(name_prefix or name, ttl_seconds=ttl_seconds).get(name)
+    assert server, f"server not found: {name}"
+    return server
+
+
+def get_server_ips(name, network_type, name_prefix=None, ttl_seconds=None):
+    # network_type is the prefix of the Kamatera network name: "wan" (public) or "lan" (private)
+    # read from the same fetch which served the lookup, not from another cached (possibly older) one
+    entry = _get_servers_entry(name_prefix or name, ttl_seconds)
+    assert name in entry["servers"], f"server not found: {name}"
+    return entry["ips"][name].get(network_type, [])
+
+
+def get_server_ip(name, network_type, name_prefix=None, ttl_seconds=None):
+    ips = get_server_ips(name, network_type, name_prefix=name_prefix, ttl_seconds=ttl_seconds)
+    assert ips, f"no {network_type} ip for server {name}"
+    return ips[0]
+
+
+def list_networks(datacenter_id, name_prefix="", ttl_seconds=None):
+    with _lock:
+        entry = _networks.get(datacenter_id)
+        if not _is_fresh(entry, ttl_seconds):
+            entry = _networks[datacenter_id] = {
+                "time": time.time(),
+                "networks": destroy.cloudcli("network", "list", "--datacenter", datacenter_id, parse_json=True),
+            }
+        return [
+            network for network in entry["networks"]
+            if any(name_prefix in name for name in network["names"])
+        ]
+
+
+def invalidate(name_prefix=None, datacenter_id=None):
+    # must be called after creating, terminating or changing power state of servers / networks
+    global _servers_list
+    with _lock:
+        _servers_list = None
+        for cached_prefix in list(_servers_info):
+            if not name_prefix or cached_prefix.startswith(name_prefix) or name_prefix.startswith(cached_prefix):
+                del _servers_info[cached_prefix]
+        if datacenter_id:
+            _networks.pop(datacenter_id, None)
+        elif not name_prefix:
+            _networks.clear()
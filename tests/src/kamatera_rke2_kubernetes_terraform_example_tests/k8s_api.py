@@ -0,0 +1,508 @@
+import os
+import ssl
+import json
+import time
+import queue
+import base64
+import tempfile
+import threading
+import http.client
+import urllib.parse
+import concurrent.futures
+
+from ruamel.yaml import YAML
+
+from . import config
+
+
+yaml = YAML(typ='safe', pure=True)
+
+
+# resource name: (api prefix, namespaced)
+RESOURCES = {
+    "nodes": ("/api/v1", False),
+    "namespaces": ("/api/v1", False),
+    "pods": ("/api/v1", True),
+    "services": ("/api/v1", True),
+    "events": ("/api/v1", True),
+    "deployments": ("/apis/apps/v1", True),
+    "ingresses": ("/apis/networking.k8s.io/v1", True),
+}
+
+RESOURCE_ALIASES = {
+    "node": "nodes", "no": "nodes",
+    "namespace": "namespaces", "ns": "namespaces",
+    "pod": "pods", "po": "pods",
+    "service": "services", "svc": "services",
+    "event": "events", "ev": "events",
+    "deployment": "deployments", "deploy": "deployments",
+    "ingress": "ingresses", "ing": "ingresses",
+}
+
+KIND_RESOURCES = {
+    "Node": "nodes",
+    "Namespace": "namespaces",
+    "Pod": "pods",
+    "Service": "services",
+    "Event": "events",
+    "Deployment": "deployments",
+    "Ingress": "ingresses",
+}
+
+FIELD_MANAGER = "kamatera-rke2-kubernetes-terraform-example-tests"
+
+
+class ApiError(Exception):
+
+    def __init__(self, method, path, status, body):
+        super().__init__(f"{method} {path} failed with status {status}: {body[:500]}")
+        self.status = status
+        self.body = body
+
+
+class NodeSummary:
+    # the fields of a node used by the tests, much smaller than the full node object
+    __slots__ = ("name", "ready", "unschedulable", "external_ip")
+
+    def __init__(self, name, ready, unschedulable=False, external_ip=None):
+        self.name = name
+        self.ready = ready
+        self.unschedulable = unschedulable
+        self.external_ip = external_ip
+
+    @classmethod
+    def from_object(cls, node):
+        return cls(
+            node["metadata"]["name"],
+            any(
+                condition.get("type") == "Ready" and condition.get("status") == "True"
+                for condition in node.get("status", {}).get("conditions", [])
+            ),
+            bool(node.get("spec", {}).get("unschedulable")),
+            (node["metadata"].get("annotations") or {}).get("rke2.io/external-ip"),
+        )
+
+    def __repr__(self):
+        return f"NodeSummary({self.name!r}, ready={self.ready}, unschedulable={self.unschedulable}, external_ip={self.external_ip!r})"
+
+
+class PodSummary:
+    __slots__ = ("name", "namespace", "phase", "node_name")
+
+    def __init__(self, name, namespace, phase, node_name=None):
+        self.name = name
+        self.namespace = namespace
+        self.phase = phase
+        self.node_name = node_name
+
+    @classmethod
+    def from_object(cls, pod):
+        return cls(
+            pod["metadata"]["name"], pod["metadata"].get("namespace"),
+            pod.get("status", {}).get("phase"), pod.get("spec", {}).get("nodeName"),
+        )
+
+    def __repr__(self):
+        return f"PodSummary({self.name!r}, namespace={self.namespace!r}, phase={self.phase!r}, node_name={self.node_name!r})"
+
+
+def get_resource(resource):
+    resource = resource.lower()
+    resource = RESOURCE_ALIASES.get(resource, resource)
+    assert resource in RESOURCES, f"unsupported resource: {resource}"
+    return resource
+
+
+def is_supported_resource(resource):
+    resource = resource.lower()
+    return RESOURCE_ALIASES.get(resource, resource) in RESOURCES
+
+
+def is_supported_object(obj):
+    return isinstance(obj, dict) and obj.get("kind") in KIND_RESOURCES and bool((obj.get("metadata") or {}).get("name"))
+
+
+class Client:
+
+    def __init__(self, kubeconfig, timeout_seconds=60, max_idle_connections=4):
+        with open(kubeconfig) as f:
+            kubeconfig_data = yaml.load(f)
+        context_name = kubeconfig_data.get("current-context")
+        context = next(c["context"] for c in kubeconfig_data["contexts"] if not context_name or c["name"] == context_name)
+        cluster = next(c["cluster"] for c in kubeconfig_data["clusters"] if c["name"] == context["cluster"])
+        user = next((u["user"] for u in kubeconfig_data.get("users", []) if u["name"] == context.get("user")), {})
+        # the other control plane servers of an HA cluster are in clusters named <cluster>@<server name>, see get_ha_kubeconfig
+        self.servers = [urllib.parse.urlparse(cluster["server"])] + [
+            urllib.parse.urlparse(c["cluster"]["server"])
+            for c in kubeconfig_data["clusters"] if c["name"].startswith(f'{context["cluster"]}@')
+        ]
+        self.server = self.servers[0]
+        self.server_latencies = {}
+        self._selected_time = None
+        self._select_lock = threading.Lock()
+        self.timeout_seconds = timeout_seconds
+        self.headers = {"Accept": "application/json"}
+        if user.get("token"):
+            self.headers["Authorization"] = f'Bearer {user["token"]}'
+        self.ssl_context = None
+        if self.server.scheme == "https":
+            self.ssl_context = self._get_ssl_context(cluster, user)
+        self._idle_connections = queue.LifoQueue(max_idle_connections)
+
+    def _get_ssl_context(self, cluster, user):
+        if cluster.get("insecure-skip-tls-verify"):
+            ssl_context = ssl._create_unverified_context()
+        elif cluster.get("certificate-authority-data"):
+            ssl_context = ssl.create_default_context(cadata=base64.b64decode(cluster["certificate-authority-data"]).decode())
+        else:
+            ssl_context = ssl.create_default_context(cafile=cluster.get("certificate-authority"))
+        if user.get("client-certificate-data"):
+            # load_cert_chain only accepts files, they are read immediately so can be deleted right after
+            with tempfile.TemporaryDirectory() as tmpdir:
+                certfile, keyfile = os.path.join(tmpdir, "cert.pem"), os.path.join(tmpdir, "key.pem")
+                with open(certfile, "wb") as f:
+                    f.write(base64.b64decode(user["client-certificate-data"]))
+                with open(keyfile, "wb") as f:
+                    f.write(base64.b64decode(user["client-key-data"]))
+                ssl_context.load_cert_chain(certfile, keyfile)
+        elif user.get("client-certificate"):
+            ssl_context.load_cert_chain(user["client-certificate"], user.get("client-key"))
+        return ssl_context
+
+    def _new_connection(self, timeout_seconds=None, server=None):
+        timeout_seconds = timeout_seconds or self.timeout_seconds
+        server = server or self.server
+        if self.ssl_context:
+            conn = http.client.HTTPSConnection(server.hostname, server.port or 443, timeout=timeout_seconds, context=self.ssl_context)
+        else:
+            conn = http.client.HTTPConnection(server.hostname, server.port or 80, timeout=timeout_seconds)
+        conn.server = server
+        return conn
+
+    def _get_connection(self):
+        # idle connections to a server which is no longer selected are closed
+        while True:
+            try:
+                conn = self._idle_connections.get_nowait()
+            except queue.Empty:
+                return self._new_connection(), False
+            if conn.server == self.server:
+                return conn, True
+            conn.close()
+
+    def probe(self, server):
+        # /readyz latency of the server, None if it's not ready or not reachable
+        start_time = time.time()
+        conn = self._new_connection(config.K8S_ENDPOINT_PROBE_TIMEOUT_SECONDS, server)
+        try:
+            conn.request("GET", server.path.rstrip("/") + "/readyz", headers=self.headers)
+            res = conn.getresponse()
+            res.read()
+            return time.time() - start_time if res.status == 200 else None
+        except (http.client.HTTPException, OSError):
+            return None
+        finally:
+            conn.close()
+
+    def select_server(self, failed_server=None):
+        # switches to the fastest ready server, the current server is kept if no other server is ready
+        with self._select_lock:
+            servers = [server for server in self.servers if server != failed_server]
+            with concurrent.futures.ThreadPoolExecutor(len(servers)) as executor:
+                latencies = dict(zip(servers, executor.map(self.probe, servers)))
+            self.server_latencies = {server.netloc: latency for server, latency in latencies.items()}
+            ready_servers = [server for server in servers if latencies[server] is not None]
+            if ready_servers:
+                self.server = min(ready_servers, key=lambda server: latencies[server])
+            self._selected_time = time.time()
+            return self.server
+
+    def verify_ca(self):
+        # False if the CA no longer verifies the servers (e.g. the cluster was recreated) or none of them is reachable
+        for server in self.servers:
+            conn = self._new_connection(config.K8S_ENDPOINT_PROBE_TIMEOUT_SECONDS, server)
+            try:
+                conn.connect()
+                return True
+            except ssl.SSLCertVerificationError:
+                return False
+            except OSError:
+                continue
+            finally:
+                conn.close()
+        return False
+
+    def _release(self, conn):
+        try:
+            self._idle_connections.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle_connections.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def request(self, method, path, query=None, body=None, content_type="application/json", raw=False):
+        if query:
+            path = f'{path}?{urllib.parse.urlencode({k: v for k, v in query.items() if v is not None})}'
+        headers = dict(self.headers)
+        if body is not None:
+            headers["Content-Type"] = content_type
+            if not isinstance(body, (str, bytes)):
+                body = json.dumps(body)
+            if isinstance(body, str):
+                body = body.encode()
+        if len(self.servers) > 1 and (self._selected_time is None or time.time() - self._selected_time > config.K8S_ENDPOINT_RESELECT_SECONDS):
+            self.select_server()
+        retried_reused = False
+        failovers = 0
+        while True:
+            conn, is_reused = self._get_connection()
+            try:
+                conn.request(method, conn.server.path.rstrip("/") + path, body=body, headers=headers)
+                res = conn.getresponse()
+                data = res.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if is_reused and not retried_reused:
+                    # idle keep-alive connection was closed by the server, retry once with a new connection
+                    retried_reused = True
+                    continue
+                if failovers < len(self.servers) - 1 and self.select_server(conn.server) != conn.server:
+                    failovers += 1
+                    continue
+                raise
+            if res.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            if res.status >= 400:
+                raise ApiError(method, path, res.status, data.decode(errors="replace"))
+            return data if raw else json.loads(data)
+
+    def get_path(self, resource, namespace=None, name=None, subresource=None):
+        resource = get_resource(resource)
+        prefix, namespaced = RESOURCES[resource]
+        path = prefix
+        if namespaced and namespace:
+            path += f"/namespaces/{namespace}"
+        path += f"/{resource}"
+        if name:
+            path += f"/{name}"
+            if subresource:
+                path += f"/{subresource}"
+        return path
+
+    def list(self, resource, namespace=None, label_selector=None, field_selector=None):
+        return self.request("GET", self.get_path(resource, namespace), query={
+            "labelSelector": label_selector,
+            "fieldSelector": field_selector,
+        })
+
+    def list_items(self, resource, namespace=None, label_selector=None, field_selector=None, limit=config.K8S_LIST_PAGE_SIZE):
+        # yields the items one by one, fetched in pages using limit / continue
+        # only a single page is held in memory and each item is released once it was consumed
+        continue_token = None
+        while True:
+            data = self.request("GET", self.get_path(resource, namespace), query={
+                "labelSelector": label_selector,
+                "fieldSelector": field_selector,
+                "limit": str(limit) if limit else None,
+                "continue": continue_token,
+            })
+            continue_token = data["metadata"].get("continue")
+            items = data.pop("items")
+            data = None
+            items.reverse()
+            while items:
+                yield items.pop()
+            if not continue_token:
+                break
+
+    def _retry_expired(self, func, attempts=3):
+        # restarts a paginated list if the continue token expired (410) before all pages were fetched
+        for attempt in range(attempts):
+            try:
+                return func()
+            except ApiError as e:
+                if e.status != 410 or attempt == attempts - 1:
+                    raise
+
+    def list_summaries(self, resource, summary_class, namespace=None, label_selector=None, field_selector=None, limit=config.K8S_LIST_PAGE_SIZE):
+        # paginated list which only keeps the compact summary of each object
+        return self._retry_expired(lambda: [
+            summary_class.from_object(item)
+            for item in self.list_items(resource, namespace, label_selector, field_selector, limit)
+        ])
+
+    def count(self, resource, summary_class, predicate, namespace=None, label_selector=None, field_selector=None, limit=config.K8S_LIST_PAGE_SIZE):
+        # returns (total, number of summaries matching predicate) without keeping the objects
+
+        def count_pages():
+            total = matching = 0
+            for item in self.list_items(resource, namespace, label_selector, field_selector, limit):
+                total += 1
+                if predicate(summary_class.from_object(item)):
+                    matching += 1
+            return total, matching
+
+        return self._retry_expired(count_pages)
+
+    def get(self, resource, name, namespace=None):
+        return self.request("GET", self.get_path(resource, namespace, name))
+
+    def apply(self, obj, field_manager=FIELD_MANAGER, force=True):
+        resource = KIND_RESOURCES[obj["kind"]]
+        return self.request(
+            "PATCH", self.get_path(resource, obj["metadata"].get("namespace"), obj["metadata"]["name"]),
+            query={"fieldManager": field_manager, "force": "true" if force else None},
+            body=obj, content_type="application/apply-patch+yaml"
+        )
+
+    def scale(self, resource, name, replicas, namespace=None):
+        return self.request(
+            "PATCH", self.get_path(resource, namespace, name, "scale"),
+            body={"spec": {"replicas": replicas}}, content_type="application/merge-patch+json"
+        )
+
+    def delete(self, resource, name, namespace=None, ignore_not_found=False):
+        try:
+            return self.request("DELETE", self.get_path(resource, namespace, name))
+        except ApiError as e:
+            if ignore_not_found and e.status == 404:
+                return None
+            raise
+
+    def watch(self, resource, namespace=None, label_selector=None, field_selector=None, resource_version=None, timeout_seconds=60):
+        # yields watch events, ends when the server closes the stream after timeout_seconds
+        # uses a dedicated connection so that long running streams don't hold pooled connections
+        query = urllib.parse.urlencode({k: v for k, v in {
+            "watch": "1",
+            "allowWatchBookmarks": "true",
+            "resourceVersion": resource_version,
+            "timeoutSeconds": str(int(timeout_seconds)),
+            "labelSelector": label_selector,
+            "fieldSelector": field_selector,
+        }.items() if v is not None})
+        path = f'{self.get_path(resource, namespace)}?{query}'
+        conn = self._new_connection(timeout_seconds=timeout_seconds + 30)
+        try:
+            try:
+                conn.request("GET", conn.server.path.rstrip("/") + path, headers=self.headers)
+                res = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                # the watch is restarted by the caller, on another server if this one is down
+                if len(self.servers) > 1:
+                    self.select_server(conn.server)
+                raise
+            if res.status >= 400:
+                raise ApiError("GET", path, res.status, res.read().decode(errors="replace"))
+            while True:
+                line = res.readline()
+                if not line:
+                    break
+                if line.strip():
+                    event = json.loads(line)
+                    if event["type"] == "ERROR":
+                        raise ApiError("GET", path, event["object"].get("code"), json.dumps(event["object"]))
+                    yield event
+        finally:
+            conn.close()
+
+    def exists(self, resource, name, namespace=None):
+        try:
+            self.get(resource, name, namespace)
+            return True
+        except ApiError as e:
+            if e.status == 404:
+                return False
+            raise
+
+
+def get_object_key(obj):
+    metadata = obj["metadata"]
+    return f'{metadata["namespace"]}/{metadata["name"]}' if metadata.get("namespace") else metadata["name"]
+
+
+def watch_objects(client, resource, namespace=None, label_selector=None, field_selector=None, timeout_seconds=60, stop_event=None):
+    # keeps an up to date store of objects using list + watch, resuming the watch from the last seen resourceVersion
+    # yields (event_type, obj, objects) for each change, event_type is "SYNC" after a full (re)list
+    objects = None
+    resource_version = None
+    while not (stop_event and stop_event.is_set()):
+        if objects is None:
+            data = client.list(resource, namespace, label_selector, field_selector)
+            objects = {get_object_key(obj): obj for obj in data["items"]}
+            resource_version = data["metadata"].get("resourceVersion")
+            yield "SYNC", None, objects
+        try:
+            for event in client.watch(resource, namespace, label_selector, field_selector, resource_version, timeout_seconds):
+                obj = event["object"]
+                resource_version = obj["metadata"].get("resourceVersion") or resource_version
+                if event["type"] == "BOOKMARK":
+                    continue
+                elif event["type"] == "DELETED":
+                    objects.pop(get_object_key(obj), None)
+                else:
+                    objects[get_object_key(obj)] = obj
+                yield event["type"], obj, objects
+                if stop_event and stop_event.is_set():
+                    break
+            else:
+                # stream ended by the server timeout, yield so that the caller can check deadlines
+                yield "TIMEOUT", None, objects
+        except ApiError as e:
+            if e.status == 410:
+                # resourceVersion is too old, need to relist
+                objects = None
+            else:
+                raise
+
+
+_clients_lock = threading.Lock()
+_clients = {}
+
+
+def get_client(kubeconfig):
+    # clients are cached per kubeconfig file, a new client is created if the file changed
+    key = os.path.realpath(kubeconfig)
+    mtime = os.path.getmtime(key)
+    with _clients_lock:
+        cached = _clients.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        if cached:
+            cached[1].close()
+        client = Client(kubeconfig, timeout_seconds=config.K8S_API_TIMEOUT_SECONDS)
+        _clients[key] = (mtime, client)
+        return client
+
+
+def write_ha_kubeconfig(kubeconfig, rke2_kubeconfig, servers):
+    # rke2.yaml with a cluster / context per control plane server, same as 01-rke2/05-kubeconfig.tf
+    # servers is a list of (server name, public ip), the first one is the default cluster
+    data = yaml.load(rke2_kubeconfig)
+    [cluster], [context] = data["clusters"], data["contexts"]
+    clusters, contexts = [], []
+    for i, (server_name, ip) in enumerate(servers):
+        name = cluster["name"] if i == 0 else f'{cluster["name"]}@{server_name}'
+        clusters.append({"name": name, "cluster": {**cluster["cluster"], "server": cluster["cluster"]["server"].replace("127.0.0.1", ip)}})
+        contexts.append({"name": context["name"] if i == 0 else name, "context": {**context["context"], "cluster": name}})
+    data.update(clusters=clusters, contexts=contexts)
+    with open(kubeconfig, "w") as f:
+        yaml.dump(data, f)
+    return kubeconfig
+
+
+def is_kubeconfig_current(kubeconfig, server_ips):
+    # a fetched kubeconfig is reused while it has the same servers and its CA still verifies them
+    if not os.path.exists(kubeconfig):
+        return False
+    try:
+        client = get_client(kubeconfig)
+    except Exception:
+        return False
+    return [server.hostname for server in client.servers] == list(server_ips) and client.verify_ca()
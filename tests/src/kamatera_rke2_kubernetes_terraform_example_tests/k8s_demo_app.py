@@ -1,11 +1,13 @@
 import os
 import json
 import time
+import traceback
+import dataclasses
 from textwrap import dedent
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from ruamel.yaml import YAML
 
-from . import setup, util, destroy
+from . import config, setup, util, destroy, inventory, workspace, cluster_pool, tracing
 
 
 yaml = YAML(typ='safe', pure=True)
@@ -89,7 +91,42 @@ def get_k8s_tfvars(cluster_autoscaler_image, ca_replicas, controller_replicas=1,
     )
 
 
-def ensure_stability(expected_nodes, expected_pods, iterations=10, print_function=print, total_iterations=30):
+def ensure_stability(expected_nodes, expected_pods, print_function=print, quiet_seconds=None, timeout_seconds=None):
+    # event based stability check, the quiet window is reset on any node / demo pod transition
+    # falls back to the polling based check if watch is disabled or fails
+    if config.K8S_WATCH and util.is_k8s_native_client():
+        print_function(f'Ensuring cluster stability')
+        print_function(f'expected_nodes={expected_nodes}')
+        print_function(f'expected_pods={expected_pods}')
+        try:
+            util.wait_for_stability(
+                "cluster nodes and demo pods",
+                {
+                    "node": ("nodes", None, util.get_node_state),
+                    "pod": ("pods", "demo", util.get_pod_state),
+                },
+                lambda objects: (
+                    util.count_nodes(objects["node"]) == expected_nodes
+                    and util.count_pods(objects["pod"]) == expected_pods
+                ),
+                print_function=print_function,
+                **({"quiet_seconds": quiet_seconds} if quiet_seconds else {}),
+                **({"timeout_seconds": timeout_seconds} if timeout_seconds else {}),
+            )
+        except AssertionError:
+            util.kubectl("get", "nodes")
+            util.kubectl("get", "pods", "-n", "demo")
+            raise
+        except Exception:
+            traceback.print_exc()
+            print_function('watch failed, falling back to polling')
+        else:
+            print_function('Cluster is stable')
+            return
+    ensure_stability_polling(expected_nodes, expected_pods, print_function=print_function)
+
+
+def ensure_stability_polling(expected_nodes, expected_pods, iterations=10, print_function=print, total_iterations=30):
     print_function(f'Ensuring cluster stability')
     print_function(f'expected_nodes={expected_nodes}')
     print_function(f'expected_pods={expected_pods}')
@@ -119,81 +156,219 @@ def ensure_stability(expected_nodes, expected_pods, iterations=10, print_functio
     print('Cluster is stable')
 
 
+def deploy_demo_app(timeout_seconds=config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS, **kwargs):
+    start_time = time.time()
+    util.wait_for(
+        "deployment of k8s_demo_app",
+        lambda: util.kubectl("apply", "-f", "k8s_demo_app.yaml", cwd=os.path.dirname(__file__)) or True,
+        retry_on_exception=True,
+        timeout_seconds=timeout_seconds,
+        **kwargs
+    )
+    util.wait_for_pods_count(
+        "demo", 2, 2, description="2 pods to be running", progress=None,
+        timeout_seconds=max(1, timeout_seconds - (time.time() - start_time)), **kwargs
+    )
+
+
+def reset_cluster(name_prefix, expected_nodes=None, timeout_seconds=config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS, print_function=print):
+    # removes everything the demo app test adds to a cluster and verifies that the cluster is back to its initial state
+    # the autoscaler is stopped first, so that it doesn't add nodes while the reset is in progress
+    util.kubectl("scale", "deployment", "cluster-autoscaler", "-n", "kube-system", "--replicas=0")
+
+    def delete_demo_namespace(**kwargs):
+        # deletes without waiting, so that the wait can be cancelled while the namespace is terminating
+        util.kubectl("delete", "namespace", "demo", "--ignore-not-found", "--wait=false")
+        util.wait_for(
+            "demo namespace to be deleted",
+            lambda: "demo" not in {
+                item["metadata"]["name"] for item in util.kubectl("get", "namespaces", parse_json=True, timeout_seconds=None, poll_seconds=None)["items"]
+            },
+            retry_on_exception=True, poll_seconds=5, **kwargs
+        )
+
+    def delete_autoscaler_nodes(**kwargs):
+        destroy.cloudcli("server", "terminate", "--force", "--name", f"{name_prefix}-autoscaler-.*", run=True)
+        inventory.invalidate(f"{name_prefix}-autoscaler-")
+        util.kubectl("delete", "nodes", "-l", "role=autoscaler", "--wait=false")
+        util.wait_for(
+            "autoscaler servers and nodes to be deleted",
+            lambda: (
+                not inventory.list_servers(f"{name_prefix}-autoscaler-", ttl_seconds=0)
+                and not util.kubectl("get", "nodes", "-l", "role=autoscaler", parse_json=True, timeout_seconds=None, poll_seconds=None)["items"]
+            ),
+            retry_on_exception=True, poll_seconds=10, **kwargs
+        )
+
+    waits = [
+        util.Wait("demo namespace to be deleted", delete_demo_namespace),
+        util.Wait("autoscaler servers and nodes to be deleted", delete_autoscaler_nodes),
+    ]
+    if expected_nodes:
+        waits.append(util.Wait(
+            f"{expected_nodes} nodes to be ready",
+            lambda **kwargs: util.wait_for_node_count(expected_nodes, expected_nodes, progress=None, **kwargs)
+        ))
+    util.wait_all(waits, timeout_seconds=timeout_seconds, print_function=print_function)
+    deployment = util.kubectl("get", "deployment", "cluster-autoscaler", "-n", "kube-system", parse_json=True)
+    assert deployment["spec"]["replicas"] == 0, "cluster autoscaler was not scaled down"
+
+
+def get_options_k8s_tfvars(options):
+    cluster_autoscaler_image = options.cluster_autoscaler_image
+    if not cluster_autoscaler_image:
+        cluster_autoscaler_image = f'ghcr.io/kamatera/kubernetes-autoscaler:kamatera-cluster-autoscaler-release-{options.k8s_version}'
+    return get_k8s_tfvars(
+        cluster_autoscaler_image,
+        0,
+        1 if options.with_kamatera_controller else 0,
+        ca_poweron_on_scale_up=options.ca_poweron_on_scale_up,
+        ca_poweroff_on_scale_down=options.ca_poweroff_on_scale_down
+    )
+
+
+def provision_cluster(name_prefix, options, timeout_seconds=config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS * 2, print_function=print):
+    # provisions a cluster ready for the demo app test, same as a fresh cluster in assert_demo_app
+    extra_servers = get_extra_servers(None, options.high_availability)
+    setup.main(
+        name_prefix=name_prefix,
+        k8s_version=options.k8s_version,
+        datacenter_id=options.datacenter_id,
+        with_bastion=options.with_bastion,
+        extra_servers=extra_servers,
+    )
+    expected_nodes = 1 + len(extra_servers)
+    util.wait_all([
+        util.Wait(
+            "Terraform apply for k8s to complete",
+            lambda **kwargs: setup.apply_k8s(options.k8s_version, get_options_k8s_tfvars(options), **kwargs),
+            stream_output=True
+        ),
+        util.Wait(
+            f"{expected_nodes} nodes to be ready",
+            lambda **kwargs: util.wait_for_node_count(expected_nodes, expected_nodes, progress=None, **kwargs)
+        ),
+    ], timeout_seconds=timeout_seconds, print_function=print_function)
+    return expected_nodes
+
+
+@dataclasses.dataclass
+class DemoAppOptions:
+    use_existing_name_prefix: str = None
+    datacenter_id: str = "IL"
+    k8s_version: str = "1.35"
+    high_availability: bool = False
+    cluster_autoscaler_image: str = None
+    keep_cluster: bool = False
+    with_bastion: bool = True
+    with_kamatera_controller: bool = False
+    ca_poweron_on_scale_up: bool = False
+    ca_poweroff_on_scale_down: bool = False
+    # run in an isolated per name prefix workspace, see workspace.py
+    use_workspace: bool = False
+    # lease a ready cluster from the cluster pool, see cluster_pool.py
+    use_cluster_pool: bool = False
+
+    @classmethod
+    def from_env(cls, env=None):
+        env = os.environ if env is None else env
+        return cls(
+            use_existing_name_prefix=env.get("USE_EXISTING_NAME_PREFIX") or None,
+            datacenter_id=env.get("DATACENTER_ID") or "IL",
+            k8s_version=env.get("K8S_VERSION") or "1.35",
+            high_availability=env.get("HIGH_AVAILABILITY") == "yes",
+            cluster_autoscaler_image=env.get("CLUSTER_AUTOSCALER_IMAGE") or None,
+            keep_cluster=env.get("KEEP_CLUSTER") == "yes",
+            with_bastion=env.get("WITH_BASTION") != "no",
+            with_kamatera_controller=env.get("WITH_KAMATERA_CONTROLLER") == "yes",
+            ca_poweron_on_scale_up=env.get("CA_POWERON_ON_SCALE_UP") == "yes",
+            ca_poweroff_on_scale_down=env.get("CA_POWEROFF_ON_SCALE_DOWN") == "yes",
+            use_workspace=env.get("USE_WORKSPACE") == "yes",
+            use_cluster_pool=env.get("USE_CLUSTER_POOL") == "yes",
+        )
+
+
 @contextmanager
-def assert_demo_app(extra_servers=None):
-    use_existing_name_prefix = os.getenv("USE_EXISTING_NAME_PREFIX")
-    name_prefix = use_existing_name_prefix or setup.generate_name_prefix()
+def assert_demo_app(extra_servers=None, options=None, name_prefix=None):
+    options = options or DemoAppOptions.from_env()
+    if options.use_cluster_pool:
+        # leased clusters are already reset and are released back to the pool instead of being destroyed
+        assert not extra_servers, "extra servers are not supported with the cluster pool"
+        with cluster_pool.leased(options) as name_prefix:
+            print(f'name_prefix="{name_prefix}"')
+            with workspace.use(name_prefix, create_if_missing=False):
+                options = dataclasses.replace(options, use_existing_name_prefix=name_prefix, keep_cluster=True)
+                with tracing.span("demo_app", name_prefix=name_prefix, leased=True), _assert_demo_app(name_prefix, extra_servers, options, is_reset=True) as result:
+                    yield result
+        return
+    name_prefix = options.use_existing_name_prefix or name_prefix or setup.generate_name_prefix()
     print(f'name_prefix="{name_prefix}"')
-    datacenter_id = os.getenv("DATACENTER_ID") or "IL"
-    k8s_version = os.getenv("K8S_VERSION") or "1.35"
-    high_availability = os.getenv("HIGH_AVAILABILITY") == "yes"
-    cluster_autoscaler_image = os.getenv("CLUSTER_AUTOSCALER_IMAGE")
-    if not cluster_autoscaler_image:
-        cluster_autoscaler_image = f'ghcr.io/kamatera/kubernetes-autoscaler:kamatera-cluster-autoscaler-release-{k8s_version}'
-    keep_cluster = os.getenv("KEEP_CLUSTER") == "yes"
-    with_bastion = os.getenv("WITH_BASTION") != "no"
-    with_kamatera_controller = os.getenv("WITH_KAMATERA_CONTROLLER") == "yes"
-    ca_poweron_on_scale_up = os.getenv("CA_POWERON_ON_SCALE_UP") == "yes"
-    ca_poweroff_on_scale_down = os.getenv("CA_POWEROFF_ON_SCALE_DOWN") == "yes"
+    with (workspace.use(name_prefix) if options.use_workspace else nullcontext()):
+        with tracing.span("demo_app", name_prefix=name_prefix), _assert_demo_app(name_prefix, extra_servers, options) as result:
+            yield result
+
+
+@contextmanager
+def _assert_demo_app(name_prefix, extra_servers, options, is_reset=False):
+    use_existing_name_prefix = options.use_existing_name_prefix
+    datacenter_id = options.datacenter_id
+    k8s_version = options.k8s_version
+    high_availability = options.high_availability
+    keep_cluster = options.keep_cluster
+    with_bastion = options.with_bastion
+    with_kamatera_controller = options.with_kamatera_controller
     try:
         extra_servers = get_extra_servers(extra_servers, high_availability)
+        waits = []
         if use_existing_name_prefix:
-            util.kubectl("delete", "namespace", "demo", "--ignore-not-found", "--wait")
-            util.kubectl("scale", "deployment", "cluster-autoscaler", "-n", "kube-system", "--replicas=0")
-            destroy.cloudcli("server", "terminate", "--force", "--name", f"{name_prefix}-autoscaler-.*", "--wait", run=True)
-            util.kubectl("delete", "nodes", "-l", "role=autoscaler", "--wait")
+            if not is_reset:
+                reset_cluster(name_prefix, 1 + len(extra_servers))
         else:
+            # the k8s terraform stack is applied below, concurrently with the demo app rollout
             setup.main(
                 name_prefix=name_prefix,
                 k8s_version=k8s_version,
                 datacenter_id=datacenter_id,
                 with_bastion=with_bastion,
                 extra_servers=extra_servers,
-                k8s_tfvars_config=get_k8s_tfvars(
-                    cluster_autoscaler_image,
-                    0,
-                    1 if with_kamatera_controller else 0,
-                    ca_poweron_on_scale_up=ca_poweron_on_scale_up,
-                    ca_poweroff_on_scale_down=ca_poweroff_on_scale_down
-                )
             )
+            k8s_tfvars_config = get_options_k8s_tfvars(options)
+            waits.append(util.Wait(
+                "Terraform apply for k8s to complete",
+                lambda **kwargs: setup.apply_k8s(k8s_version, k8s_tfvars_config, **kwargs),
+                stream_output=True
+            ))
         expected_ready_nodes = 1 + len(extra_servers)
-        util.wait_for(
-            f"{expected_ready_nodes} nodes to be ready",
-            lambda: util.kubectl_node_count() == (expected_ready_nodes,expected_ready_nodes),
-            progress=lambda: util.kubectl("get", "nodes"),
-            retry_on_exception=True
-        )
-        nodes = util.kubectl("get", "nodes", parse_json=True)["items"]
-        assert {node["metadata"]["name"] for node in nodes} == {
+        util.wait_all([
+            *waits,
+            util.Wait(
+                f"{expected_ready_nodes} nodes to be ready",
+                lambda **kwargs: util.wait_for_node_count(expected_ready_nodes, expected_ready_nodes, progress=None, **kwargs)
+            ),
+            util.Wait("deployment of k8s_demo_app with 2 running pods", deploy_demo_app),
+        ], timeout_seconds=config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS * 2)
+        nodes = util.list_node_summaries()
+        assert {node.name for node in nodes} == {
             "controlplane1", *extra_servers.keys()
         }
-        util.wait_for(
-            "deployment of k8s_demo_app",
-            lambda: util.kubectl("apply", "-f", "k8s_demo_app.yaml", cwd=os.path.dirname(__file__)) or True,
-            retry_on_exception=True
-        )
-        util.wait_for(
-            "2 pods to be running",
-            lambda: util.kubectl_pods_count("demo") == (2,2),
-            progress=lambda: util.kubectl("get", "pods", "-n", "demo")
-        )
         node_external_ips = [
-            node["metadata"]["annotations"]["rke2.io/external-ip"]
+            node.external_ip
             for node in nodes
-            if node["metadata"]["name"].startswith("worker")
+            if node.name.startswith("worker")
         ]
         demo_pods = set([
-            pod["metadata"]["name"]
-            for pod in util.kubectl("get", "pods", "-n", "demo", parse_json=True)["items"]
+            pod.name
+            for pod in util.list_pod_summaries("demo")
         ])
         assert len(demo_pods) == 2
+        # each attempt gives up after 300 seconds, the whole wait keeps the default total budget
+        ip_pods = {}
         util.wait_for(
             "ingress reachable from all IPs to all demo pods",
-            lambda: util.curl_unique_demo_pods(node_external_ips, demo_pods) or True,
-            progress=lambda: util.curl_unique_demo_pods(node_external_ips, demo_pods),
+            lambda: ip_pods.update(util.curl_unique_demo_pods(node_external_ips, demo_pods)) or True,
             retry_on_exception=True
         )
+        print(f'ingress reachable from all IPs to all demo pods: {ip_pods}')
         with open(os.path.join(os.path.dirname(__file__), "k8s_demo_app.yaml")) as f:
             for obj in yaml.load_all(f):
                 if obj["kind"] == "Deployment":
@@ -202,52 +377,33 @@ def assert_demo_app(extra_servers=None):
         k8s_demo_app['spec']['template']['spec']['nodeSelector'] = {"role": "autoscaler"}
         p = util.kubectl("apply", "-f", "-", run=True, input=json.dumps(k8s_demo_app))
         assert p.returncode == 0
-        util.wait_for(
-            "3 pods total but only 2 running (1 is pending for autoscaler node)",
-            lambda: util.kubectl_pods_count("demo") == (3,2),
-            progress=lambda: util.kubectl("get", "pods", "-n", "demo")
-        )
+        util.wait_for_pods_count("demo", 3, 2, description="3 pods total but only 2 running (1 is pending for autoscaler node)")
         # start the autoscaler - which will create 2 autoscaler nodes for the demo pods
         util.kubectl("scale", "deployment", "cluster-autoscaler", "-n", "kube-system", "--replicas=1")
         expected_ready_nodes += 2
-        util.wait_for(
-            f"{expected_ready_nodes} nodes to be ready",
-            lambda: util.kubectl_node_count() == (expected_ready_nodes,expected_ready_nodes),
-            progress=lambda: util.kubectl("get", "nodes"),
-            retry_on_exception=True
-        )
-        node_names = {node["metadata"]["name"] for node in util.kubectl("get", "nodes", parse_json=True)["items"]}
+        util.wait_for_node_count(expected_ready_nodes, expected_ready_nodes, description=f"{expected_ready_nodes} nodes to be ready")
+        node_names = {node.name for node in util.list_node_summaries()}
         node_names.remove("controlplane1")
         for name in extra_servers.keys():
             node_names.remove(name)
         assert len(node_names) == 2 and all(name.startswith(f"{name_prefix}-autoscaler-") for name in node_names), node_names
-        util.wait_for(
-            "2 pods total and running (after autoscaler adds nodes)",
-            lambda: util.kubectl_pods_count("demo") == (2, 2),
-            progress=lambda: util.kubectl("get", "pods", "-n", "demo")
-        )
-        pods = util.kubectl("get", "pods", "-n", "demo", parse_json=True)["items"]
-        assert len(pods) == 2 and all(pod["spec"]["nodeName"].startswith(f"{name_prefix}-autoscaler-") for pod in pods), pods
+        util.wait_for_pods_count("demo", 2, 2, description="2 pods total and running (after autoscaler adds nodes)")
+        pods = util.list_pod_summaries("demo")
+        assert len(pods) == 2 and all(pod.node_name.startswith(f"{name_prefix}-autoscaler-") for pod in pods), pods
         ensure_stability(
             (expected_ready_nodes, expected_ready_nodes),
             (2, 2)
         )
         util.kubectl("scale", "deployment", "demo", "-n", "demo", "--replicas=0")
-        util.wait_for(
-            "all demo pods terminated",
-            lambda: util.kubectl_pods_count("demo") == (0, 0),
-            progress=lambda: util.kubectl("get", "pods", "-n", "demo")
-        )
+        util.wait_for_pods_count("demo", 0, 0, description="all demo pods terminated")
         # autoscaler should remove 1 autoscaler node (because min-size=1)
         expected_total_nodes = expected_ready_nodes
         expected_ready_nodes -= 1
         if with_kamatera_controller:
             # controller will terminate the node
             expected_total_nodes -= 1
-        util.wait_for(
-            f"{expected_total_nodes} total nodes, {expected_ready_nodes} ready nodes",
-            lambda: util.kubectl_node_count() == (expected_total_nodes, expected_ready_nodes),
-            progress=lambda: util.kubectl("get", "nodes"),
+        util.wait_for_node_count(
+            expected_total_nodes, expected_ready_nodes,
             timeout_seconds=3600,  # need enough time for the controller to delete the not ready node
         )
         ensure_stability(
@@ -0,0 +1,254 @@
+import json
+import time
+import queue
+import threading
+import subprocess
+import http.client
+import urllib.parse
+
+from . import config
+
+
+# queue command statuses, any other status means the command is still pending / running
+COMMAND_COMPLETE_STATUSES = ["complete"]
+COMMAND_FAILED_STATUSES = ["error", "cancelled"]
+
+
+class ApiError(Exception):
+
+    def __init__(self, method, path, status, body):
+        super().__init__(f"{method} {path} failed with status {status}: {body[:500]}")
+        self.status = status
+        self.body = body
+
+
+class ConcurrencyLimiter:
+    # bounds the number of requests in flight, the limit is halved when the api responds with a rate limit
+    # and slowly increased back to max_concurrency as requests succeed
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    def __exit__(self, *args):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        with self.condition:
+            self.successes += 1
+            if self.limit < self.max_concurrency and self.successes >= self.limit:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify_all()
+
+    def on_rate_limited(self):
+        with self.condition:
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+
+
+class Client:
+
+    def __init__(
+        self, url=config.KAMATERA_API_URL, client_id=config.KAMATERA_API_CLIENT_ID, secret=config.KAMATERA_API_SECRET,
+        timeout_seconds=config.KAMATERA_API_TIMEOUT_SECONDS, max_concurrency=config.KAMATERA_API_MAX_CONCURRENCY,
+        retries=5, retry_sleep_seconds=2,
+    ):
+        self.url = urllib.parse.urlparse(url)
+        self.timeout_seconds = timeout_seconds
+        self.retries = retries
+        self.retry_sleep_seconds = retry_sleep_seconds
+        self.headers = {
+            "Accept": "application/json",
+            "AuthClientId": client_id or "",
+            "AuthSecret": secret or "",
+        }
+        self.limiter = ConcurrencyLimiter(max_concurrency)
+        self._idle_connections = queue.LifoQueue(max_concurrency)
+
+    def _new_connection(self):
+        if self.url.scheme == "https":
+            return http.client.HTTPSConnection(self.url.hostname, self.url.port or 443, timeout=self.timeout_seconds)
+        else:
+            return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout_seconds)
+
+    def _release(self, conn):
+        try:
+            self._idle_connections.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle_connections.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _request_once(self, method, path, body):
+        headers = dict(self.headers)
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(body).encode()
+        for attempt in range(2):
+            try:
+                conn = self._idle_connections.get_nowait()
+                is_reused = True
+            except queue.Empty:
+                conn = self._new_connection()
+                is_reused = False
+            try:
+                conn.request(method, self.url.path.rstrip("/") + path, body=body, headers=headers)
+                res = conn.getresponse()
+                data = res.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if is_reused and attempt == 0:
+                    # idle keep-alive connection was closed by the server, retry once with a new connection
+                    continue
+                raise
+            if res.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            return res, data
+
+    def request(self, method, path, query=None, body=None):
+        # rate limited and unavailable responses are retried, honoring Retry-After
+        if query:
+            path = f'{path}?{urllib.parse.urlencode({k: v for k, v in query.items() if v is not None})}'
+        for attempt in range(self.retries + 1):
+            with self.limiter:
+                res, data = self._request_once(method, path, body)
+            if res.status == 429:
+                self.limiter.on_rate_limited()
+            elif res.status not in (502, 503, 504):
+                break
+            if attempt < self.retries:
+                time.sleep(float(res.getheader("Retry-After") or self.retry_sleep_seconds * (attempt + 1)))
+        if res.status >= 400:
+            raise ApiError(method, path, res.status, data.decode(errors="replace"))
+        self.limiter.on_success()
+        return json.loads(data) if data else None
+
+    def wait_commands(self, command_ids, timeout_seconds=config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS, poll_seconds=2):
+        # polls the command queue until all commands are complete, raises if any of them failed
+        command_ids = [int(command_id) for command_id in command_ids]
+        start_time = time.time()
+        while command_ids:
+            commands = self.request("POST", "/service/queue", body={"IDs": command_ids})
+            failed = [command for command in commands if command.get("status") in COMMAND_FAILED_STATUSES]
+            if failed:
+                raise Exception("commands failed: " + ", ".join(f'{c.get("id")} ({c.get("status")})' for c in failed))
+            complete = {int(command["id"]) for command in commands if command.get("status") in COMMAND_COMPLETE_STATUSES}
+            command_ids = [command_id for command_id in command_ids if command_id not in complete]
+            if not command_ids:
+                break
+            if time.time() - start_time > timeout_seconds:
+                raise AssertionError(f"timeout waiting for commands: {command_ids}")
+            time.sleep(poll_seconds)
+
+    def list_servers(self):
+        return self.request("GET", "/service/servers")
+
+    def server_info(self, name):
+        # name is a regular expression, returns detailed info of all matching servers
+        return self.request("POST", "/service/server/info", body={"name": name})
+
+    def server_poweroff(self, name, force=False, wait=True):
+        command_ids = self.request("POST", "/service/server/poweroff", body={"name": name, "force": force})
+        if wait:
+            self.wait_commands(command_ids)
+        return command_ids
+
+    def server_terminate(self, name, force=True, wait=True):
+        command_ids = self.request("POST", "/service/server/terminate", body={"name": name, "force": force})
+        if wait:
+            self.wait_commands(command_ids)
+        return command_ids
+
+    def list_networks(self, datacenter):
+        return self.request("GET", "/service/networks", query={"datacenter": datacenter})
+
+    def list_subnets(self, vlan_id, datacenter):
+        return self.request("GET", "/service/network/subnets", query={"vlanId": vlan_id, "datacenter": datacenter})
+
+    def delete_subnet(self, subnet_id):
+        return self.request("POST", "/service/network/subnet/delete", body={"subnetId": int(subnet_id)})
+
+    def delete_network(self, network_id, datacenter):
+        return self.request("POST", "/service/network/delete", body={"id": network_id, "datacenter": datacenter})
+
+
+# cloudcli command: function of (client, options)
+CLOUDCLI_COMMANDS = {
+    ("server", "list"): lambda client, options: client.list_servers(),
+    ("server", "info"): lambda client, options: client.server_info(options["name"]),
+    ("server", "poweroff"): lambda client, options: client.server_poweroff(options["name"], force=bool(options.get("force")), wait=bool(options.get("wait"))),
+    ("server", "terminate"): lambda client, options: client.server_terminate(options["name"], force=bool(options.get("force")), wait=bool(options.get("wait"))),
+    ("network", "list"): lambda client, options: client.list_networks(options["datacenter"]),
+    ("network", "subnet_list"): lambda client, options: client.list_subnets(options["vlanId"], options["datacenter"]),
+    ("network", "subnet_delete"): lambda client, options: client.delete_subnet(options["subnetId"]),
+    ("network", "delete"): lambda client, options: client.delete_network(options["id"], options["datacenter"]),
+}
+
+
+def parse_cloudcli_args(args):
+    command, options = [], {}
+    i = 0
+    while i < len(args):
+        if args[i].startswith("--"):
+            if i + 1 < len(args) and not args[i + 1].startswith("--"):
+                options[args[i][2:]] = args[i + 1]
+                i += 2
+            else:
+                options[args[i][2:]] = True
+                i += 1
+        else:
+            command.append(args[i])
+            i += 1
+    return tuple(command), options
+
+
+def is_cloudcli_supported(args):
+    return parse_cloudcli_args(args)[0] in CLOUDCLI_COMMANDS
+
+
+def cloudcli(*args, parse_json=False, run=False):
+    # same return values and errors as destroy.cloudcli with the cloudcli binary
+    command, options = parse_cloudcli_args(args)
+    try:
+        res = CLOUDCLI_COMMANDS[command](get_client(), options)
+    except Exception as e:
+        if not run:
+            raise subprocess.CalledProcessError(1, ["cloudcli", *args], output=str(e)) from e
+        print(f'cloudcli {" ".join(args)} failed: {e}')
+        return subprocess.CompletedProcess(["cloudcli", *args], 1)
+    if parse_json:
+        return res
+    elif run:
+        return subprocess.CompletedProcess(["cloudcli", *args], 0)
+    else:
+        return 0
+
+
+_client_lock = threading.Lock()
+_client = None
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client()
+        return _client
@@ -0,0 +1,91 @@
+import re
+import json
+import base64
+
+from . import util, k8s_api, autoscaler_sim
+
+
+# deployed by 02-k8s/registry-mirror.tf
+NAMESPACE = "kube-system"
+SERVICE_NAME = "registry-mirror"
+# default of the registry_mirror_node_port variable
+NODE_PORT = 30500
+
+# kubelet event message, e.g. Successfully pulled image "nginx:latest" in 2.345s (2.345s including waiting)
+PULLED_RE = re.compile(r'^Successfully pulled image "(?P<image>[^"]+)" in (?P<duration>(?:[0-9.]+(?:h|ms|m|s))+)')
+
+
+def get_node_script(node_port=NODE_PORT):
+    # same as registry_mirror_node_script in 02-k8s/registry-mirror.tf, for nodes created outside of terraform
+    registries_yaml = f'mirrors:\n  docker.io:\n    endpoint:\n      - "http://127.0.0.1:{node_port}"\n'
+    rke2_config = "private-registry: /etc/rancher/rke2/registries-mirror.yaml\n"
+    return "\n".join([
+        "mkdir -p /etc/rancher/rke2/config.yaml.d",
+        f"echo '{base64.b64encode(registries_yaml.encode()).decode()}' | base64 --decode > /etc/rancher/rke2/registries-mirror.yaml",
+        f"echo '{base64.b64encode(rke2_config.encode()).decode()}' | base64 --decode > /etc/rancher/rke2/config.yaml.d/50-registry-mirror.yaml",
+    ])
+
+
+def get_proxy_stats(client):
+    # cache hits / misses of the pull-through cache from the registry expvars, None if the mirror is not deployed
+    path = client.get_path("services", NAMESPACE, f"{SERVICE_NAME}:debug", "proxy") + "/debug/vars"
+    try:
+        proxy = client.request("GET", path).get("registry", {}).get("proxy", {})
+    except k8s_api.ApiError as e:
+        if e.status == 404:
+            return None
+        raise
+    stats = {}
+    for kind in ("blobs", "manifests"):
+        metrics = proxy.get(kind) or {}
+        requests = metrics.get("Requests", 0)
+        stats[kind] = {
+            "requests": requests,
+            "hits": metrics.get("Hits", 0),
+            "misses": metrics.get("Misses", 0),
+            "hit_rate": round(metrics.get("Hits", 0) / requests, 3) if requests else None,
+            "bytes_pulled": metrics.get("BytesPulled", 0),
+        }
+    return stats
+
+
+def get_seconds_stats(values):
+    return {"count": len(values), "p50": util.percentile(values, 50), "p95": util.percentile(values, 95), "max": max(values)} if values else None
+
+
+def get_pull_stats(client, namespace=None):
+    # image pull durations reported by the kubelets in the Pulled events
+    images = {}
+    already_present = 0
+    for event in client.list_items("events", namespace, field_selector="reason=Pulled"):
+        message = event.get("message") or ""
+        match = PULLED_RE.match(message)
+        if match:
+            images.setdefault(match.group("image"), []).append(autoscaler_sim.parse_duration(match.group("duration")))
+        elif "already present on machine" in message:
+            already_present += 1
+    return {
+        "pulls": sum(len(values) for values in images.values()),
+        "already_present": already_present,
+        "pull_seconds": get_seconds_stats([seconds for values in images.values() for seconds in values]),
+        "images": {image: get_seconds_stats(values) for image, values in sorted(images.items())},
+    }
+
+
+def main(namespace=None, output=None, print_function=print):
+    client = k8s_api.get_client(util.get_kubeconfig())
+    metrics = {"proxy": get_proxy_stats(client), "pulls": get_pull_stats(client, namespace)}
+    if metrics["proxy"] is None:
+        print_function("Registry mirror is not deployed")
+    else:
+        for kind, stats in metrics["proxy"].items():
+            hit_rate = "-" if stats["hit_rate"] is None else f'{stats["hit_rate"] * 100:.1f}%'
+            print_function(f'{kind}: {stats["requests"]} requests, {stats["hits"]} hits, {stats["misses"]} misses, hit rate {hit_rate}, {stats["bytes_pulled"]} bytes pulled from upstream')
+    pulls = metrics["pulls"]
+    print_function(f'image pulls: {pulls["pulls"]}, already present: {pulls["already_present"]}')
+    for image, stats in pulls["images"].items():
+        print_function(f'  {image}: {stats["count"]} pulls, p50={stats["p50"]:.1f}s p95={stats["p95"]:.1f}s max={stats["max"]:.1f}s')
+    if output:
+        with open(output, "w") as f:
+            json.dump(metrics, f, indent=2)
+    return metrics
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import base64
+import shlex
+import tempfile
+import datetime
+import threading
+import concurrent.futures
+
+from . import config, util, destroy, inventory, workspace, setup, registry_mirror, tracing, cassette
+
+
+# workers are created the same way as the autoscaler nodes, the startup script joins the server to the cluster on first boot,
+# so adding capacity doesn't need a terraform plan / refresh of the whole 01-rke2 stack
+RECORDS_FILE = "scaled_workers.json"
+
+DEFAULT_WORKER = {
+    "role": "rke2",
+    "role_config": {
+        "rke2_type": "agent",
+    },
+    "cpu_cores": 2,
+    "ram_mb": 4096,
+}
+
+
+def load_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_records(tfdir):
+    return load_json(os.path.join(tfdir, RECORDS_FILE), {})
+
+
+def save_records(tfdir, records):
+    with open(os.path.join(tfdir, RECORDS_FILE), "w") as f:
+        json.dump(records, f, indent=2)
+
+
+def get_worker_names(count, existing_names):
+    names = []
+    i = 1
+    while len(names) < count:
+        name = f"worker{i}"
+        if name not in existing_names:
+            names.append(name)
+        i += 1
+    return names
+
+
+def get_script(tfdir, tfvars, name, registry_mirror_enabled=False):
+    # same as autoscaler_script in 02-k8s/autoscaler.tf, with the node name of a static worker
+    with open(os.path.join(tfdir, "server_startup_script.sh"), "rb") as f:
+        startup_script = base64.b64encode(f.read()).decode()
+    with open(os.path.join(tfdir, ".cluster_token")) as f:
+        cluster_token = f.read().strip()
+    rke2_args = [
+        tfvars["private_ip_prefix"], str(tfvars["servers_ssh_port"]), "agent", tfvars["rke2_version"],
+        base64.b64encode(tfvars["rke2_config"].encode()).decode(), "yes" if tfvars["with_bastion"] else "no",
+    ]
+    return "\n".join([
+        "set -euo pipefail",
+        f'echo "{startup_script}" | base64 --decode > /root/server_startup_script.sh',
+        f"export CLUSTER_TOKEN={shlex.quote(cluster_token)}",
+        f"export NODE_NAME={shlex.quote(name)}",
+        *([registry_mirror.get_node_script()] if registry_mirror_enabled else []),
+        *([f'export SSS_ARTIFACT_CACHE_URL={shlex.quote(tfvars["rke2_artifact_cache_url"])}'] if tfvars.get("rke2_artifact_cache_url") else []),
+        f"bash /root/server_startup_script.sh rke2 {shlex.join(rke2_args)}",
+    ]) + "\n"
+
+
+def get_create_args(tfvars, server_name, server, ssh_pubkeys, script_file):
+    return [
+        "server", "create",
+        "--name", server_name,
+        "--datacenter", tfvars["datacenter_id"],
+        "--image", tfvars["image_id"],
+        "--cpu", f'{server["cpu_cores"]}{server["cpu_type"]}',
+        "--ram", str(server["ram_mb"]),
+        *[arg for size in server["disk_sizes_gb"] for arg in ("--disk", f"size={size}")],
+        "--network", "name=wan,ip=auto",
+        "--network", f'name={tfvars["private_network_name"]},ip=auto',
+        "--billingcycle", server["billing_cycle"],
+        "--dailybackup", "yes" if server["daily_backup"] else "no",
+        "--managed", "yes" if server["managed"] else "no",
+        "--ssh-key", ssh_pubkeys,
+        "--script-file", script_file,
+        "--wait",
+    ]
+
+
+def create_worker(tfdir, tfvars, name, worker, ssh_pubkeys, registry_mirror_enabled, print_function=print):
+    server_name = f'{tfvars["name_prefix"]}-{name}'
+    # the script contains the cluster token
+    with tempfile.TemporaryDirectory() as tmpdir:
+        script_file = os.path.join(tmpdir, f"{name}.sh")
+        with open(script_file, "w") as f:
+            f.write(get_script(tfdir, tfvars, name, registry_mirror_enabled))
+        start_time = time.time()
+        with tracing.span("create worker", worker=name):
+            destroy.cloudcli(*get_create_args(tfvars, server_name, {**setup.get_rke2_servers(False)["default"], **worker}, ssh_pubkeys, script_file))
+    print_function(f'[{name}] server {server_name} created in {time.time() - start_time:.1f} seconds')
+    return server_name
+
+
+def add_workers(tfdir, tfvars, count, worker, width, print_function=print):
+    rke2_tfvars = load_json(os.path.join(tfdir, "01-rke2", "ktb.auto.tfvars.json"), {})
+    records = load_records(tfdir)
+    existing_names = {*rke2_tfvars.get("servers", {}), *records}
+    existing_names.update(server["name"][len(tfvars["name_prefix"]) + 1:] for server in inventory.list_servers(f'{tfvars["name_prefix"]}-'))
+    names = get_worker_names(count, existing_names)
+    ssh_pubkeys = util.get_ssh_pubkeys()
+    registry_mirror_enabled = bool(load_json(os.path.join(tfdir, "02-k8s", "ktb.auto.tfvars.json"), {}).get("registry_mirror_enabled"))
+    lock = threading.Lock()
+    errors = {}
+
+    def create(name):
+        try:
+            server_name = create_worker(tfdir, tfvars, name, worker, ssh_pubkeys, registry_mirror_enabled, print_function)
+        except Exception as e:
+            with lock:
+                errors[name] = str(e)
+            return
+        # recorded as soon as the server exists, so that it can be imported / removed even if other workers failed
+        with lock:
+            records[name] = {
+                "server_name": server_name,
+                "created_at": datetime.datetime.now().isoformat(),
+                "extra_server": worker,
+            }
+            save_records(tfdir, records)
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, min(width, len(names)))) as executor:
+        list(executor.map(tracing.propagate(cassette.forked(create)), names))
+    inventory.invalidate(tfvars["name_prefix"])
+    for name in names:
+        if name in records and not records[name].get("id"):
+            server = inventory.get_server(records[name]["server_name"], name_prefix=f'{tfvars["name_prefix"]}-')
+            records[name].update(id=server.get("id"), terraform_import=f'terraform import \'kamatera_server.servers["{name}"]\' {server.get("id")}')
+    save_records(tfdir, records)
+    if errors:
+        raise Exception("Errors occurred creating workers:\n" + "\n".join(f'{name}: {error}' for name, error in sorted(errors.items())))
+    return names
+
+
+def drain_nodes(names, timeout_seconds, print_function=print):
+    # workers which never joined the cluster have no node to drain
+    node_names = {node.name for node in util.list_node_summaries()}
+    names = [name for name in names if name in node_names]
+    if not names:
+        return
+    print_function(f'draining nodes {", ".join(names)} (with timeout {timeout_seconds} seconds)')
+    p = util.kubectl(
+        "drain", *names, "--ignore-daemonsets", "--delete-emptydir-data", f"--timeout={timeout_seconds}s",
+        run=True, timeout_seconds=None, poll_seconds=None
+    )
+    # the nodes stay cordoned, so the workers can be removed again once the blocking pods are handled
+    assert p.returncode == 0, f"failed to drain nodes {', '.join(names)}, the workers were not removed"
+
+
+def remove_workers(tfdir, tfvars, count, width, drain_timeout_seconds=config.SCALE_WORKERS_DRAIN_TIMEOUT_SECONDS, print_function=print):
+    # only workers added by scale-workers are removed, newest first
+    records = load_records(tfdir)
+    names = sorted(records, key=lambda name: records[name]["created_at"], reverse=True)[:count]
+    if not names:
+        return []
+    drain_nodes(names, drain_timeout_seconds, print_function)
+    util.kubectl("delete", "nodes", *names, "--ignore-not-found")
+    with concurrent.futures.ThreadPoolExecutor(max(1, min(width, len(names)))) as executor:
+        results = dict(zip(names, executor.map(tracing.propagate(cassette.forked(
+            lambda name: destroy.cloudcli("server", "terminate", "--name", records[name]["server_name"], "--force", "--wait", run=True).returncode
+        )), names)))
+    for name, returncode in results.items():
+        if returncode == 0:
+            print_function(f'[{name}] server {records[name]["server_name"]} terminated')
+            del records[name]
+        else:
+            print_function(f'[{name}] failed to terminate server {records[name]["server_name"]} (exit code {returncode})')
+    save_records(tfdir, records)
+    inventory.invalidate(tfvars["name_prefix"])
+    assert all(returncode == 0 for returncode in results.values()), "failed to terminate some of the workers"
+    return names
+
+
+@tracing.traced("scale_workers", ("add", "remove"))
+def main(
+    add=0, remove=0, cpu_cores=None, ram_mb=None, width=10, wait=True, timeout_seconds=config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS,
+    drain_timeout_seconds=config.SCALE_WORKERS_DRAIN_TIMEOUT_SECONDS, print_function=print
+):
+    assert bool(add) != bool(remove), "must specify either add or remove"
+    tfdir = workspace.get_tfdir()
+    tfvars = load_json(os.path.join(tfdir, "02-k8s", "autoscaler.auto.tfvars.json"))
+    assert tfvars, "missing 02-k8s/autoscaler.auto.tfvars.json, the 01-rke2 stack must be applied first"
+    start_time = time.time()
+    if remove:
+        names = remove_workers(tfdir, tfvars, remove, width, drain_timeout_seconds, print_function)
+        print_function(f'Removed {len(names)} workers in {time.time() - start_time:.1f} seconds')
+        return names
+    worker = {**DEFAULT_WORKER, **({"cpu_cores": cpu_cores} if cpu_cores else {}), **({"ram_mb": ram_mb} if ram_mb else {})}
+    names = add_workers(tfdir, tfvars, add, worker, width, print_function)
+    if wait:
+        util.wait_for(
+            f"{len(names)} new workers to be ready",
+            lambda: {node.name for node in util.list_node_summaries() if node.ready}.issuperset(names),
+            timeout_seconds=timeout_seconds, retry_on_exception=True, print_function=print_function
+        )
+    print_function(f'Added {len(names)} workers in {time.time() - start_time:.1f} seconds: {", ".join(names)}')
+    print_function(f'Recorded in {os.path.join(tfdir, RECORDS_FILE)}')
+    print_function(
+        'To manage them with terraform, add the extra_server entry of each record to extra_servers under the same name (e.g. '
+        f'"{names[0]}") and run its terraform_import command in 01-rke2. There is no terraform_data.init_rke2 state for imported workers, '
+        'so the next apply runs the startup script on them again.'
+    )
+    return names
@@ -0,0 +1,135 @@
+import io
+import os
+import sys
+import json
+import time
+import threading
+import traceback
+import contextvars
+import dataclasses
+import concurrent.futures
+
+import dotenv
+from ruamel.yaml import YAML
+
+from . import config, setup, workspace, k8s_demo_app
+
+
+yaml = YAML(typ='safe', pure=True)
+
+_output_prefix = contextvars.ContextVar("output_prefix", default=None)
+
+
+class PrefixedOutput:
+    # sys.stdout replacement which prefixes each line with the scenario name of the current context
+    # output of subprocesses (terraform, kubectl) is written directly to the file descriptor and is not prefixed
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.buffers = {}
+
+    def write(self, data):
+        prefix = _output_prefix.get()
+        if not prefix:
+            return self.stream.write(data)
+        key = (prefix, threading.get_ident())
+        with self.lock:
+            lines = (self.buffers.pop(key, "") + data).split("\n")
+            if lines[-1]:
+                self.buffers[key] = lines[-1]
+            for line in lines[:-1]:
+                self.stream.write(f'[{prefix}] {line}\n')
+        return len(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+@dataclasses.dataclass
+class Scenario:
+    name: str
+    env: dict
+    status: str = "pending"
+    name_prefix: str = None
+    start_time: float = None
+    end_time: float = None
+    error: str = None
+
+
+def load_scenarios(path=None):
+    # json list of {"name": ..., "env": {...}} or a github workflow with a matrix of dotenvs (defaults to the CI workflow)
+    path = path or os.path.join(workspace.ROOT_TFDIR, ".github", "workflows", "ci.yaml")
+    with open(path) as f:
+        if path.endswith(".json"):
+            return [Scenario(scenario["name"], scenario["env"]) for scenario in json.load(f)]
+        ci = yaml.load(f)
+    scenarios = []
+    for i, dotenv_str in enumerate(ci["jobs"]["ci"]["strategy"]["matrix"]["dotenvs"]):
+        env = dotenv.dotenv_values(stream=io.StringIO(dotenv_str))
+        scenarios.append(Scenario(f'{i + 1}-k8s{env.get("K8S_VERSION")}-{env.get("DATACENTER_ID")}', env))
+    return scenarios
+
+
+def run_scenario(scenario):
+    # each scenario gets a new cluster in its own workspace, so any number of them can run from the same checkout
+    options = dataclasses.replace(
+        k8s_demo_app.DemoAppOptions.from_env(scenario.env),
+        use_existing_name_prefix=None, use_workspace=True
+    )
+    with k8s_demo_app.assert_demo_app(name_prefix=scenario.name_prefix, options=options):
+        pass
+
+
+def print_summary(scenarios):
+    print("Scenarios summary:")
+    for scenario in scenarios:
+        duration = f'{scenario.end_time - scenario.start_time:.0f}s' if scenario.end_time and scenario.start_time else "-"
+        print(f'  {scenario.status:<9} {scenario.name} name_prefix={scenario.name_prefix} duration={duration}{f" error={scenario.error}" if scenario.error else ""}')
+
+
+def main(scenarios_file=None, max_clusters=config.SCHEDULER_MAX_CLUSTERS, only=None):
+    scenarios = [scenario for scenario in load_scenarios(scenarios_file) if not only or scenario.name in only]
+    assert scenarios, "no scenarios to run"
+    print(f'Running {len(scenarios)} scenarios with up to {max_clusters} clusters in flight')
+
+    def run(scenario):
+        _output_prefix.set(scenario.name)
+        scenario.status = "running"
+        scenario.start_time = time.time()
+        print(f'starting scenario, name_prefix="{scenario.name_prefix}"')
+        try:
+            run_scenario(scenario)
+        except Exception as e:
+            traceback.print_exc(file=sys.stdout)
+            scenario.status = "failed"
+            scenario.error = str(e).splitlines()[0] if str(e) else type(e).__name__
+        else:
+            scenario.status = "passed"
+        finally:
+            scenario.end_time = time.time()
+            print(f'scenario {scenario.status} in {scenario.end_time - scenario.start_time:.0f} seconds')
+
+    for scenario in scenarios:
+        scenario.name_prefix = setup.generate_name_prefix()
+    stdout = sys.stdout
+    sys.stdout = PrefixedOutput(stdout)
+    try:
+        # the executor bounds the number of clusters which exist at the same time
+        with concurrent.futures.ThreadPoolExecutor(max_clusters) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, run, scenario) for scenario in scenarios]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+                running = sum(1 for scenario in scenarios if scenario.status == "running")
+                done = sum(1 for scenario in scenarios if scenario.status in ("passed", "failed"))
+                print(f'{done}/{len(scenarios)} scenarios done, {running} running')
+    finally:
+        sys.stdout = stdout
+    print_summary(scenarios)
+    failed = [scenario.name for scenario in scenarios if scenario.status != "passed"]
+    if failed:
+        raise Exception(f'Scenarios failed: {", ".join(failed)}')
+    return scenarios
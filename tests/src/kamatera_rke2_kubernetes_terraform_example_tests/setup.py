@@ -1,11 +1,12 @@
 import dataclasses
 import os
+import sys
+import shlex
 import secrets
 import datetime
-import subprocess
 import json
 
-from . import config, util
+from . import config, util, inventory, workspace, terraform, tracing
 
 
 def get_rke2_servers(with_bastion, extra_servers=None):
@@ -39,6 +40,11 @@ def get_rke2_servers(with_bastion, extra_servers=None):
     return servers
 
 
+def get_bootstrap_command():
+    # terraform runs it once per node (with --node), nodes are bootstrapped concurrently up to the terraform parallelism
+    return shlex.join([sys.executable, "-m", "kamatera_rke2_kubernetes_terraform_example_tests.cli", "bootstrap"])
+
+
 def write_rke2_tfvars(tfdir, name_prefix, rke2_version, datacenter_id, ssh_pubkeys, with_bastion, extra_servers):
     assert not os.path.exists(os.path.join(tfdir, "01-rke2", "ktb.auto.tfvars.json"))
     with open(os.path.join(tfdir, "01-rke2", "ktb.auto.tfvars.json"), "w") as f:
@@ -50,6 +56,10 @@ def write_rke2_tfvars(tfdir, name_prefix, rke2_version, datacenter_id, ssh_pubke
             "ssh_pubkeys": ssh_pubkeys,
             "rke2_version": rke2_version,
             "servers": get_rke2_servers(with_bastion, extra_servers),
+            "ssh_control_path": config.SSH_CONTROL_PATH,
+            "ssh_control_persist_seconds": config.SSH_CONTROL_PERSIST_SECONDS,
+            **({"bootstrap_command": get_bootstrap_command()} if config.BOOTSTRAP_ORCHESTRATOR else {}),
+            **({"rke2_artifact_cache_port": config.RKE2_ARTIFACT_CACHE_PORT} if config.RKE2_ARTIFACT_CACHE else {}),
         }, indent=2))
 
 
@@ -100,19 +110,31 @@ def write_k8s_tfvars(tfdir, ssh_pubkeys, k8s_version, tfvars_config: K8STfvarsCo
             "cluster_autoscaler_extra_args": ca_extra_args,
             "cluster_autoscaler_rbac_url": tfvars_config.ca_rbac_url,
             "kamatera_controller_replicas": tfvars_config.controller_replicas,
+            "registry_mirror_enabled": config.REGISTRY_MIRROR,
         }, indent=2))
 
 
+@tracing.traced("apply_k8s", ("k8s_version",))
+def apply_k8s(k8s_version, k8s_tfvars_config, ssh_pubkeys=None, **wait_for_kwargs):
+    # can run separately from main, concurrently with other waits which only depend on the rke2 cluster
+    tfdir = workspace.get_tfdir()
+    write_k8s_tfvars(tfdir, ssh_pubkeys or util.get_ssh_pubkeys(), k8s_version, k8s_tfvars_config)
+    with tracing.span("terraform init", cwd="02-k8s"):
+        terraform.init(os.path.join(tfdir, "02-k8s"))
+    terraform.apply_with_retries(os.path.join(tfdir, "02-k8s"), "Terraform apply for k8s to complete", **wait_for_kwargs)
+
+
 def generate_name_prefix():
     return f'kca{datetime.datetime.now().strftime("%m%d")}{secrets.token_hex(2)}'
 
 
+@tracing.traced("setup", ("name_prefix", "k8s_version", "rke2_version", "datacenter_id"))
 def main(name_prefix=None, k8s_version=None, rke2_version=None, datacenter_id=None, with_bastion=False, k8s_tfvars_config=None, extra_servers=None):
     assert config.KAMATERA_API_CLIENT_ID and config.KAMATERA_API_SECRET
     if name_prefix is None:
-        name_prefix = generate_name_prefix()
+        name_prefix = workspace.get_name_prefix() or generate_name_prefix()
     ssh_pubkeys = util.get_ssh_pubkeys()
-    tfdir = os.path.join(os.path.dirname(__file__), "..", "..", "..")
+    tfdir = workspace.get_tfdir()
     print(f'name prefix: {name_prefix}')
     try:
         if k8s_version:
@@ -123,20 +145,12 @@ def main(name_prefix=None, k8s_version=None, rke2_version=None, datacenter_id=No
         if not datacenter_id:
             datacenter_id = "US-NY2"
         write_rke2_tfvars(tfdir, name_prefix, rke2_version, datacenter_id, ssh_pubkeys, with_bastion, extra_servers)
-        subprocess.check_call(["terraform", "init"], cwd=os.path.join(tfdir, "01-rke2"))
-        util.wait_for(
-            "Terraform apply for rke2 to complete",
-            lambda: subprocess.check_call(["terraform", "apply", "-auto-approve"], cwd=os.path.join(tfdir, "01-rke2")) or True,
-            retry_on_exception=True
-        )
+        with tracing.span("terraform init", cwd="01-rke2"):
+            terraform.init(os.path.join(tfdir, "01-rke2"))
+        terraform.apply_with_retries(os.path.join(tfdir, "01-rke2"), "Terraform apply for rke2 to complete")
+        inventory.invalidate(name_prefix, datacenter_id)
         if k8s_tfvars_config:
-            write_k8s_tfvars(tfdir, ssh_pubkeys, k8s_version, k8s_tfvars_config)
-            subprocess.check_call(["terraform", "init"], cwd=os.path.join(tfdir, "02-k8s"))
-            util.wait_for(
-                "Terraform apply for k8s to complete",
-                lambda: subprocess.check_call(["terraform", "apply", "-auto-approve"], cwd=os.path.join(tfdir, "02-k8s")) or True,
-                retry_on_exception=True
-            )
+            apply_k8s(k8s_version, k8s_tfvars_config, ssh_pubkeys=ssh_pubkeys)
     finally:
         print(f'name prefix: {name_prefix}')
     return name_prefix
@@ -0,0 +1,175 @@
+import re
+import os
+import json
+import time
+import signal
+import datetime
+import threading
+import subprocess
+import dataclasses
+
+from . import config, util, tracing, cassette
+
+
+# errors which fail the apply immediately, any other error is retried
+# matched against the error summary only (the "Error:" line of terraform / the provider error message),
+# the detail can include the output of provisioner commands which may mention anything
+FATAL_ERROR_PATTERNS = [
+    r"^(Error:\s*)?Invalid (value|reference|function argument|index)", r"^(Error:\s*)?Unsupported (argument|attribute|block type)",
+    r"^(Error:\s*)?Missing required argument", r"^(Error:\s*)?Reference to undeclared", r"^(Error:\s*)?Inconsistent dependency lock file",
+    r"\b(status|status code|code|HTTP)\W*(401|403)\b", r"\b401 Unauthorized\b", r"\b403 Forbidden\b",
+    r"\bauthentication failed\b", r"\binvalid (api )?credentials\b",
+    r"\bquota (exceeded|limit)", r"\bexceeded\b.*\bquota\b", r"\binsufficient (funds|balance|credit)\b",
+]
+
+
+def classify_error(summary):
+    if any(re.search(pattern, summary or "", re.IGNORECASE | re.MULTILINE) for pattern in FATAL_ERROR_PATTERNS):
+        return "fatal"
+    # unknown errors are retried, same as before streaming apply was added
+    return "retryable"
+
+
+@dataclasses.dataclass
+class ApplyResult:
+    targets: list = None
+    returncode: int = None
+    durations: dict = dataclasses.field(default_factory=dict)  # resource address -> seconds
+    failed: set = dataclasses.field(default_factory=set)  # resource addresses
+    errors: list = dataclasses.field(default_factory=list)  # (address, classification, summary, detail)
+    changes: dict = None
+
+    @property
+    def is_fatal(self):
+        return any(classification == "fatal" for _, classification, _, _ in self.errors)
+
+
+def handle_event(result, event, start_times, print_function=print):
+    event_type = event.get("type")
+    hook = event.get("hook") or {}
+    address = (hook.get("resource") or {}).get("addr")
+    if event_type == "apply_start":
+        start_times[address] = time.time()
+    elif event_type in ("apply_complete", "apply_errored"):
+        elapsed_seconds = hook.get("elapsed_seconds")
+        if elapsed_seconds is None:
+            elapsed_seconds = time.time() - start_times.get(address, time.time())
+        result.durations[address] = elapsed_seconds
+        tracing.add_span(f"terraform {address}", time.time() - elapsed_seconds, time.time(), "ok" if event_type == "apply_complete" else "error")
+        if event_type == "apply_errored":
+            result.failed.add(address)
+    elif event_type == "diagnostic" and event.get("diagnostic", {}).get("severity") == "error":
+        diagnostic = event["diagnostic"]
+        address = diagnostic.get("address")
+        if address:
+            result.failed.add(address)
+        result.errors.append((address, classify_error(diagnostic.get("summary")), diagnostic.get("summary"), diagnostic.get("detail")))
+        print_function(f'Error: {diagnostic.get("summary")}{f" ({address})" if address else ""}')
+        if diagnostic.get("detail"):
+            print_function(diagnostic["detail"])
+        return
+    elif event_type == "change_summary":
+        result.changes = event.get("changes")
+    if event_type not in ("apply_progress", "provision_progress") and event.get("@message"):
+        print_function(event["@message"])
+
+
+def init(cwd):
+    cassette.call("terraform", ["init"], lambda: subprocess.check_call(["terraform", "init"], cwd=cwd), stack=os.path.basename(cwd))
+
+
+@tracing.traced("terraform apply attempt", ("cwd", "targets"))
+def apply(cwd, targets=None, print_function=print, stop_event=None):
+    # runs terraform apply with machine-readable output and parses the events as they arrive
+    args = ["terraform", "apply", "-auto-approve", "-json", *[f"-target={target}" for target in (targets or [])]]
+    result = ApplyResult(targets=targets)
+    start_times = {}
+    proc = cassette.popen("terraform", args[1:], lambda: subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, text=True), stack=os.path.basename(cwd))
+    done_event = threading.Event()
+
+    def interrupt_on_stop():
+        # terraform handles SIGINT gracefully, so that the state is saved and unlocked
+        while not done_event.wait(1):
+            if stop_event.is_set():
+                proc.send_signal(signal.SIGINT)
+                break
+
+    if stop_event:
+        threading.Thread(target=interrupt_on_stop, daemon=True).start()
+    try:
+        for line in proc.stdout:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                print_function(line.rstrip())
+                continue
+            handle_event(result, event, start_times, print_function)
+        result.returncode = proc.wait()
+    finally:
+        done_event.set()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    if result.returncode != 0 and not result.errors:
+        result.errors.append((None, "retryable", f"terraform apply failed with exit code {result.returncode}", None))
+    return result
+
+
+def print_timing_report(durations, top=10, print_function=print):
+    print_function(f'Terraform timing report ({len(durations)} resources, top {top} slowest):')
+    for address, seconds in sorted(durations.items(), key=lambda item: -item[1])[:top]:
+        print_function(f'  {seconds:8.1f}s {address}')
+
+
+@tracing.traced("terraform apply", ("cwd", "description"))
+def apply_with_retries(
+    cwd, description, timeout_seconds=config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS, retries=config.TERRAFORM_APPLY_RETRIES,
+    retry_sleep_seconds=15, print_function=print, stop_event=None
+):
+    # retries apply only the failed resources (terraform includes their dependencies),
+    # followed by a full apply for resources which were skipped because they depend on the failed ones
+    if not config.TERRAFORM_STREAMING:
+        return util.wait_for(
+            description,
+            lambda: cassette.call(
+                "terraform", ["apply", "-auto-approve"], lambda: subprocess.check_call(["terraform", "apply", "-auto-approve"], cwd=cwd), stack=os.path.basename(cwd)
+            ) or True,
+            retry_on_exception=True, timeout_seconds=timeout_seconds, print_function=print_function, stop_event=stop_event
+        )
+    print_function(f'{description} (with timeout {timeout_seconds} seconds)')
+    print_function(f'start time: {datetime.datetime.now().isoformat()}')
+    start_time = time.time()
+    durations = {}
+    targets = None
+    attempt = 0
+    while True:
+        attempt += 1
+        print_function(f'terraform apply attempt {attempt}{f" targeting {len(targets)} failed resources" if targets else ""}')
+        result = apply(cwd, targets, print_function, stop_event)
+        for address, seconds in result.durations.items():
+            durations[address] = durations.get(address, 0) + seconds
+        if stop_event and stop_event.is_set():
+            raise util.WaitCancelled(f"cancelled waiting for {description}")
+        if result.returncode == 0:
+            if targets:
+                targets = None
+                continue
+            break
+        for address, classification, summary, _ in result.errors:
+            print_function(f'  {classification} error: {summary}{f" ({address})" if address else ""}')
+        if result.is_fatal:
+            print_timing_report(durations, print_function=print_function)
+            raise Exception(f"fatal error in {description}: {', '.join(summary for _, c, summary, _ in result.errors if c == 'fatal')}")
+        if attempt > retries or time.time() - start_time > timeout_seconds:
+            print_timing_report(durations, print_function=print_function)
+            raise AssertionError(f"failed {description} after {attempt} attempts")
+        targets = sorted(result.failed) or None
+        if stop_event:
+            if cassette.wait(stop_event, retry_sleep_seconds):
+                raise util.WaitCancelled(f"cancelled waiting for {description}")
+        else:
+            time.sleep(retry_sleep_seconds)
+    print_function(f'condition met: {description} ({attempt} attempts, {time.time() - start_time:.0f} seconds)')
+    print_function(f'end time: {datetime.datetime.now().isoformat()}')
+    print_timing_report(durations, print_function=print_function)
+    return durations
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import atexit
+import inspect
+import itertools
+import threading
+import functools
+import contextvars
+import dataclasses
+
+from . import config
+
+
+# spans are only recorded while a tracer is started, otherwise span / traced / add_span are no-ops
+_tracer = None
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclasses.dataclass
+class Span:
+    name: str
+    id: int
+    parent_id: int = None
+    thread_id: int = None
+    start_time: float = None
+    end_time: float = None
+    outcome: str = None  # ok, error or cancelled
+    attributes: dict = dataclasses.field(default_factory=dict)
+
+    @property
+    def duration_seconds(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class _NoopSpan:
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _SpanContext:
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.span = tracer.start_span(name, attributes)
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self.token)
+        if exc_type is None:
+            outcome = "ok"
+        else:
+            # util.WaitCancelled, not imported to avoid a circular import
+            outcome = "cancelled" if exc_type.__name__ == "WaitCancelled" else "error"
+            self.span.set(error=f'{exc_type.__name__}: {exc}'[:500])
+        self.tracer.end_span(self.span, outcome)
+        return False
+
+
+class Tracer:
+
+    def __init__(self, trace_file=None):
+        self.trace_file = trace_file
+        self.spans = []
+        self.thread_names = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def start_span(self, name, attributes, start_time=None):
+        thread = threading.current_thread()
+        parent = _current_span.get()
+        with self.lock:
+            self.thread_names.setdefault(thread.ident, thread.name)
+            span = Span(
+                name, next(self.ids), parent.id if parent else None, thread.ident,
+                start_time or time.time(), attributes={k: get_attribute_value(v) for k, v in attributes.items()}
+            )
+            self.spans.append(span)
+        return span
+
+    def end_span(self, span, outcome="ok", end_time=None):
+        span.end_time = end_time or time.time()
+        span.outcome = outcome
+
+    def get_chrome_trace(self):
+        # chrome trace event format, can be opened with https://ui.perfetto.dev or chrome://tracing
+        pid = os.getpid()
+        with self.lock:
+            spans = list(self.spans)
+            thread_names = dict(self.thread_names)
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in thread_names.items()
+        ]
+        for span in sorted(spans, key=lambda s: s.start_time):
+            events.append({
+                "name": span.name, "cat": span.name.split(" ")[0], "ph": "X", "pid": pid, "tid": span.thread_id,
+                "ts": int(span.start_time * 1000000), "dur": int(span.duration_seconds * 1000000),
+                "args": {**span.attributes, "outcome": span.outcome or "unfinished", "span_id": span.id, "parent_id": span.parent_id},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, trace_file=None):
+        with open(trace_file or self.trace_file, "w") as f:
+            json.dump(self.get_chrome_trace(), f)
+
+    def get_summary(self, top=config.TRACE_SUMMARY_TOP):
+        with self.lock:
+            spans = list(self.spans)
+        totals = {}
+        for span in spans:
+            total = totals.setdefault(span.name, {"count": 0, "errors": 0, "total_seconds": 0})
+            total["count"] += 1
+            total["errors"] += 1 if span.outcome == "error" else 0
+            total["total_seconds"] += span.duration_seconds
+        return {
+            "slowest": [
+                (span.name, round(span.duration_seconds, 3), span.outcome, span.attributes)
+                for span in sorted(spans, key=lambda s: -s.duration_seconds)[:top]
+            ],
+            "totals": dict(sorted(totals.items(), key=lambda item: -item[1]["total_seconds"])[:top]),
+        }
+
+    def print_summary(self, top=config.TRACE_SUMMARY_TOP, print_function=print):
+        summary = self.get_summary(top)
+        print_function(f'Trace summary, top {top} slowest spans:')
+        for name, seconds, outcome, attributes in summary["slowest"]:
+            details = " ".join(f"{k}={v}" for k, v in attributes.items() if k != "error")
+            print_function(f'  {seconds:9.1f}s {name}{f" [{outcome}]" if outcome != "ok" else ""} {details}'[:300])
+        print_function('Total time by span name:')
+        for name, total in summary["totals"].items():
+            print_function(f'  {total["total_seconds"]:9.1f}s {name} (count={total["count"]}, errors={total["errors"]})')
+        return summary
+
+
+def get_attribute_value(value):
+    return value if value is None or isinstance(value, (bool, int, float)) else str(value)[:200]
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def start(trace_file=config.TRACE_FILE):
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(trace_file)
+        if trace_file:
+            atexit.register(finish)
+    return _tracer
+
+
+def finish(print_function=print):
+    # stops tracing, writes the trace file and prints the summary
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer and tracer.spans:
+        if tracer.trace_file:
+            tracer.write()
+            print_function(f'Trace written to {tracer.trace_file}')
+        tracer.print_summary(print_function=print_function)
+    return tracer
+
+
+def span(name, **attributes):
+    if _tracer is None:
+        return NOOP_SPAN
+    return _SpanContext(_tracer, name, attributes)
+
+
+def current_span():
+    return (_current_span.get() or NOOP_SPAN) if _tracer is not None else NOOP_SPAN
+
+
+def add_span(name, start_time, end_time, outcome="ok", **attributes):
+    # records a span which was measured elsewhere, as a child of the current span
+    if _tracer is not None:
+        _tracer.end_span(_tracer.start_span(name, attributes, start_time=start_time), outcome, end_time=end_time)
+
+
+def traced(name=None, attributes=()):
+    # decorator, records a span for each call with the given arguments of the function as attributes
+    def decorator(func):
+        span_name = name or func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            span_attributes = {}
+            if attributes:
+                arguments = signature.bind_partial(*args, **kwargs).arguments
+                span_attributes = {k: arguments[k] for k in attributes if k in arguments}
+            with _SpanContext(_tracer, span_name, span_attributes):
+                return func(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+def propagate(func):
+    # for functions which run in other threads, so that their spans are children of the current span
+    if _tracer is None:
+        return func
+    parent = _current_span.get()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+
+    return wrapper
+
+
+if config.TRACE_FILE:
+    start()
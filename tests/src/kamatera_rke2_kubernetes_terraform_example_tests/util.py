@@ -1,36 +1,37 @@
 import os
 import json
+import queue
+import typing
+import asyncio
+import functools
+import contextvars
+import dataclasses
+import concurrent.futures
 import subprocess
+import threading
 import time
 import datetime
 import traceback
+import math
+import shlex
+import fnmatch
 from textwrap import dedent
 
-from . import destroy, config
+from . import config, inventory, k8s_api, ingress_bench, workspace, tracing, cassette
 
 
 def get_ssh_pubkeys():
-    return subprocess.check_output(["bash", "-c", "cat ~/.ssh/*.pub"]).decode().strip()
+    return cassette.call("bash", ["cat ~/.ssh/*.pub"], lambda: subprocess.check_output(["bash", "-c", "cat ~/.ssh/*.pub"]).decode().strip())
 
 
 def get_ssh_config(name_prefix=None, bastion_port=None, nodes_port=None, identity_file=None):
     if name_prefix:
-        ssh_config = os.path.join(os.path.dirname(__file__), "..", "..", "..", f"ssh_config_{name_prefix}")
+        ssh_config = os.path.join(workspace.get_tfdir(), f"ssh_config_{name_prefix}")
         if not identity_file:
             identity_file = os.path.expanduser("~/.ssh/id_rsa")
         if bastion_port:
-            bastion_public_ip = None
-            for network in destroy.cloudcli("server", "info", "--name", f"{name_prefix}-bastion", parse_json=True)[0]["networks"]:
-                if network["network"].startswith("wan-"):
-                    bastion_public_ip = network["ips"][0]
-                    break
-            assert bastion_public_ip
-            controlplane_private_ip = None
-            for network in destroy.cloudcli("server", "info", "--name", f"{name_prefix}-controlplane1", parse_json=True)[0]["networks"]:
-                if network["network"].startswith("lan-"):
-                    controlplane_private_ip = network["ips"][0]
-                    break
-            assert controlplane_private_ip
+            bastion_public_ip = inventory.get_server_ip(f"{name_prefix}-bastion", "wan", name_prefix=f"{name_prefix}-")
+            controlplane_private_ip = inventory.get_server_ip(f"{name_prefix}-controlplane1", "lan", name_prefix=f"{name_prefix}-")
             with open(ssh_config, "w") as f:
                 f.write(dedent(f'''
                     Host {name_prefix}-bastion
@@ -44,14 +45,9 @@ def get_ssh_config(name_prefix=None, bastion_port=None, nodes_port=None, identit
                       Port {nodes_port}
                       ProxyJump {name_prefix}-bastion
                       IdentityFile {identity_file}
-                '''))
+                ''') + get_ssh_multiplexing_config())
         else:
-            controlplane_public_ip = None
-            for network in destroy.cloudcli("server", "info", "--name", f"{name_prefix}-controlplane1", parse_json=True)[0]["networks"]:
-                if network["network"].startswith("wan-"):
-                    controlplane_public_ip = network["ips"][0]
-                    break
-            assert controlplane_public_ip
+            controlplane_public_ip = inventory.get_server_ip(f"{name_prefix}-controlplane1", "wan", name_prefix=f"{name_prefix}-")
             with open(ssh_config, "w") as f:
                 f.write(dedent(f'''
                     Host {name_prefix}-controlplane1
@@ -59,34 +55,151 @@ def get_ssh_config(name_prefix=None, bastion_port=None, nodes_port=None, identit
                       User root
                       Port {nodes_port}
                       IdentityFile {identity_file}
-                '''))
+                ''') + get_ssh_multiplexing_config())
     else:
-        ssh_config = os.path.join(os.path.dirname(__file__), "..", "..", "..", "ssh_config")
+        ssh_config = os.path.join(workspace.get_tfdir(), "ssh_config")
     return ssh_config
 
 
+def get_controlplane_node_names(name_prefix):
+    # server-role nodes from 01-rke2/06-k8s-tfvars.tf which exist in the inventory, controlplane1 first
+    taint_tfvars = os.path.join(workspace.get_tfdir(), "02-k8s", "taints.auto.tfvars.json")
+    names = ["controlplane1"]
+    if os.path.exists(taint_tfvars):
+        with open(taint_tfvars) as f:
+            names += [name for name in json.load(f)["controlplane_node_names"] if name not in names]
+    servers = inventory.get_servers(f"{name_prefix}-")
+    return [name for name in names if name == "controlplane1" or f"{name_prefix}-{name}" in servers]
+
+
 def get_kubeconfig(name_prefix=None, bastion_port=None, nodes_port=None, identity_file=None):
     if name_prefix:
-        kubeconfig = os.path.join(os.path.dirname(__file__), "..", "..", "..", f".kubeconfig-{name_prefix}")
-        ssh_config = get_ssh_config(name_prefix, bastion_port, nodes_port, identity_file)
-        controlplane_public_ip = None
-        for network in destroy.cloudcli("server", "info", "--name", f"{name_prefix}-controlplane1", parse_json=True)[0][
-            "networks"]:
-            if network["network"].startswith("wan-"):
-                controlplane_public_ip = network["ips"][0]
-                break
-        assert controlplane_public_ip
-        subprocess.check_call([
-            "bash", "-c", f'''
-                ssh -F {ssh_config} {name_prefix}-controlplane1 "cat /etc/rancher/rke2/rke2.yaml" > {kubeconfig}
-                sed -i 's/127.0.0.1/{controlplane_public_ip}/g' {kubeconfig}
-            '''
-        ])
+        kubeconfig = os.path.join(workspace.get_tfdir(), f".kubeconfig-{name_prefix}")
+        servers = [
+            (name, inventory.get_server_ip(f"{name_prefix}-{name}", "wan", name_prefix=f"{name_prefix}-"))
+            for name in get_controlplane_node_names(name_prefix)
+        ]
+        if not k8s_api.is_kubeconfig_current(kubeconfig, [ip for _, ip in servers]):
+            ssh_config = get_ssh_config(name_prefix, bastion_port, nodes_port, identity_file)
+            rke2_kubeconfig = get_ssh_pool(ssh_config).fetch(f"{name_prefix}-controlplane1", "/etc/rancher/rke2/rke2.yaml")
+            k8s_api.write_ha_kubeconfig(kubeconfig, rke2_kubeconfig.decode(), servers)
     else:
-        kubeconfig = os.path.join(os.path.dirname(__file__), "..", "..", "..", ".kubeconfig")
+        kubeconfig = os.path.join(workspace.get_tfdir(), ".kubeconfig")
     return kubeconfig
 
 
+def get_ssh_multiplexing_config():
+    # same settings as passed to 01-rke2 by setup.write_rke2_tfvars, so that ssh -F, terraform and the session pool share the masters
+    return dedent(f'''
+        Host *
+          ControlMaster auto
+          ControlPath {config.SSH_CONTROL_PATH}
+          ControlPersist {config.SSH_CONTROL_PERSIST_SECONDS}
+    ''')
+
+
+class SSHSessionPool:
+    # remote commands over persistent multiplexed connections, one control master per host which is reused by all calls
+    # masters are closed by ssh after being idle for idle_timeout_seconds
+
+    def __init__(self, ssh_config, idle_timeout_seconds=config.SSH_CONTROL_PERSIST_SECONDS, max_workers=config.SSH_MAX_WORKERS):
+        self.ssh_config = ssh_config
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.last_used = {}
+
+    def get_args(self, host, *options, command=None):
+        return [
+            "ssh", "-F", self.ssh_config,
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={config.SSH_CONTROL_PATH}",
+            "-o", f"ControlPersist={self.idle_timeout_seconds}",
+            *options, host, *([command] if command else [])
+        ]
+
+    def get_hosts(self, selector=None):
+        # selector is a glob pattern or a function of the host name, defaults to all hosts except the bastion
+        hosts = []
+        with open(self.ssh_config) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[0] == "Host" and parts[1] != "*":
+                    hosts.append(parts[1])
+        if selector is None:
+            return [host for host in hosts if not host.endswith("-bastion")]
+        elif callable(selector):
+            return [host for host in hosts if selector(host)]
+        else:
+            return [host for host in hosts if fnmatch.fnmatch(host, selector)]
+
+    def run(self, host, command, input=None, check=True, timeout_seconds=None):
+        # returns a CompletedProcess with stdout and stderr as bytes
+        with self.lock:
+            self.last_used[host] = time.time()
+        p = subprocess.run(
+            self.get_args(host, command=command), input=input.encode() if isinstance(input, str) else input,
+            capture_output=True, timeout=timeout_seconds, stdin=None if input is not None else subprocess.DEVNULL,
+        )
+        if check and p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, p.args, p.stdout, p.stderr)
+        return p
+
+    def run_on_nodes(self, command, selector=None, check=False, timeout_seconds=None):
+        # runs concurrently on all selected hosts, returns a dict of host -> CompletedProcess
+        hosts = self.get_hosts(selector)
+        if not hosts:
+            return {}
+        with concurrent.futures.ThreadPoolExecutor(min(len(hosts), self.max_workers)) as executor:
+            results = executor.map(lambda host: self.run(host, command, check=check, timeout_seconds=timeout_seconds), hosts)
+            return dict(zip(hosts, results))
+
+    def fetch(self, host, remote_path, local_path=None):
+        content = self.run(host, f"cat {shlex.quote(remote_path)}").stdout
+        if local_path:
+            with open(local_path, "wb") as f:
+                f.write(content)
+        return content
+
+    def push(self, host, local_path, remote_path, mode=None):
+        with open(local_path, "rb") as f:
+            content = f.read()
+        command = f"cat > {shlex.quote(remote_path)}"
+        if mode:
+            command += f" && chmod {mode} {shlex.quote(remote_path)}"
+        self.run(host, command, input=content)
+
+    def close(self, host=None):
+        with self.lock:
+            hosts = [host] if host else list(self.last_used)
+            for h in hosts:
+                self.last_used.pop(h, None)
+        for h in hosts:
+            subprocess.run(self.get_args(h, "-O", "exit"), capture_output=True)
+
+    def close_idle(self):
+        # ssh closes idle masters by itself (ControlPersist), this only forgets about them
+        with self.lock:
+            for host, last_used in list(self.last_used.items()):
+                if time.time() - last_used > self.idle_timeout_seconds:
+                    del self.last_used[host]
+
+
+_ssh_pools_lock = threading.Lock()
+_ssh_pools = {}
+
+
+def get_ssh_pool(ssh_config=None):
+    key = os.path.realpath(ssh_config or get_ssh_config())
+    with _ssh_pools_lock:
+        if key not in _ssh_pools:
+            _ssh_pools[key] = SSHSessionPool(key)
+        pool = _ssh_pools[key]
+    pool.close_idle()
+    return pool
+
+
+@tracing.traced("kubectl", ("args",))
 def kubectl(*args, parse_json=False, run=False, timeout_seconds=360, poll_seconds=10, **kwargs):
     if timeout_seconds and poll_seconds:
         state = {}
@@ -99,49 +212,152 @@ def kubectl(*args, parse_json=False, run=False, timeout_seconds=360, poll_second
         )
         return state["res"]
     else:
-        if parse_json:
-            assert not run
-            func = subprocess.check_output
-        elif run:
-            func = subprocess.run
+        return cassette.call(
+            "kubectl", args, lambda: _kubectl(*args, parse_json=parse_json, run=run, **kwargs),
+            parse_json=parse_json, run=run, **{k: v for k, v in kwargs.items() if k != "cwd"}
+        )
+
+
+def _kubectl(*args, parse_json=False, run=False, **kwargs):
+    if config.K8S_NATIVE_CLIENT:
+        res = kubectl_native(*args, parse_json=parse_json, run=run, **kwargs)
+        if res is not NotImplemented:
+            return res
+    if parse_json:
+        assert not run
+        func = subprocess.check_output
+    elif run:
+        func = subprocess.run
+    else:
+        func = subprocess.check_call
+    res = func([
+        "kubectl", *args, *(["-o", "json"] if parse_json else [])
+    ], env={
+        **os.environ,
+        "KUBECONFIG": get_kubeconfig(),
+    }, text=True, **kwargs)
+    if parse_json:
+        return json.loads(res)
+    elif run:
+        return res
+    else:
+        return None
+
+
+KUBECTL_FLAG_ALIASES = {"n": "namespace", "l": "selector", "f": "filename", "o": "output"}
+KUBECTL_VALUE_FLAGS = {"namespace", "selector", "field-selector", "filename", "replicas", "output"}
+
+
+def parse_kubectl_args(args):
+    positional, flags = [], {}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg.startswith("-") and arg != "-":
+            name, *value = arg.lstrip("-").split("=", 1)
+            name = KUBECTL_FLAG_ALIASES.get(name, name)
+            if value:
+                flags[name] = value[0]
+            elif name in KUBECTL_VALUE_FLAGS and args:
+                flags[name] = args.pop(0)
+            else:
+                flags[name] = True
         else:
-            func = subprocess.check_call
-        res = func([
-            "kubectl", *args, *(["-o", "json"] if parse_json else [])
-        ], env={
-            **os.environ,
-            "KUBECONFIG": get_kubeconfig(),
-        }, text=True, **kwargs)
+            positional.append(arg)
+    return positional, flags
+
+
+def kubectl_native(*args, parse_json=False, run=False, **kwargs):
+    # handles the kubectl calls used by the tests using the in-process Kubernetes API client
+    # returns NotImplemented for anything else, including resources / kinds the client doesn't know, which is then handled by the kubectl binary
+    positional, flags = parse_kubectl_args(args)
+    if not positional:
+        return NotImplemented
+    command, positional = positional[0], positional[1:]
+    namespace = flags.pop("namespace", None)
+    if command in ("get", "scale", "delete") and (not positional or "/" in positional[0] or not k8s_api.is_supported_resource(positional[0])):
+        return NotImplemented
+    if command == "get" and (parse_json or flags.get("output") == "json") and not set(kwargs) - {"cwd"} and 1 <= len(positional) <= 2 and not set(flags) - {"selector", "field-selector", "output"}:
+        client = k8s_api.get_client(get_kubeconfig())
+        if len(positional) == 2:
+            res = client.get(positional[0], positional[1], namespace)
+        else:
+            res = client.list(positional[0], namespace, flags.get("selector"), flags.get("field-selector"))
         if parse_json:
-            return json.loads(res)
-        elif run:
             return res
+        # same as the kubectl binary with -o json, other output formats are handled by the kubectl binary
+        print(json.dumps(res, indent=4))
+    elif command == "scale" and not parse_json and not set(kwargs) - {"cwd"} and len(positional) == 2 and set(flags) == {"replicas"}:
+        k8s_api.get_client(get_kubeconfig()).scale(positional[0], positional[1], int(flags["replicas"]), namespace)
+        print(f"{positional[0]}/{positional[1]} scaled")
+    elif command == "apply" and not parse_json and not positional and set(flags) == {"filename"} and not set(kwargs) - {"input", "cwd"}:
+        if flags["filename"] == "-":
+            if "input" not in kwargs:
+                # the kubectl binary reads the manifest from stdin
+                return NotImplemented
+            objs = list(k8s_api.yaml.load_all(kwargs["input"]))
         else:
-            return None
+            with open(os.path.join(kwargs.get("cwd") or "", flags["filename"])) as f:
+                objs = list(k8s_api.yaml.load_all(f))
+        objs = [obj for obj in objs if obj]
+        if not objs or not all(k8s_api.is_supported_object(obj) for obj in objs):
+            return NotImplemented
+        # server-side apply, unlike the client-side apply of the kubectl binary there is no last-applied-configuration annotation,
+        # so fields removed from the manifest are only pruned if they are owned by this field manager
+        client = k8s_api.get_client(get_kubeconfig())
+        for obj in objs:
+            if namespace and k8s_api.RESOURCES[k8s_api.KIND_RESOURCES[obj["kind"]]][1]:
+                obj["metadata"].setdefault("namespace", namespace)
+            client.apply(obj)
+            print(f'{obj["kind"].lower()}/{obj["metadata"]["name"]} serverside-applied')
+    elif command == "delete" and not parse_json and not set(kwargs) - {"cwd"} and len(positional) >= 2 and not set(flags) - {"ignore-not-found", "wait"}:
+        client = k8s_api.get_client(get_kubeconfig())
+        for name in positional[1:]:
+            client.delete(positional[0], name, namespace, ignore_not_found=bool(flags.get("ignore-not-found")))
+            print(f"{positional[0]}/{name} deleted")
+        if flags.get("wait") in (True, "true"):
+            for name in positional[1:]:
+                while client.exists(positional[0], name, namespace):
+                    time.sleep(1)
+    else:
+        return NotImplemented
+    return subprocess.CompletedProcess(["kubectl", *args], 0) if run else None
+
+
+def print_progress(progress, print_function=print):
+    if progress:
+        try:
+            res = progress()
+            if res is not None:
+                print_function(res)
+        except:
+            traceback.print_exc()
+
+
+class WaitCancelled(AssertionError):
+    pass
 
 
+@tracing.traced("wait_for", ("description", "timeout_seconds"))
 def wait_for(
     description, condition, timeout_seconds=config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS, progress=None, poll_seconds=15, retry_on_exception=False,
-    print_function=print
+    print_function=print, stop_event=None
 ):
     start_time = time.time()
     print_function(f'waiting for condition: {description} (with timeout {timeout_seconds} seconds)')
     print_function(f'start time: {datetime.datetime.now().isoformat()}')
 
     def progress_():
-        if progress:
-            try:
-                res = progress()
-                if res is not None:
-                    print_function(res)
-            except:
-                traceback.print_exc()
+        print_progress(progress, print_function)
 
     i = 0
     while True:
         i += 1
+        tracing.current_span().set(attempts=i)
         try:
-            res = condition()
+            with tracing.span("wait_for attempt", attempt=i) as span:
+                res = condition()
+                span.set(met=bool(res))
         except:
             if retry_on_exception:
                 traceback.print_exc()
@@ -158,14 +374,169 @@ def wait_for(
             raise AssertionError(f"timeout waiting for {description}")
         if i % 10 == 0:
             progress_()
-        time.sleep(poll_seconds)
+        if stop_event:
+            if cassette.wait(stop_event, poll_seconds):
+                raise WaitCancelled(f"cancelled waiting for {description}")
+        else:
+            time.sleep(poll_seconds)
 
 
-def kubectl_node_count(label_selector=None):
-    data = kubectl("get", "nodes", *(["-l", label_selector] if label_selector else []), parse_json=True)
+@tracing.traced("wait_for_k8s", ("description", "resource", "timeout_seconds"))
+def wait_for_k8s(
+    description, resource, condition, namespace=None, label_selector=None, field_selector=None,
+    timeout_seconds=config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS, progress=None, print_function=print, progress_seconds=150,
+    stop_event=None
+):
+    # condition receives the list of current objects and is re-evaluated on every watch event
+    # falls back to polling with wait_for if watch is disabled or fails
+    start_time = time.time()
+    if config.K8S_WATCH and is_k8s_native_client():
+        print_function(f'waiting for condition: {description} (watching {resource}, with timeout {timeout_seconds} seconds)')
+        print_function(f'start time: {datetime.datetime.now().isoformat()}')
+        last_progress_time = start_time
+        try:
+            client = k8s_api.get_client(get_kubeconfig())
+            for event_type, obj, objects in k8s_api.watch_objects(
+                client, resource, namespace, label_selector, field_selector,
+                timeout_seconds=max(1, min(60, progress_seconds, timeout_seconds)), stop_event=stop_event
+            ):
+                if condition(list(objects.values())):
+                    print_function(f'condition met: {description}')
+                    print_function(f'end time: {datetime.datetime.now().isoformat()}')
+                    print_progress(progress, print_function)
+                    return
+                if time.time() - start_time > timeout_seconds:
+                    print_progress(progress, print_function)
+                    raise AssertionError(f"timeout waiting for {description}")
+                if time.time() - last_progress_time > progress_seconds:
+                    last_progress_time = time.time()
+                    print_progress(progress, print_function)
+            raise WaitCancelled(f"cancelled waiting for {description}")
+        except AssertionError:
+            raise
+        except Exception:
+            traceback.print_exc()
+            print_function(f'watch failed, falling back to polling: {description}')
+    wait_for(
+        description,
+        lambda: condition(kubectl(
+            "get", resource,
+            *(["-n", namespace] if namespace else []),
+            *(["-l", label_selector] if label_selector else []),
+            *([f"--field-selector={field_selector}"] if field_selector else []),
+            parse_json=True, timeout_seconds=None, poll_seconds=None
+        )["items"]),
+        timeout_seconds=max(1, timeout_seconds - (time.time() - start_time)),
+        progress=progress,
+        retry_on_exception=True,
+        print_function=print_function,
+        stop_event=stop_event,
+    )
+
+
+@dataclasses.dataclass
+class Wait:
+    description: str
+    # blocking function which returns when the condition is met and raises on failure
+    # called with timeout_seconds, stop_event and print_function keyword arguments, should stop when stop_event is set
+    run: typing.Callable
+    status: str = "pending"
+    end_time: float = None
+    last_message: str = ""
+    # prints all the output of the wait, prefixed with its description, instead of only the last line in the status report
+    # should be set for tasks which aren't polling a condition, so that their logs and diagnostics are not lost
+    stream_output: bool = False
+
+
+def _run_wait(wait, **kwargs):
+    with tracing.span("wait", description=wait.description):
+        return wait.run(**kwargs)
+
+
+async def _run_waits(waits, timeout_seconds, return_when, print_function, progress_seconds):
+    start_time = time.time()
+    stop_event = threading.Event()
+    # not using asyncio.to_thread because the default executor is joined on exit of asyncio.run
+    # which would block until cancelled waits notice the stop_event
+    executor = concurrent.futures.ThreadPoolExecutor(len(waits))
+    # all the waits start from the current replay clock, even if some of them complete before others are started
+    run_wait = cassette.forked(_run_wait)
+
+    def print_status(title):
+        lines = [f'{datetime.datetime.now().isoformat()} {title} ({int(time.time() - start_time)}/{timeout_seconds} seconds)']
+        for wait in waits:
+            elapsed_seconds = int((wait.end_time or time.time()) - start_time)
+            lines.append(f'  [{wait.status} {elapsed_seconds}s] {wait.description}{f": {wait.last_message}" if wait.last_message else ""}')
+        print_function("\n".join(lines))
+
+    async def run(wait):
+        def wait_print_function(*args):
+            lines = " ".join(str(arg) for arg in args).strip().splitlines()
+            if wait.stream_output and lines:
+                print_function("\n".join(f'[{wait.description}] {line}' for line in lines))
+            wait.last_message = lines[-1][:200] if lines else ""
+
+        wait.status = "waiting"
+        try:
+            await asyncio.get_running_loop().run_in_executor(executor, functools.partial(
+                contextvars.copy_context().run, run_wait, wait,
+                timeout_seconds=timeout_seconds, stop_event=stop_event, print_function=wait_print_function
+            ))
+        except BaseException:
+            wait.status = "cancelled" if stop_event.is_set() else "failed"
+            raise
+        finally:
+            wait.end_time = time.time()
+        wait.status = "met"
+        print_status(f'condition met: {wait.description}')
+        return wait
+
+    async def report():
+        while True:
+            await asyncio.sleep(progress_seconds)
+            print_status("waiting for conditions")
+
+    print_status(f'waiting for {"all" if return_when == asyncio.FIRST_EXCEPTION else "any"} of {len(waits)} conditions')
+    tasks = [asyncio.create_task(run(wait)) for wait in waits]
+    reporter = asyncio.create_task(report())
+    try:
+        pending = tasks
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0, timeout_seconds - (time.time() - start_time)), return_when=return_when)
+            if not done:
+                raise AssertionError(f"timeout waiting for: {', '.join(wait.description for wait in waits if wait.status == 'waiting')}")
+            for task in done:
+                if task.exception() is None:
+                    if return_when == asyncio.FIRST_COMPLETED:
+                        return task.result()
+                elif return_when == asyncio.FIRST_EXCEPTION or not pending:
+                    print_status(f'condition failed: {waits[tasks.index(task)].description}')
+                    raise task.exception()
+        return waits
+    finally:
+        stop_event.set()
+        reporter.cancel()
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False)
+
+
+@tracing.traced("wait_all")
+def wait_all(waits, timeout_seconds=config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS, print_function=print, progress_seconds=150):
+    # runs the waits concurrently under a shared timeout, fails as soon as any of them fails
+    return asyncio.run(_run_waits(waits, timeout_seconds, asyncio.FIRST_EXCEPTION, print_function, progress_seconds))
+
+
+@tracing.traced("wait_any")
+def wait_any(waits, timeout_seconds=config.DEFAULT_WAIT_FOR_TIMEOUT_SECONDS, print_function=print, progress_seconds=150):
+    # runs the waits concurrently under a shared timeout, returns the first wait which succeeded
+    return asyncio.run(_run_waits(waits, timeout_seconds, asyncio.FIRST_COMPLETED, print_function, progress_seconds))
+
+
+def count_nodes(nodes):
     total_nodes = 0
     ready_nodes = 0
-    for node in data.get("items", []):
+    for node in nodes:
         total_nodes += 1
         for condition in node.get("status", {}).get("conditions", []):
             if condition.get("type") == "Ready" and condition.get("status") == "True":
@@ -174,8 +545,7 @@ def kubectl_node_count(label_selector=None):
     return total_nodes, ready_nodes
 
 
-def kubectl_pods_count(namespace):
-    pods = kubectl("get", "pods", "-n", namespace, parse_json=True)["items"]
+def count_pods(pods):
     total = 0
     running = 0
     for pod in pods:
@@ -185,20 +555,169 @@ def kubectl_pods_count(namespace):
     return total, running
 
 
-def curl_unique_demo_pods(ips, pods):
-    start_time = time.time()
+def is_k8s_native_client():
+    # while a cassette is recorded or replayed, reads go through kubectl so that they are recorded / served from the cassette
+    return config.K8S_NATIVE_CLIENT and not cassette.get_cassette()
+
+
+def list_node_summaries(label_selector=None, field_selector=None):
+    # paginated listing with the selectors applied by the server, only compact summaries are kept
+    if is_k8s_native_client():
+        return k8s_api.get_client(get_kubeconfig()).list_summaries("nodes", k8s_api.NodeSummary, None, label_selector, field_selector)
+    data = kubectl(
+        "get", "nodes", *(["-l", label_selector] if label_selector else []),
+        *(["--field-selector", field_selector] if field_selector else []), parse_json=True
+    )
+    return [k8s_api.NodeSummary.from_object(node) for node in data.get("items", [])]
+
+
+def list_pod_summaries(namespace, label_selector=None, field_selector=None):
+    if is_k8s_native_client():
+        return k8s_api.get_client(get_kubeconfig()).list_summaries("pods", k8s_api.PodSummary, namespace, label_selector, field_selector)
+    data = kubectl(
+        "get", "pods", "-n", namespace, *(["-l", label_selector] if label_selector else []),
+        *(["--field-selector", field_selector] if field_selector else []), parse_json=True
+    )
+    return [k8s_api.PodSummary.from_object(pod) for pod in data["items"]]
+
+
+def kubectl_node_count(label_selector=None):
+    # memory is bounded by a single page regardless of the number of nodes
+    if is_k8s_native_client():
+        return k8s_api.get_client(get_kubeconfig()).count("nodes", k8s_api.NodeSummary, lambda node: node.ready, label_selector=label_selector)
+    nodes = list_node_summaries(label_selector)
+    return len(nodes), sum(1 for node in nodes if node.ready)
+
+
+def kubectl_pods_count(namespace):
+    if is_k8s_native_client():
+        return k8s_api.get_client(get_kubeconfig()).count("pods", k8s_api.PodSummary, lambda pod: pod.phase == "Running", namespace)
+    pods = list_pod_summaries(namespace)
+    return len(pods), sum(1 for pod in pods if pod.phase == "Running")
+
+
+def wait_for_node_count(expected_total, expected_ready, label_selector=None, **kwargs):
+    kwargs.setdefault("progress", lambda: kubectl("get", "nodes"))
+    wait_for_k8s(
+        kwargs.pop("description", None) or f"{expected_total} total nodes, {expected_ready} ready nodes",
+        "nodes", lambda nodes: count_nodes(nodes) == (expected_total, expected_ready),
+        label_selector=label_selector, **kwargs
+    )
+
+
+def wait_for_pods_count(namespace, expected_total, expected_running, **kwargs):
+    kwargs.setdefault("progress", lambda: kubectl("get", "pods", "-n", namespace))
+    wait_for_k8s(
+        kwargs.pop("description", None) or f"{expected_total} pods total, {expected_running} running in namespace {namespace}",
+        "pods", lambda pods: count_pods(pods) == (expected_total, expected_running),
+        namespace=namespace, **kwargs
+    )
+
+
+def get_node_state(node):
+    ready = next((
+        condition.get("status") for condition in node.get("status", {}).get("conditions", [])
+        if condition.get("type") == "Ready"
+    ), None)
+    return f'ready={ready} unschedulable={bool(node.get("spec", {}).get("unschedulable"))}'
+
+
+def get_pod_state(pod):
+    status = pod.get("status", {})
+    restarts = sum(container.get("restartCount", 0) for container in status.get("containerStatuses", []))
+    return f'phase={status.get("phase")} node={pod.get("spec", {}).get("nodeName")} restarts={restarts}'
+
+
+@tracing.traced("wait_for_stability", ("description", "quiet_seconds"))
+def wait_for_stability(
+    description, watches, condition, quiet_seconds=config.STABILITY_QUIET_SECONDS,
+    timeout_seconds=config.STABILITY_TIMEOUT_SECONDS, print_function=print, progress_seconds=60
+):
+    # watches: dict of name -> (resource, namespace, get_state), get_state returns the relevant state of an object
+    # condition receives a dict of name -> list of objects
+    # stable once the condition is met and no object was added, deleted or changed state for quiet_seconds
+    # returns the list of observed transitions: (time, watch name, object key, old state, new state)
+    print_function(f'waiting for stability: {description} (quiet window {quiet_seconds} seconds, with timeout {timeout_seconds} seconds)')
+    print_function(f'start time: {datetime.datetime.now().isoformat()}')
+    client = k8s_api.get_client(get_kubeconfig())
+    events = queue.Queue()
+    stop_event = threading.Event()
+
+    def watch(name, resource, namespace, get_state):
+        try:
+            for event_type, obj, objects in k8s_api.watch_objects(client, resource, namespace, stop_event=stop_event):
+                events.put((name, {key: get_state(o) for key, o in objects.items()}, list(objects.values())))
+        except Exception as e:
+            events.put((name, e, None))
+
+    for name, (resource, namespace, get_state) in watches.items():
+        threading.Thread(target=watch, args=(name, resource, namespace, get_state), daemon=True).start()
+    states, objects, transitions = {}, {}, []
+    start_time = last_transition_time = last_progress_time = time.time()
+    try:
+        while True:
+            now = time.time()
+            is_met = len(states) == len(watches) and condition(objects)
+            if is_met and now - last_transition_time >= quiet_seconds:
+                print_function(f'stable: {description} (no transitions for {int(now - last_transition_time)} seconds, {len(transitions)} transitions total)')
+                print_function(f'end time: {datetime.datetime.now().isoformat()}')
+                return transitions
+            remaining_seconds = timeout_seconds - (now - start_time)
+            if remaining_seconds < quiet_seconds - (now - last_transition_time):
+                print_function(f'not enough time left to reach a quiet window of {quiet_seconds} seconds')
+                for transition_time, name, key, old_state, new_state in transitions[-20:]:
+                    print_function(f'  {datetime.datetime.fromtimestamp(transition_time).isoformat()} {name} {key}: {old_state} -> {new_state}')
+                raise AssertionError(f"unstable: {description} ({len(transitions)} transitions, condition met: {is_met})")
+            if now - last_progress_time > progress_seconds:
+                last_progress_time = now
+                print_function(f'{int(now - start_time)}s: condition met: {is_met}, quiet for {int(now - last_transition_time)}s, {len(transitions)} transitions')
+            try:
+                name, new_states, new_objects = events.get(timeout=max(0.1, min(
+                    progress_seconds, remaining_seconds, quiet_seconds - (now - last_transition_time) if is_met else progress_seconds
+                )))
+            except queue.Empty:
+                continue
+            if isinstance(new_states, Exception):
+                raise new_states
+            old_states = states.get(name)
+            if old_states is not None:
+                for key in sorted(set(old_states) | set(new_states)):
+                    old_state, new_state = old_states.get(key), new_states.get(key)
+                    if old_state != new_state:
+                        last_transition_time = time.time()
+                        transitions.append((last_transition_time, name, key, old_state, new_state))
+                        print_function(
+                            f'{datetime.datetime.fromtimestamp(last_transition_time).isoformat()} '
+                            f'{name} {key}: {old_state or "(added)"} -> {new_state or "(deleted)"}, quiet window reset'
+                        )
+            states[name] = new_states
+            objects[name] = new_objects
+    finally:
+        stop_event.set()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    # nearest-rank percentile
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def curl_unique_demo_pods(ips, pods, port=80, timeout_seconds=300):
+    # sends requests over pooled keep-alive connections until every ip returned every demo pod
     expected_count = len(pods)
-    ip_pods = {
-        ip: set() for ip in ips
-    }
-    while not all(len(p) >= expected_count for p in ip_pods.values()):
-        for ip in ips:
-            if len(ip_pods[ip]) < expected_count:
-                try:
-                    pod = subprocess.check_output(["curl", "-H", "Host: demo.example.com", "-s", f"http://{ip}/"], text=True).strip()
-                except subprocess.CalledProcessError:
-                    continue
-                assert pod in pods, f"unexpected pod name '{pod}' from ip {ip}"
-                ip_pods[ip].add(pod)
-        assert time.time() - start_time < 300, "timeout curling demo pods"
+
+    def run():
+        result = ingress_bench.run(
+            ips, concurrency=2 * len(ips), duration_seconds=timeout_seconds, port=port,
+            stop_condition=lambda result: all(len(result.ip_pods.get(ip, ())) >= expected_count for ip in ips)
+        )
+        return {ip: sorted(result.ip_pods.get(ip, ())) for ip in ips}
+
+    ip_pods = {ip: set(ip_pod_names) for ip, ip_pod_names in cassette.call("ingress", list(ips), run, port=port, expected_count=expected_count).items()}
+    for ip, ip_pod_names in ip_pods.items():
+        for pod in ip_pod_names:
+            assert pod in pods, f"unexpected pod name '{pod}' from ip {ip}"
+    assert all(len(p) >= expected_count for p in ip_pods.values()), "timeout curling demo pods"
     return ip_pods
@@ -0,0 +1,95 @@
+import os
+import fcntl
+import shutil
+import contextlib
+import contextvars
+
+from . import config
+
+
+ROOT_TFDIR = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+WORKSPACE_FILES = ["01-rke2", "02-k8s", "server_startup_script.sh"]
+# per cluster state, not copied into new workspaces
+WORKSPACE_IGNORE_PATTERNS = [".terraform", "terraform.tfstate*", "*.auto.tfvars.json", "ssh_known_hosts.*", "bootstrap.json"]
+# shared flock held while a workspace is in use, in any process on this host
+IN_USE_LOCK_FILE = ".in_use.lock"
+
+_tfdir = contextvars.ContextVar("tfdir", default=None)
+
+
+def get_workspaces_dir():
+    return config.WORKSPACES_DIR or os.path.join(ROOT_TFDIR, ".workspaces")
+
+
+def get_workspace_tfdir(name_prefix):
+    return os.path.join(get_workspaces_dir(), name_prefix)
+
+
+def get_tfdir():
+    # terraform dir of the current context, all cluster files (state, tfvars, .kubeconfig, ssh_config, .cluster_token)
+    # are relative to it, so each workspace is isolated from the repo root and from other workspaces
+    return _tfdir.get() or ROOT_TFDIR
+
+
+def get_name_prefix():
+    tfdir = _tfdir.get()
+    return os.path.basename(tfdir) if tfdir else None
+
+
+def exists(name_prefix):
+    return os.path.isdir(get_workspace_tfdir(name_prefix))
+
+
+def create(name_prefix):
+    # working copy of the terraform stacks, existing workspaces are updated without touching their state
+    tfdir = get_workspace_tfdir(name_prefix)
+    os.makedirs(tfdir, exist_ok=True)
+    for name in WORKSPACE_FILES:
+        src, dst = os.path.join(ROOT_TFDIR, name), os.path.join(tfdir, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst, dirs_exist_ok=True, ignore=shutil.ignore_patterns(*WORKSPACE_IGNORE_PATTERNS))
+        else:
+            shutil.copy2(src, dst)
+    return tfdir
+
+
+def remove(name_prefix):
+    shutil.rmtree(get_workspace_tfdir(name_prefix), ignore_errors=True)
+
+
+def is_in_use(name_prefix):
+    path = os.path.join(get_workspace_tfdir(name_prefix), IN_USE_LOCK_FILE)
+    if not os.path.exists(path):
+        return False
+    with open(path) as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return False
+
+
+def list_workspaces():
+    workspaces_dir = get_workspaces_dir()
+    if not os.path.isdir(workspaces_dir):
+        return []
+    return sorted(name for name in os.listdir(workspaces_dir) if os.path.isdir(os.path.join(workspaces_dir, name)))
+
+
+@contextlib.contextmanager
+def use(name_prefix, create_if_missing=True):
+    # the workspace is bound to the current context, threads started with a copy of the context
+    # (e.g. util.wait_all) use the same workspace
+    if create_if_missing:
+        tfdir = create(name_prefix)
+    else:
+        assert exists(name_prefix), f"workspace does not exist: {name_prefix}"
+        tfdir = get_workspace_tfdir(name_prefix)
+    with open(os.path.join(tfdir, IN_USE_LOCK_FILE), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        token = _tfdir.set(tfdir)
+        try:
+            yield tfdir
+        finally:
+            _tfdir.reset(token)
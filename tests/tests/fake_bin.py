@@ -0,0 +1,37 @@
+import os
+import sys
+
+
+def install_fake_bin(tmp_path, monkeypatch, name, script):
+    # installs a python script as an executable on PATH, returns the directory of the script
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir(exist_ok=True)
+    (bin_path / f"fake_{name}.py").write_text(script)
+    (bin_path / name).write_text(f'#!/bin/sh\nexec {sys.executable} {bin_path / f"fake_{name}.py"} "$@"\n')
+    os.chmod(bin_path / name, 0o755)
+    monkeypatch.setenv("PATH", f'{bin_path}:{os.environ["PATH"]}')
+    return bin_path
+
+
+FAKE_HOSTNAME = '''
+import os
+import sys
+print(os.environ.get("FAKE_HOSTNAME_IPS", "10.0.0.5 1.2.3.4") if "-I" in sys.argv else "worker1")
+'''
+
+FAKE_ENVSUBST = '''
+import os
+import sys
+sys.stdout.write(os.path.expandvars(sys.stdin.read()))
+'''
+
+FAKE_SSH_KEYGEN = '''
+import sys
+open(sys.argv[sys.argv.index("-f") + 1], "w").close()
+'''
+
+
+def install_startup_script_fake_bins(tmp_path, monkeypatch):
+    # the commands server_startup_script.sh needs in dry run, except curl
+    for name, script in [("hostname", FAKE_HOSTNAME), ("envsubst", FAKE_ENVSUBST), ("ssh-keygen", FAKE_SSH_KEYGEN)]:
+        install_fake_bin(tmp_path, monkeypatch, name, script)
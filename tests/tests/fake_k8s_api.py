@@ -0,0 +1,234 @@
+import re
+import copy
+import json
+import time
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+PATH_RE = re.compile(
+    r'^/(?:api/v1|apis/[^/]+/[^/]+)(?:/namespaces/(?P<namespace>[^/]+))?/(?P<resource>[^/]+)(?:/(?P<name>[^/]+)(?:/(?P<subresource>[^/]+))?)?$'
+)
+
+
+def match_selector(selector, values):
+    for requirement in filter(None, (selector or "").split(",")):
+        key, value = requirement.split("=", 1)
+        if values.get(key.rstrip("=")) != value:
+            return False
+    return True
+
+
+def get_field_values(obj):
+    return {
+        "metadata.name": obj["metadata"]["name"],
+        "metadata.namespace": obj["metadata"].get("namespace"),
+        "spec.nodeName": obj.get("spec", {}).get("nodeName"),
+        "status.phase": obj.get("status", {}).get("phase"),
+        "reason": obj.get("reason"),
+    }
+
+
+class FakeK8sApi:
+    # minimal in-memory Kubernetes API server used to test the API client without a cluster
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.objects = {}
+        self.events = []
+        self.resource_version = 0
+        self.compacted_resource_version = 0
+        self.connections = 0
+        self.requests = []
+        # resource -> (count, function of index returning an object), synthetic objects generated on each list
+        self.generated = {}
+        # path -> json response of services proxied by the api server
+        self.proxied = {}
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+            wbufsize = -1
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self, method):
+                url = urllib.parse.urlparse(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with fake.lock:
+                    fake.requests.append((method, url.path, query))
+                if url.path in fake.proxied:
+                    return self._send(200, fake.proxied[url.path])
+                match = PATH_RE.match(url.path)
+                if not match:
+                    return self._send(404, {"kind": "Status", "code": 404})
+                if method == "GET" and query.get("watch") and not match.group("name"):
+                    return self._stream(fake.watch(
+                        match.group("resource"), match.group("namespace"), query.get("resourceVersion"),
+                        int(query.get("timeoutSeconds") or 60), query.get("labelSelector"), query.get("fieldSelector")
+                    ))
+                status, data = fake.handle(method, query, json.loads(body) if body else None, **match.groupdict())
+                self._send(status, data)
+
+            def _stream(self, events):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for event in events:
+                    data = json.dumps(event).encode() + b"\n"
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_PATCH(self):
+                self._handle("PATCH")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def write_kubeconfig(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "apiVersion": "v1",
+                "clusters": [{"name": "default", "cluster": {"server": f"http://127.0.0.1:{self.port}"}}],
+                "contexts": [{"name": "default", "context": {"cluster": "default", "user": "default"}}],
+                "current-context": "default",
+                "users": [{"name": "default", "user": {"token": "fake"}}],
+            }, f)
+        return path
+
+    def _add_event(self, event_type, resource, obj):
+        self.events.append((self.resource_version, event_type, resource, copy.deepcopy(obj)))
+        self.changed.notify_all()
+
+    def put(self, resource, obj):
+        with self.lock:
+            self.resource_version += 1
+            obj.setdefault("metadata", {})["resourceVersion"] = str(self.resource_version)
+            key = (resource, obj["metadata"].get("namespace"), obj["metadata"]["name"])
+            self._add_event("MODIFIED" if key in self.objects else "ADDED", resource, obj)
+            self.objects[key] = obj
+            return obj
+
+    def remove(self, resource, name, namespace=None):
+        with self.lock:
+            obj = self.objects.pop((resource, namespace, name), None)
+            if obj:
+                self.resource_version += 1
+                obj["metadata"]["resourceVersion"] = str(self.resource_version)
+                self._add_event("DELETED", resource, obj)
+            return obj
+
+    def compact(self):
+        # drops the event history, watches from older resource versions will get 410 Gone
+        with self.lock:
+            self.events = []
+            self.compacted_resource_version = self.resource_version
+
+    def watch(self, resource, namespace, resource_version, timeout_seconds, label_selector=None, field_selector=None):
+        deadline = time.time() + timeout_seconds
+        resource_version = int(resource_version) if resource_version else self.resource_version
+        if resource_version < self.compacted_resource_version:
+            yield {"type": "ERROR", "object": {"kind": "Status", "code": 410, "reason": "Expired"}}
+            return
+        while True:
+            with self.changed:
+                events = [
+                    event for event in self.events
+                    if event[0] > resource_version and event[2] == resource
+                    and (namespace is None or event[3]["metadata"].get("namespace") == namespace)
+                    and match_selector(label_selector, event[3]["metadata"].get("labels", {}))
+                    and match_selector(field_selector, get_field_values(event[3]))
+                ]
+                resource_version = max(resource_version, self.resource_version)
+                if not events:
+                    if time.time() >= deadline:
+                        return
+                    self.changed.wait(deadline - time.time())
+            for _, event_type, _, obj in events:
+                yield {"type": event_type, "object": obj}
+
+    def list(self, resource, namespace=None, label_selector=None, field_selector=None):
+        with self.lock:
+            return [
+                obj for (r, ns, _), obj in sorted(self.objects.items(), key=lambda item: (item[0][1] or "", item[0][2]))
+                if r == resource and (namespace is None or ns == namespace)
+                and match_selector(label_selector, obj["metadata"].get("labels", {}))
+                and match_selector(field_selector, get_field_values(obj))
+            ]
+
+    def list_generated(self, resource, limit, continue_token):
+        count, get_object = self.generated[resource]
+        start = int(continue_token or 0)
+        end = min(count, start + limit) if limit else count
+        metadata = {"resourceVersion": str(self.resource_version)}
+        if end < count:
+            metadata.update({"continue": str(end), "remainingItemCount": count - end})
+        return {"kind": "List", "metadata": metadata, "items": [get_object(i) for i in range(start, end)]}
+
+    def handle(self, method, query, body, namespace, resource, name, subresource):
+        with self.lock:
+            key = (resource, namespace, name)
+            if method == "GET" and not name and resource in self.generated:
+                return 200, self.list_generated(resource, int(query.get("limit") or 0), query.get("continue"))
+            elif method == "GET" and not name:
+                items = self.list(resource, namespace, query.get("labelSelector"), query.get("fieldSelector"))
+                metadata = {"resourceVersion": str(self.resource_version)}
+                if query.get("limit"):
+                    start = int(query.get("continue") or 0)
+                    end = start + int(query["limit"])
+                    if end < len(items):
+                        metadata.update({"continue": str(end), "remainingItemCount": len(items) - end})
+                    items = items[start:end]
+                return 200, {"kind": "List", "metadata": metadata, "items": items}
+            elif method == "GET":
+                if key in self.objects:
+                    return 200, self.objects[key]
+            elif method == "PATCH" and subresource == "scale":
+                if key in self.objects:
+                    obj = self.objects[key]
+                    obj["spec"]["replicas"] = body["spec"]["replicas"]
+                    self.put(resource, obj)
+                    return 200, {"kind": "Scale", "spec": {"replicas": obj["spec"]["replicas"]}}
+            elif method == "PATCH":
+                return 200, self.put(resource, body)
+            elif method == "DELETE":
+                obj = self.remove(resource, name, namespace)
+                if obj:
+                    return 200, obj
+            return 404, {"kind": "Status", "code": 404, "reason": "NotFound"}
@@ -0,0 +1,136 @@
+import re
+import json
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FakeKamateraApi:
+    # minimal in-memory Kamatera cloudcli API server used to test the API client without an account
+
+    def __init__(self, command_polls=1):
+        self.lock = threading.RLock()
+        self.servers = {}
+        self.networks = {}  # datacenter -> list of networks
+        self.subnets = {}  # vlan id -> list of subnets
+        self.commands = {}  # id -> remaining polls until complete
+        self.command_polls = command_polls
+        self.rate_limit_responses = 0
+        self.connections = 0
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, data, headers=None):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self, method):
+                url = urllib.parse.urlparse(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with fake.lock:
+                    fake.requests.append((method, url.path))
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                    is_rate_limited = fake.rate_limit_responses > 0
+                    if is_rate_limited:
+                        fake.rate_limit_responses -= 1
+                try:
+                    if self.headers.get("AuthClientId") != "client-id" or self.headers.get("AuthSecret") != "secret":
+                        return self._send(401, {"message": "unauthorized"})
+                    if is_rate_limited:
+                        return self._send(429, {"message": "too many requests"}, {"Retry-After": "0"})
+                    status, data = fake.handle(method, url.path, query, json.loads(body) if body else None)
+                    self._send(status, data)
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_server(self, name, power="on", datacenter="EU"):
+        with self.lock:
+            self.servers[name] = {"id": name, "name": name, "power": power, "datacenter": datacenter, "networks": []}
+
+    def add_command(self):
+        with self.lock:
+            command_id = len(self.commands) + 1
+            self.commands[command_id] = self.command_polls
+            return command_id
+
+    def handle(self, method, path, query, body):
+        with self.lock:
+            if (method, path) == ("GET", "/service/servers"):
+                return 200, [{k: s[k] for k in ("id", "name", "power", "datacenter")} for s in self.servers.values()]
+            elif (method, path) == ("POST", "/service/server/info"):
+                return 200, [s for name, s in self.servers.items() if re.fullmatch(body["name"], name)]
+            elif (method, path) == ("POST", "/service/server/poweroff"):
+                command_ids = []
+                for name, server in self.servers.items():
+                    if re.fullmatch(body["name"], name):
+                        server["power"] = "off"
+                        command_ids.append(self.add_command())
+                return 200, command_ids
+            elif (method, path) == ("POST", "/service/server/terminate"):
+                names = [name for name in self.servers if re.fullmatch(body["name"], name)]
+                if not names:
+                    return 404, {"message": "server not found"}
+                for name in names:
+                    del self.servers[name]
+                return 200, [self.add_command() for _ in names]
+            elif (method, path) == ("POST", "/service/queue"):
+                commands = []
+                for command_id in body["IDs"]:
+                    self.commands[command_id] -= 1
+                    commands.append({"id": command_id, "status": "complete" if self.commands[command_id] <= 0 else "running"})
+                return 200, commands
+            elif (method, path) == ("GET", "/service/networks"):
+                return 200, self.networks.get(query["datacenter"], [])
+            elif (method, path) == ("GET", "/service/network/subnets"):
+                return 200, self.subnets.get(int(query["vlanId"]), [])
+            elif (method, path) == ("POST", "/service/network/subnet/delete"):
+                for subnets in self.subnets.values():
+                    subnets[:] = [s for s in subnets if s["subnetId"] != body["subnetId"]]
+                return 200, {}
+            elif (method, path) == ("POST", "/service/network/delete"):
+                for network in self.networks.get(body["datacenter"], []):
+                    network["ids"] = [id_ for id_ in network["ids"] if id_ != body["id"]]
+                return 200, {}
+            return 404, {"message": "not found"}
@@ -0,0 +1,105 @@
+import os
+import base64
+import hashlib
+import subprocess
+
+from kamatera_rke2_kubernetes_terraform_example_tests import bootstrap_timeline, workspace
+
+from .fake_bin import install_fake_bin, install_startup_script_fake_bins
+
+
+# serves urls from files under FAKE_CURL_ROOT/<host>/<path>
+FAKE_CURL = '''
+import os
+import sys
+args = sys.argv[1:]
+output, write_out, url = None, None, None
+while args:
+    arg = args.pop(0)
+    if arg == "-o":
+        output = args.pop(0)
+    elif arg == "-w":
+        write_out = args.pop(0)
+    elif arg in ("--connect-timeout", "--max-time"):
+        args.pop(0)
+    elif not arg.startswith("-"):
+        url = arg
+path = os.path.join(os.environ["FAKE_CURL_ROOT"], url.split("://", 1)[1])
+if not os.path.isfile(path):
+    sys.exit(22)
+with open(path, "rb") as f:
+    content = f.read()
+if write_out:
+    # the file of a redirect holds the effective url
+    sys.stdout.write(content.decode().strip())
+    content = b""
+if output:
+    with open(output, "wb") as f:
+        f.write(content)
+else:
+    sys.stdout.buffer.write(content)
+'''
+
+VERSION = "v1.35.1+rke2r1"
+CACHE_URL = "http://172.16.0.2:52080"
+
+
+def write_upstream(root):
+    (root / "checkip.amazonaws.com").parent.mkdir(parents=True, exist_ok=True)
+    (root / "checkip.amazonaws.com").write_text("1.2.3.4\n")
+    (root / "get.rke2.io").write_text("#!/bin/sh\necho install rke2\n")
+    (root / "update.rke2.io" / "v1-release" / "channels").mkdir(parents=True)
+    (root / "update.rke2.io" / "v1-release" / "channels" / "v1.35").write_text(f"https://github.com/rancher/rke2/releases/tag/{VERSION}")
+    release_path = root / "github.com" / "rancher" / "rke2" / "releases" / "download" / VERSION
+    release_path.mkdir(parents=True)
+    sha256sums = []
+    for artifact in ["rke2.linux-amd64.tar.gz", "rke2-images.linux-amd64.tar.zst", "rke2.linux-arm64.tar.gz"]:
+        content = f"{artifact} content".encode()
+        (release_path / artifact).write_bytes(content)
+        sha256sums.append(f"{hashlib.sha256(content).hexdigest()}  {artifact}\n")
+    (release_path / "sha256sum-amd64.txt").write_text("".join(sha256sums))
+
+
+def run_startup_script(tmp_path, *args, **env):
+    return subprocess.run(
+        ["bash", os.path.join(workspace.ROOT_TFDIR, "server_startup_script.sh"), *args],
+        cwd=tmp_path, env={**os.environ, "DRY_RUN": "true", "SSS_RETRIES": "1", "SSS_RETRY_TTL": "0", **env},
+        capture_output=True, text=True,
+    )
+
+
+def test_artifact_cache(tmp_path, monkeypatch):
+    install_fake_bin(tmp_path, monkeypatch, "curl", FAKE_CURL)
+    install_startup_script_fake_bins(tmp_path, monkeypatch)
+    root = tmp_path / "urls"
+    write_upstream(root)
+    monkeypatch.setenv("FAKE_CURL_ROOT", str(root))
+    p = run_startup_script(tmp_path, "artifact_cache", "172.16.", "52080", "v1.35", FAKE_HOSTNAME_IPS="1.2.3.4 172.16.0.2")
+    assert p.returncode == 0, p.stdout + p.stderr
+    cache_path = tmp_path / ".dry_run" / "var" / "lib" / "rke2-artifact-cache"
+    assert (cache_path / "resolved" / "v1.35").read_text() == f"{VERSION}\n"
+    assert sorted(os.listdir(cache_path / VERSION)) == ["rke2-images.linux-amd64.tar.zst", "rke2.linux-amd64.tar.gz", "sha256sum-amd64.txt"]
+    assert not (cache_path / ".partial").exists()
+    service = (tmp_path / ".dry_run" / "etc" / "systemd" / "system" / "rke2-artifact-cache.service").read_text()
+    assert "http.server 52080 --bind 172.16.0.2 --directory /var/lib/rke2-artifact-cache" in service
+    # the cache is served on the private ip
+    os.symlink(cache_path, root / "172.16.0.2:52080")
+    rke2_args = ["rke2", "172.16.", "52002", "agent", "v1.35", base64.b64encode(b"node-ip: $PRIVATE_IP\n").decode(), "yes"]
+    p = run_startup_script(tmp_path, *rke2_args, SSS_ARTIFACT_CACHE_URL=CACHE_URL, FAKE_HOSTNAME_IPS="172.16.0.10 1.2.3.5")
+    assert p.returncode == 0, p.stdout + p.stderr
+    assert f"Installing RKE2 {VERSION} from artifact cache {CACHE_URL}" in p.stdout
+    artifacts_path = tmp_path / ".dry_run" / "var" / "lib" / "rancher" / "rke2-artifacts"
+    assert (artifacts_path / "rke2.linux-amd64.tar.gz").read_text() == "rke2.linux-amd64.tar.gz content"
+    assert (tmp_path / "rke2_install.sh").read_text() == "#!/bin/sh\necho install rke2\n"
+    # a tampered cache fails the upstream checksum verification, and the node falls back to upstream
+    (cache_path / VERSION / "rke2.linux-amd64.tar.gz").write_text("tampered")
+    (cache_path / VERSION / "sha256sum-amd64.txt").write_text(f'{hashlib.sha256(b"tampered").hexdigest()}  rke2.linux-amd64.tar.gz\n')
+    p = run_startup_script(tmp_path, *rke2_args, SSS_ARTIFACT_CACHE_URL=CACHE_URL, FAKE_HOSTNAME_IPS="172.16.0.10 1.2.3.5")
+    assert p.returncode == 0, p.stdout + p.stderr
+    assert "ERROR! Checksum mismatch for rke2.linux-amd64.tar.gz" in p.stdout
+    assert "WARNING: RKE2 artifact cache is not available, installing from upstream" in p.stdout
+    assert not artifacts_path.exists()
+    records = bootstrap_timeline.parse_records((tmp_path / ".dry_run" / "root" / "server_startup_script.timing.jsonl").read_text())
+    assert [(r["role"], r["phase"], r["exit_code"]) for r in records if r["phase"] in ("artifact_cache_fill", "rke2_cache_download")] == [
+        ("artifact_cache", "artifact_cache_fill", 0), ("rke2", "rke2_cache_download", 0), ("rke2", "rke2_cache_download", 1),
+    ]
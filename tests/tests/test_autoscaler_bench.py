@@ -0,0 +1,75 @@
+import pytest
+
+from kamatera_rke2_kubernetes_terraform_example_tests import autoscaler_bench, k8s_api
+
+from .test_k8s_api import get_node, get_pod
+
+
+def test_cycle_phases():
+    cycle = autoscaler_bench.Cycle(1, {"a-autoscaler-1": True}, {"a-autoscaler-1": "on", "a-autoscaler-2": "off"})
+    baseline_node = get_node("a-autoscaler-1")
+    # observations before the scale-up trigger are ignored
+    cycle.observe_pods([get_pod("demo-1", "Pending")], now=99)
+    cycle.scale_up_time = 100
+    cycle.observe_pods([get_pod("demo-1", "Pending")], now=101)
+    cycle.observe_servers([{"name": "a-autoscaler-1", "power": "on"}, {"name": "a-autoscaler-2", "power": "on"}], now=110)
+    cycle.observe_nodes([baseline_node, get_node("a-autoscaler-2", ready=False)], now=150)
+    cycle.observe_nodes([baseline_node, get_node("a-autoscaler-2")], now=170)
+    cycle.observe_pods([get_pod("demo-1", "Running")], now=180)
+    assert cycle.is_scaled_up() and not cycle.is_scaled_down()
+    cycle.scale_down_time = 200
+    cordoned_node = get_node("a-autoscaler-2")
+    cordoned_node["spec"] = {"unschedulable": True}
+    cycle.observe_nodes([baseline_node, cordoned_node], now=500)
+    cycle.observe_servers([{"name": "a-autoscaler-1", "power": "on"}, {"name": "a-autoscaler-2", "power": "off"}], now=520)
+    cycle.observe_nodes([baseline_node], now=530)
+    assert cycle.phases == {
+        "pod_pending": 1, "server_created": 10, "node_registered": 50, "node_ready": 70,
+        "pod_running": 80, "all_pods_running": 80,
+        "node_cordoned": 300, "server_stopped": 320, "node_deleted": 330, "scaled_down": 330,
+    }
+    summary = autoscaler_bench.get_summary([cycle, autoscaler_bench.Cycle(1, {}, {}, phases={"node_ready": 90})])
+    assert summary["phases"]["node_ready"] == {"count": 2, "p50": 70, "p90": 90, "p95": 90, "p99": 90, "max": 90}
+    assert summary["phases"]["server_stopped"]["count"] == 1
+
+
+def test_cycle_phases_poweron():
+    # with CA_POWERON_ON_SCALE_UP the powered off baseline node registers again instead of a new node
+    stopped_node = get_node("a-autoscaler-2", ready=False)
+    stopped_node["status"]["conditions"][0]["status"] = "Unknown"
+    cycle = autoscaler_bench.Cycle(1, {"a-autoscaler-2": False}, {"a-autoscaler-2": "off"}, {"a-autoscaler-2"})
+    cycle.scale_up_time = 100
+    cycle.observe_nodes([stopped_node], now=101)
+    cycle.observe_servers([{"name": "a-autoscaler-2", "power": "on"}], now=110)
+    cycle.observe_nodes([get_node("a-autoscaler-2", ready=False)], now=140)
+    cycle.observe_nodes([get_node("a-autoscaler-2")], now=160)
+    assert cycle.phases == {"server_created": 10, "node_registered": 40, "node_ready": 60}
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.calls = []
+
+    def get(self, resource, name, namespace=None):
+        return {"spec": {"replicas": 0, "template": {"spec": {"containers": []}}}}
+
+    def scale(self, resource, name, replicas, namespace=None):
+        self.calls.append(("scale", name, replicas))
+
+    def delete(self, resource, name, namespace=None, ignore_not_found=False):
+        self.calls.append(("delete", resource, name))
+
+
+def test_main_restores_cluster(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(k8s_api, "get_client", lambda kubeconfig: client)
+    monkeypatch.setattr(autoscaler_bench.util, "get_kubeconfig", lambda: "kubeconfig")
+
+    def run_cycle(*args):
+        raise AssertionError("timeout")
+
+    monkeypatch.setattr(autoscaler_bench, "run_cycle", run_cycle)
+    with pytest.raises(AssertionError, match="timeout"):
+        autoscaler_bench.main("a", print_function=lambda *args: None)
+    assert client.calls == [("scale", "cluster-autoscaler", 1), ("delete", "namespaces", "demo"), ("scale", "cluster-autoscaler", 0)]
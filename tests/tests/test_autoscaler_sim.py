@@ -0,0 +1,72 @@
+from textwrap import dedent
+
+from kamatera_rke2_kubernetes_terraform_example_tests import autoscaler_sim, k8s_demo_app
+
+
+CLOUD_CONFIG = dedent('''
+    [global]
+    kamatera-api-client-id=xxx
+    default-network = "name=wan,ip=auto"
+    default-network = "name=private,ip=auto"
+
+    [nodegroup "small"]
+    name-prefix=test-small
+    min-size = 0
+    max-size = 4
+    cpu = 2B
+    ram = 2048
+    template-label = "role=autoscaler"
+
+    [nodegroup "large"]
+    name-prefix=test-large
+    min-size = 0
+    max-size = 2
+    cpu = 8B
+    ram = 16384
+    template-label = "role=large"
+''')
+
+
+def test_parse():
+    assert autoscaler_sim.parse_duration("1h2m30s") == 3750
+    assert autoscaler_sim.parse_memory("1Gi") == 1024 and autoscaler_sim.parse_cpu("250m") == 0.25
+    small, large = autoscaler_sim.parse_cloud_config(CLOUD_CONFIG)
+    assert (small.name, small.max_size, small.cpu, small.ram, small.labels) == ("small", 4, 2, 2048, {"role": "autoscaler"})
+    assert (large.name, large.cpu) == ("large", 8)
+    k8s_tfvars_config = k8s_demo_app.get_k8s_tfvars(None, 1)
+    [nodegroup] = autoscaler_sim.parse_nodegroup_configs(k8s_tfvars_config.ca_nodegroup_configs)
+    assert (nodegroup.min_size, nodegroup.max_size, nodegroup.labels["role"]) == (1, 3, "autoscaler")
+    flags = autoscaler_sim.parse_flags(k8s_tfvars_config.ca_extra_args)
+    assert flags["scale-down-unneeded-time"] == 300 and flags["scan-interval"] == 10
+
+
+def test_demo_app_simulation():
+    nodegroups, extra_args = autoscaler_sim.load_nodegroups()
+    simulator = autoscaler_sim.Simulator(nodegroups, autoscaler_sim.parse_flags(extra_args), provision_seconds=300, delete_seconds=60)
+    summary = simulator.run(autoscaler_sim.get_demo_trace(replicas=2, scale_down_after_seconds=1800), duration_seconds=3600)
+    # min-size node hosts the first pod, anti-affinity requires a second node for the other pod
+    assert summary["peak_nodes"] == 2
+    assert summary["pending_seconds"]["max"] == 300
+    # after scale down, one node is removed after scale-down-unneeded-time (5m) and the min-size node is kept
+    assert summary["final_nodes"] == 1
+    assert [t for t, message in simulator.events if message.startswith("scale down node")] == [2100]
+    assert summary["node_hours"] == round((3600 + 2160) / 3600, 3)
+
+
+def test_trace_with_failures_and_backoff():
+    nodegroups = autoscaler_sim.parse_cloud_config(CLOUD_CONFIG)
+    flags = autoscaler_sim.parse_flags(["--max-node-provision-time=10m", "--initial-node-group-backoff-duration=2m"])
+    trace = [
+        {"time": 0, "deployment": "web", "replicas": 6, "cpu": "900m", "memory": "512Mi", "node_selector": {"role": "autoscaler"}},
+        {"time": 60, "deployment": "batch", "replicas": 3, "cpu": "3", "memory": "4Gi", "node_selector": {"role": "large"}},
+        {"time": 3600, "deployment": "batch", "replicas": 0},
+    ]
+    simulator = autoscaler_sim.Simulator(nodegroups, flags, provision_seconds=200, provision_failure_rate=0.3, seed=1)
+    summary = simulator.run(trace, duration_seconds=7200)
+    assert summary["failed_provisions"] > 0
+    assert any("backed off" in message for _, message in simulator.events)
+    assert summary["unscheduled_pods"] == 0
+    # 6 web pods of 0.9 cpu on 2 cpu nodes, 3 batch pods of 3 cpu on 8 cpu nodes
+    assert summary["peak_nodes"] >= 5
+    assert summary["pending_seconds"]["max"] > 200
+    assert summary["node_hours_by_nodegroup"]["large"] < summary["node_hours_by_nodegroup"]["small"]
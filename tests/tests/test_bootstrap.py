@@ -0,0 +1,58 @@
+import json
+
+from kamatera_rke2_kubernetes_terraform_example_tests import bootstrap
+
+from .fake_bin import install_fake_bin
+
+
+# records the calls and simulates a control master, remote commands are echoed instead of being executed
+FAKE_SSH = '''
+import os
+import sys
+import json
+
+args = sys.argv[1:]
+with open(os.path.join(os.path.dirname(__file__), "calls.jsonl"), "a") as f:
+    f.write(json.dumps(args) + "\\n")
+destination_index = next(i for i, arg in enumerate(args) if arg.startswith("root@"))
+destination, command = args[destination_index], args[destination_index + 1:]
+if "-N" in args and destination == "root@10.0.0.3" and "-p" in args and args[args.index("-p") + 1] == "22":
+    # node which already moved ssh to the servers ssh port
+    sys.exit(255)
+if command:
+    if command[0].startswith("cat >"):
+        sys.stdin.read()
+    elif command[0].startswith("ssh-keyscan"):
+        print(f"{command[0].split()[-1]} ssh-ed25519 AAAA")
+    else:
+        print(f"running: {command[0]}")
+        print("done")
+'''
+
+
+def test_bootstrap(tmp_path, monkeypatch):
+    bin_path = install_fake_bin(tmp_path, monkeypatch, "ssh", FAKE_SSH)
+    (tmp_path / "server_startup_script.sh").write_text("echo hello")
+    (tmp_path / ".cluster_token").write_text("secret-token\n")
+    spec_path = tmp_path / "bootstrap.json"
+    spec_path.write_text(json.dumps({
+        "bastion": {"host": "1.2.3.4", "port": 52001},
+        "servers_ssh_port": 52002,
+        "startup_script_path": str(tmp_path / "server_startup_script.sh"),
+        "cluster_token_path": str(tmp_path / ".cluster_token"),
+        "known_hosts_dir": str(tmp_path),
+        "nodes": {f"worker{i}": {"ssh_ip": f"10.0.0.{i}", "rke2_args": "10.0.0 52002 agent v1.35 abc yes"} for i in range(1, 6)},
+    }))
+    output = []
+    results = bootstrap.main(str(spec_path), width=3, print_function=output.append)
+    assert sorted(results) == [f"worker{i}" for i in range(1, 6)]
+    calls = [json.loads(line) for line in (bin_path / "calls.jsonl").read_text().splitlines()]
+    masters = [call for call in calls if "-N" in call]
+    # one handshake with the bastion, node connections are forwarded over the bastion control connection
+    assert [call[-1] for call in masters if "ProxyCommand" not in " ".join(call)] == ["root@1.2.3.4"]
+    bastion_control_path = next(arg for arg in masters[0] if arg.startswith("ControlPath="))
+    assert all(bastion_control_path in " ".join(call) for call in masters[1:])
+    # worker3 is only reachable on the servers ssh port
+    assert [call[call.index("-p") + 1] for call in masters if call[-1] == "root@10.0.0.3"] == ["22", "52002"]
+    assert "[worker2] running: NODE_NAME=worker2 CLUSTER_TOKEN=secret-token bash /root/server_startup_script.sh rke2 10.0.0 52002 agent v1.35 abc yes" in output
+    assert (tmp_path / "ssh_known_hosts.worker4").read_text() == "10.0.0.4 ssh-ed25519 AAAA\n"
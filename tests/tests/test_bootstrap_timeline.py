@@ -0,0 +1,74 @@
+import os
+import json
+import base64
+import subprocess
+
+from kamatera_rke2_kubernetes_terraform_example_tests import bootstrap_timeline, workspace
+
+from .fake_bin import install_fake_bin, install_startup_script_fake_bins
+
+
+# first call fails to get the public ip, so that the first attempt fails
+FAKE_CURL = '''
+import os
+counter = os.path.join(os.path.dirname(__file__), "curl_calls")
+calls = int(open(counter).read()) if os.path.exists(counter) else 0
+open(counter, "w").write(str(calls + 1))
+if calls > 0:
+    print("1.2.3.4")
+'''
+
+
+def test_startup_script_timing(tmp_path, monkeypatch):
+    install_fake_bin(tmp_path, monkeypatch, "curl", FAKE_CURL)
+    install_startup_script_fake_bins(tmp_path, monkeypatch)
+    p = subprocess.run(
+        [
+            "bash", os.path.join(workspace.ROOT_TFDIR, "server_startup_script.sh"),
+            "rke2", "10.0.0", "52002", "agent", "v1.35", base64.b64encode(b"node-ip: $PRIVATE_IP\n").decode(), "yes"
+        ],
+        cwd=tmp_path, env={**os.environ, "DRY_RUN": "true", "SSS_RETRY_TTL": "0", "NODE_NAME": "worker1"},
+        capture_output=True, text=True,
+    )
+    assert p.returncode == 0, p.stdout + p.stderr
+    assert (tmp_path / ".dry_run" / "etc" / "rancher" / "rke2" / "config.yaml").read_text() == "node-ip: 10.0.0.5\n"
+    records = bootstrap_timeline.parse_records((tmp_path / ".dry_run" / "root" / "server_startup_script.timing.jsonl").read_text())
+    assert [(r["attempt"], r["phase"], r["exit_code"]) for r in records] == [
+        (1, "find_public_ip", 0), (1, "attempt", 1),
+        (2, "find_public_ip", 0), (2, "init_ssh", 0), (2, "node_settings", 0), (2, "attempt", 0),
+    ]
+    assert all(r["node"] == "worker1" and r["role"] == "rke2" and r["end"] >= r["start"] for r in records)
+
+
+def get_records(node, start, phases, attempt=1, role="rke2"):
+    records = []
+    for phase, seconds in phases:
+        records.append({"node": node, "role": role, "attempt": attempt, "phase": phase, "start": start, "end": start + seconds, "duration": seconds, "exit_code": 0})
+        start += seconds
+    records.append({"node": node, "role": role, "attempt": attempt, "phase": "attempt", "start": records[0]["start"], "end": start, "duration": start - records[0]["start"], "exit_code": 0})
+    return records
+
+
+def test_timeline(tmp_path):
+    records = [
+        *get_records("controlplane1", 1000, [("init_ssh", 2), ("node_settings", 5), ("rke2_install", 60), ("verify_rke2", 100)]),
+        # nested phase, not part of the critical path
+        {"node": "controlplane1", "role": "rke2", "attempt": 1, "phase": "calico_wait", "start": 1070, "end": 1160, "duration": 90, "exit_code": 0},
+        *get_records("worker1", 1010, [("init_ssh", 2), ("rke2_install", 50), ("verify_rke2", 40)]),
+        *get_records("worker2", 1010, [("init_ssh", 200)], attempt=1),
+        *get_records("worker2", 1220, [("init_ssh", 2), ("rke2_install", 50), ("verify_rke2", 30)], attempt=2),
+    ]
+    records_file = tmp_path / "records.jsonl"
+    records_file.write_text("\n".join(json.dumps(record) for record in records))
+    output = []
+    timeline = bootstrap_timeline.main(records_file=str(records_file), output=str(tmp_path / "timeline.json"), print_function=output.append)
+    assert timeline["duration_seconds"] == 302
+    assert timeline["nodes"]["worker2"]["attempts"] == 2
+    assert timeline["phases"]["rke2_install"] == {"count": 3, "p50": 50, "p95": 60, "max": 60}
+    # worker2 finished last, it started before controlplane1 was ready
+    assert [(name, phase) for name, phase, _ in timeline["critical_path"]] == [
+        ("controlplane1", "init_ssh"), ("controlplane1", "node_settings"), ("controlplane1", "rke2_install"), ("controlplane1", "verify_rke2"),
+        ("worker2", "init_ssh"), ("worker2", "rke2_install"), ("worker2", "verify_rke2"),
+    ]
+    assert any(line.startswith("  worker2") and line.endswith("(2 attempts)") for line in output)
+    assert json.load(open(tmp_path / "timeline.json"))["records"] == records
@@ -0,0 +1,114 @@
+import json
+import time
+import subprocess
+
+import pytest
+
+from kamatera_rke2_kubernetes_terraform_example_tests import cassette, util, destroy, terraform
+
+from .fake_bin import install_fake_bin
+
+
+# each fake counts its calls, so that the recorded results change between calls
+FAKE_COUNTER = '''
+import os
+path = os.path.join(os.environ["FAKE_STATE_DIR"], "{name}")
+calls = int(open(path).read()) + 1 if os.path.exists(path) else 1
+open(path, "w").write(str(calls))
+'''
+
+FAKE_KUBECTL = FAKE_COUNTER.format(name="kubectl") + '''
+import json
+print(json.dumps({"items": [{"metadata": {"name": f"node{i}"}} for i in range(calls)]}))
+'''
+
+FAKE_CLOUDCLI = FAKE_COUNTER.format(name="cloudcli") + '''
+import sys
+import json
+if "list" in sys.argv:
+    print(json.dumps([{"name": "test-controlplane1", "power": "on"}]))
+sys.exit(1 if "terminate" in sys.argv else 0)
+'''
+
+FAKE_TERRAFORM = FAKE_COUNTER.format(name="terraform") + '''
+import sys
+import json
+if calls == 1:
+    print(json.dumps({"type": "diagnostic", "diagnostic": {"severity": "error", "summary": "connection reset", "address": "kamatera_server.worker1"}}))
+    sys.exit(1)
+print(json.dumps({"type": "apply_complete", "hook": {"resource": {"addr": "kamatera_server.worker1"}, "elapsed_seconds": 90}}))
+'''
+
+
+def run_scenario(tmp_path, poll_seconds, retry_sleep_seconds):
+    util.wait_for(
+        "3 nodes", lambda: len(util.kubectl("get", "nodes", parse_json=True, timeout_seconds=None)["items"]) >= 3,
+        timeout_seconds=600, poll_seconds=poll_seconds, print_function=lambda *args: None
+    )
+    servers = destroy.cloudcli("server", "list", parse_json=True)
+    terminate = destroy.cloudcli("server", "terminate", "--name", "test-controlplane1", run=True)
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        destroy.cloudcli("server", "terminate", "--name", "test-controlplane1")
+    durations = terraform.apply_with_retries(
+        str(tmp_path / "01-rke2"), "apply", retry_sleep_seconds=retry_sleep_seconds, print_function=lambda *args: None
+    )
+    return servers, terminate.returncode, excinfo.value.returncode, durations
+
+
+def test_cassette(tmp_path, monkeypatch):
+    monkeypatch.setattr(destroy.config, "KAMATERA_NATIVE_API", False)
+    monkeypatch.setattr(destroy.config, "KAMATERA_API_CLIENT_ID", "id")
+    monkeypatch.setattr(destroy.config, "KAMATERA_API_SECRET", "secret")
+    monkeypatch.setattr(util.config, "K8S_NATIVE_CLIENT", False)
+    monkeypatch.setenv("FAKE_STATE_DIR", str(tmp_path))
+    (tmp_path / "01-rke2").mkdir()
+    monkeypatch.setattr(util.workspace, "get_tfdir", lambda: str(tmp_path))
+    original_path = util.os.environ["PATH"]
+    for name, script in [("kubectl", FAKE_KUBECTL), ("cloudcli", FAKE_CLOUDCLI), ("terraform", FAKE_TERRAFORM)]:
+        install_fake_bin(tmp_path, monkeypatch, name, script)
+    cassette_file = str(tmp_path / "cassette.jsonl")
+    cassette.start(cassette_file)
+    try:
+        recorded = run_scenario(tmp_path, poll_seconds=0.1, retry_sleep_seconds=0.1)
+    finally:
+        assert cassette.stop().num_calls == 9
+    calls = [json.loads(line) for line in open(cassette_file)]
+    assert [(call["kind"], call["args"][0]) for call in calls] == [
+        ("kubectl", "get"), ("kubectl", "get"), ("kubectl", "get"),
+        ("cloudcli", "server"), ("cloudcli", "server"), ("cloudcli", "server"), ("terraform", "apply"), ("terraform", "apply"), ("terraform", "apply"),
+    ]
+    assert calls[6]["options"] == {"stack": "01-rke2"} and calls[6]["process"]["returncode"] == 1
+    assert calls[7]["args"] == ["apply", "-auto-approve", "-json", "-target=kamatera_server.worker1"]
+    # replayed without the fake binaries, waits and retry sleeps only advance the clock
+    monkeypatch.setenv("PATH", original_path)
+    replay = cassette.start(cassette_file, replay=True)
+    start_time = time.time()
+    try:
+        assert run_scenario(tmp_path, poll_seconds=60, retry_sleep_seconds=300) == recorded
+        with pytest.raises(cassette.CassetteError, match="no recorded call left: cloudcli server list"):
+            destroy.cloudcli("server", "list", parse_json=True)
+    finally:
+        cassette.stop()
+    assert time.time() - start_time < 5
+    assert replay.clock.offset_seconds >= 2 * 60 + 300
+    assert util.time is time and terraform.time is time
+
+
+def test_replay_concurrent_waits(tmp_path):
+    (tmp_path / "empty.jsonl").write_text("")
+    replay = cassette.start(str(tmp_path / "empty.jsonl"), replay=True)
+
+    def get_wait(attempts):
+        calls = []
+        return util.Wait(f"{attempts} attempts", lambda **kwargs: util.wait_for(
+            f"{attempts} attempts", lambda: calls.append(1) or len(calls) >= attempts, poll_seconds=60, **kwargs
+        ))
+
+    try:
+        # kubernetes reads go through kubectl, so that they are served from the cassette
+        assert not util.is_k8s_native_client()
+        # with a shared clock the polls of both waits would add up to 600 seconds and the second wait would time out
+        util.wait_all([get_wait(5), get_wait(7)], timeout_seconds=400, print_function=lambda *args: None)
+        assert replay.clock.offset_seconds == 360
+    finally:
+        cassette.stop()
@@ -0,0 +1,55 @@
+import concurrent.futures
+
+from kamatera_rke2_kubernetes_terraform_example_tests import config, cluster_pool, destroy, k8s_demo_app
+
+
+def test_cluster_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WORKSPACES_DIR", str(tmp_path))
+    calls = []
+    failing_resets = set()
+
+    def provision_cluster(name_prefix, options, print_function=print):
+        calls.append(("provision", name_prefix))
+        return 3
+
+    def reset_cluster(name_prefix, expected_nodes, print_function=print):
+        calls.append(("reset", name_prefix))
+        assert expected_nodes == 3
+        assert name_prefix not in failing_resets, "reset failed"
+
+    monkeypatch.setattr(k8s_demo_app, "provision_cluster", provision_cluster)
+    monkeypatch.setattr(k8s_demo_app, "reset_cluster", reset_cluster)
+    monkeypatch.setattr(destroy, "main", lambda name_prefix, datacenter_id: calls.append(("destroy", name_prefix)))
+    options = k8s_demo_app.DemoAppOptions(datacenter_id="EU", high_availability=True)
+    other_options = k8s_demo_app.DemoAppOptions(datacenter_id="IL")
+
+    def maintain():
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            concurrent.futures.wait(cluster_pool.maintain([options, other_options], 2, executor))
+
+    maintain()
+    clusters = cluster_pool.print_status()
+    assert sorted(cluster["status"] for cluster in clusters.values()) == ["ready"] * 4
+    with cluster_pool.leased(options) as name_prefix:
+        assert clusters[name_prefix]["profile"]["datacenter_id"] == "EU"
+        assert cluster_pool.print_status()[name_prefix]["status"] == "leased"
+        with cluster_pool.leased(options) as second_name_prefix:
+            assert second_name_prefix != name_prefix
+    assert cluster_pool.print_status()[name_prefix]["status"] == "dirty"
+    # the daemon resets released clusters in the background, failed resets are destroyed and replaced
+    failing_resets.add(second_name_prefix)
+    maintain()
+    clusters = cluster_pool.print_status()
+    assert clusters[name_prefix]["status"] == "ready"
+    assert clusters[second_name_prefix]["status"] == "broken"
+    maintain()
+    clusters = cluster_pool.print_status()
+    assert second_name_prefix not in clusters
+    assert ("destroy", second_name_prefix) in calls
+    assert sorted(cluster["status"] for cluster in clusters.values()) == ["ready"] * 4
+    # without a ready cluster, a dirty cluster is reset by the lease itself
+    for name_prefix in list(clusters):
+        cluster_pool.set_status(name_prefix, "dirty")
+    name_prefix = cluster_pool.lease(other_options, timeout_seconds=1)
+    assert calls[-1] == ("reset", name_prefix)
+    assert cluster_pool.print_status()[name_prefix]["status"] == "leased"
@@ -0,0 +1,90 @@
+import os
+import json
+import threading
+
+import pytest
+from click.testing import CliRunner
+
+from kamatera_rke2_kubernetes_terraform_example_tests import daemon, util, cli
+
+from .fake_k8s_api import FakeK8sApi
+
+
+@pytest.fixture()
+def permissive_umask():
+    # the socket permissions don't depend on the umask
+    umask = os.umask(0)
+    yield
+    os.umask(umask)
+
+
+def test_daemon(tmp_path, monkeypatch, permissive_umask):
+    socket_path = str(tmp_path / "daemon.sock")
+    monkeypatch.setattr(daemon, "SOCKET_PATH", socket_path)
+    with FakeK8sApi() as fake:
+        kubeconfig = fake.write_kubeconfig(tmp_path / "kubeconfig")
+        fake.put("deployments", {"metadata": {"name": "nginx", "namespace": "default"}, "spec": {"replicas": 1}})
+        fetches = []
+
+        def get_kubeconfig(name_prefix=None, **kwargs):
+            if not name_prefix:
+                return kubeconfig
+            fetches.append(name_prefix)
+            path = tmp_path / f".kubeconfig-{name_prefix}-{len(fetches)}"
+            path.write_text("")
+            return str(path)
+
+        monkeypatch.setattr(util, "get_kubeconfig", get_kubeconfig)
+        local_kubectl_calls = []
+        monkeypatch.setattr(util, "kubectl", lambda *args: local_kubectl_calls.append(args))
+        runner = CliRunner()
+        # without the daemon commands run locally
+        assert daemon.request("ping") is daemon.NOT_RUNNING
+        assert runner.invoke(cli.main, ["get-kubeconfig", "--name-prefix", "test"]).output.strip().endswith(".kubeconfig-test-1")
+        server = daemon.create_server()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            assert oct(os.stat(socket_path).st_mode & 0o777) == "0o600"
+            with pytest.raises(daemon.DaemonError, match="already running"):
+                daemon.create_server()
+            # the kubeconfig is fetched once by the daemon and then reused while it exists
+            outputs = {runner.invoke(cli.main, ["get-kubeconfig", "--name-prefix", "test"]).output.strip() for _ in range(3)}
+            assert len(outputs) == 1 and fetches == ["test", "test"]
+            os.unlink(outputs.pop())
+            assert runner.invoke(cli.main, ["get-kubeconfig", "--name-prefix", "test"]).output.strip().endswith(".kubeconfig-test-3")
+            # kubectl commands supported by the native client run in the daemon, others run locally
+            result = runner.invoke(cli.main, ["kubectl", "--", "scale", "deployment", "nginx", "--replicas", "3", "-n", "default"])
+            assert result.output == "deployment/nginx scaled\n"
+            assert fake.objects[("deployments", "default", "nginx")]["spec"]["replicas"] == 3
+            assert local_kubectl_calls == []
+            # file names are relative to the client's working directory, stdin is sent with the command
+            (tmp_path / "client").mkdir()
+            (tmp_path / "client" / "ns.json").write_text('{"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "client"}}')
+            (tmp_path / "ns.json").write_text('{"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "daemon"}}')
+            monkeypatch.chdir(tmp_path)
+            response = daemon.request("kubectl", args=["apply", "-f", "ns.json"], cwd=str(tmp_path / "client"))
+            assert response["output"] == "namespace/client serverside-applied\n"
+            monkeypatch.chdir(tmp_path / "client")
+            result = runner.invoke(cli.main, ["kubectl", "--", "apply", "-f", "ns.json"])
+            assert result.output == "namespace/client serverside-applied\n"
+            result = runner.invoke(cli.main, ["kubectl", "--", "apply", "-f", "-"], input='{"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "stdin"}}')
+            assert result.output == "namespace/stdin serverside-applied\n"
+            assert {"client", "stdin"} <= {name for resource, _, name in fake.objects if resource == "namespaces"}
+            assert ("namespaces", None, "daemon") not in fake.objects
+            result = runner.invoke(cli.main, ["kubectl", "--", "get", "deployment", "nginx", "-n", "default", "-o", "json"])
+            assert json.loads(result.output)["spec"]["replicas"] == 3
+            runner.invoke(cli.main, ["kubectl", "--", "get", "pods"])
+            assert local_kubectl_calls == [("get", "pods")]
+            # commands which failed in the daemon are not run again locally
+            result = runner.invoke(cli.main, ["kubectl", "--", "scale", "deployment", "missing", "--replicas", "3"])
+            assert result.exit_code == 1 and "serve daemon failed: ApiError" in result.output
+            assert local_kubectl_calls == [("get", "pods")]
+            with pytest.raises(daemon.DaemonError, match="unknown command"):
+                daemon.request("unknown")
+            assert daemon.request("ping")["requests"] == 13
+        finally:
+            server.shutdown()
+            server.server_close()
+        # a socket left over from a killed daemon is replaced
+        assert os.path.exists(socket_path) and daemon.request("ping") is daemon.NOT_RUNNING
+        daemon.create_server().server_close()
@@ -0,0 +1,44 @@
+import time
+import threading
+import subprocess
+
+from kamatera_rke2_kubernetes_terraform_example_tests import destroy
+
+
+def test_teardown_pipeline(monkeypatch):
+    calls = []
+    lock = threading.Lock()
+    failures = {"subnet_delete": 1, "terminate": 5}
+
+    def cloudcli(*args, parse_json=False, run=False, **kwargs):
+        with lock:
+            calls.append(args)
+        if args[:2] == ("network", "subnet_list"):
+            return [{"subnetId": int(args[3]) * 10}]
+        if args[1] == "poweroff" and "slow" in args[3]:
+            time.sleep(0.5)
+        returncode = 0
+        if args[1] in failures and (args[1] != "terminate" or "broken" in args[3]):
+            with lock:
+                if failures[args[1]] > 0:
+                    failures[args[1]] -= 1
+                    returncode = 1
+        return subprocess.CompletedProcess(args, returncode)
+
+    monkeypatch.setattr(destroy, "cloudcli", cloudcli)
+    result = destroy.TeardownResult(retry_sleep_seconds=0)
+    errors = destroy.terminate_servers("p-", result, servers=[
+        {"name": "p-slow", "power": "on"},
+        {"name": "p-fast", "power": "on"},
+        {"name": "p-broken", "power": "off"},
+    ])
+    # fast server is terminated without waiting for the slow server poweroff
+    assert calls.index(("server", "terminate", "--name", "p-fast", "--force", "--wait")) < calls.index(("server", "terminate", "--name", "p-slow", "--force", "--wait"))
+    assert errors == ["Failed to terminate server: p-broken (exit code 1)"]
+    errors = destroy.terminate_networks("EU", "p-", result, networks=[
+        {"vlanId": 1, "ids": ["n1"], "names": ["p-private"]},
+        {"vlanId": 2, "ids": ["n2"], "names": ["p-private2"]},
+    ], retries=2)
+    assert len(errors) == 1
+    assert sorted(result.deleted) == ["network n1", "network n2", "server p-fast", "server p-slow", "subnet 10", "subnet 20"]
+    assert any(description.endswith("(attempt 2)") for description, _, _ in result.steps)
@@ -0,0 +1,130 @@
+import time
+import datetime
+import functools
+import threading
+import subprocess
+
+from kamatera_rke2_kubernetes_terraform_example_tests import config, garbage_collect, cluster_pool, workspace
+
+
+def get_name_prefix(date, suffix):
+    return f'kca{date:%m%d}{suffix}'
+
+
+def test_gc_skips_pool_and_active_workspaces(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WORKSPACES_DIR", str(tmp_path))
+    date = datetime.datetime.now() - datetime.timedelta(days=3)
+    pool_name_prefix, active_name_prefix, abandoned_name_prefix = [get_name_prefix(date, suffix) for suffix in ("0001", "0002", "0003")]
+    monkeypatch.setattr(garbage_collect.inventory, "list_servers", lambda prefix, ttl_seconds=None: [
+        {"name": f'{name_prefix}-controlplane1', "datacenter": "EU"}
+        for name_prefix in (pool_name_prefix, active_name_prefix, abandoned_name_prefix)
+    ])
+    monkeypatch.setattr(garbage_collect.inventory, "list_networks", lambda datacenter_id, prefix, ttl_seconds=None: [])
+    with cluster_pool.locked_state() as state:
+        state["clusters"][pool_name_prefix] = {"profile": {}, "status": "ready", "owner": None, "created_at": time.time(), "updated_at": time.time()}
+    workspace.create(abandoned_name_prefix)
+    with workspace.use(active_name_prefix):
+        assert workspace.is_in_use(active_name_prefix) and not workspace.is_in_use(abandoned_name_prefix)
+        assert garbage_collect.get_protected_name_prefixes() == {pool_name_prefix: "pool", active_name_prefix: "in use"}
+        assert list(garbage_collect.main("EU", dry_run=True)) == [abandoned_name_prefix]
+    assert list(garbage_collect.main("EU", dry_run=True)) == [active_name_prefix, abandoned_name_prefix]
+
+
+def test_get_name_prefix_date():
+    now = datetime.datetime(2026, 3, 15, 12)
+    assert garbage_collect.get_name_prefix_date(3, 15, now) == datetime.datetime(2026, 3, 15)
+    assert garbage_collect.get_name_prefix_date(1, 2, now) == datetime.datetime(2026, 1, 2)
+    # dates in the future are from the previous year
+    assert garbage_collect.get_name_prefix_date(3, 16, now) == datetime.datetime(2025, 3, 16)
+    assert garbage_collect.get_name_prefix_date(12, 31, datetime.datetime(2026, 1, 1, 0, 30)) == datetime.datetime(2025, 12, 31)
+    assert garbage_collect.get_name_prefix_date(2, 29, datetime.datetime(2028, 3, 1)) == datetime.datetime(2028, 2, 29)
+    # unparseable dates
+    for month, day in [(13, 1), (0, 10), (2, 30), (4, 31), (2, 29)]:
+        assert garbage_collect.get_name_prefix_date(month, day, now) is None
+
+
+def test_is_stale():
+    now = datetime.datetime(2026, 1, 2, 6)
+    cluster_date = garbage_collect.get_name_prefix_date(12, 31, now)
+    # the age is counted from the end of the day, across the year rollover
+    assert not garbage_collect.is_stale({"date": cluster_date}, 31, now)
+    assert garbage_collect.is_stale({"date": cluster_date}, 30, now)
+    assert garbage_collect.is_stale({"date": cluster_date}, 31, now + datetime.timedelta(hours=1))
+    assert not garbage_collect.is_stale({"date": datetime.datetime(2026, 1, 2)}, 0, now)
+    assert not garbage_collect.is_stale({"date": None}, 0, now)
+
+
+def test_find_clusters(monkeypatch):
+    now = datetime.datetime(2026, 1, 2, 6)
+    monkeypatch.setattr(garbage_collect.inventory, "list_servers", lambda prefix, ttl_seconds=None: [
+        {"name": name, "datacenter": datacenter}
+        for name, datacenter in [
+            ("kca1231abcd-controlplane1", "EU"),
+            ("kca1231abcd-worker1", "EU"),
+            ("kca0102beef-controlplane1", None),
+            ("kca0230cafe-controlplane1", "EU"),
+            ("kca0105dead-controlplane1", "US-NY2"),
+            # malformed name prefixes
+            ("kca1231abc-controlplane1", "EU"),
+            ("kca1231ABCD-controlplane1", "EU"),
+            ("kca12x1abcd-controlplane1", "EU"),
+            ("kca1231abcdcontrolplane1", "EU"),
+            ("kca1231abcd", "EU"),
+            ("kcb1231abcd-controlplane1", "EU"),
+        ]
+    ])
+    monkeypatch.setattr(garbage_collect.inventory, "list_networks", lambda datacenter_id, prefix, ttl_seconds=None: [
+        {"names": ["lan-1-kca1231abcd-private"], "id": 1},
+        {"names": ["other", "lan-2-kca0101f00d-private"], "id": 2},
+        {"names": ["lan-3-kca1231zzzz-private"], "id": 3},
+    ])
+    clusters = garbage_collect.find_clusters(["EU"], now=now)
+    assert sorted(clusters) == ["kca0101f00d", "kca0102beef", "kca0230cafe", "kca1231abcd"]
+    assert clusters["kca1231abcd"]["date"] == datetime.datetime(2025, 12, 31)
+    assert [server["name"] for server in clusters["kca1231abcd"]["servers"]] == ["kca1231abcd-controlplane1", "kca1231abcd-worker1"]
+    assert [network["id"] for network in clusters["kca1231abcd"]["networks"]["EU"]] == [1]
+    assert clusters["kca0101f00d"] == {"date": datetime.datetime(2026, 1, 1), "servers": [], "networks": {"EU": [{"names": ["other", "lan-2-kca0101f00d-private"], "id": 2}]}}
+    assert clusters["kca0102beef"]["date"] == datetime.datetime(2026, 1, 2)
+    # an invalid date is kept, but never considered stale
+    assert clusters["kca0230cafe"]["date"] is None and not garbage_collect.is_stale(clusters["kca0230cafe"], 0, now)
+
+
+def test_gc_teardown_bounded_concurrency(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WORKSPACES_DIR", str(tmp_path))
+    date = datetime.datetime.now() - datetime.timedelta(days=3)
+    name_prefixes = [get_name_prefix(date, f"000{i}") for i in range(4)]
+    monkeypatch.setattr(garbage_collect.inventory, "list_servers", lambda prefix, ttl_seconds=None: [
+        {"name": f'{name_prefix}-worker{i}', "datacenter": "EU", "power": "on"} for name_prefix in name_prefixes for i in range(5)
+    ])
+    monkeypatch.setattr(garbage_collect.inventory, "list_networks", lambda datacenter_id, prefix, ttl_seconds=None: [
+        {"names": [f"lan-{i}-{name_prefix}-private"], "vlanId": i, "ids": [f"n{i}"]} for i, name_prefix in enumerate(name_prefixes)
+    ])
+    monkeypatch.setattr(garbage_collect.destroy, "TeardownResult", functools.partial(garbage_collect.destroy.TeardownResult, retry_sleep_seconds=0))
+    lock = threading.Lock()
+    state = {"running": 0, "max_running": 0, "terminated": set()}
+    calls = []
+
+    def cloudcli(*args, parse_json=False, run=False, **kwargs):
+        with lock:
+            calls.append(args)
+            state["running"] += 1
+            state["max_running"] = max(state["max_running"], state["running"])
+        time.sleep(0.01)
+        with lock:
+            state["running"] -= 1
+            if args[:2] == ("network", "delete"):
+                # networks are deleted after all the servers were terminated
+                assert len(state["terminated"]) == 20
+            elif args[:2] == ("server", "terminate"):
+                # the first terminate attempt of each server fails
+                if calls.count(args) == 1:
+                    return subprocess.CompletedProcess(args, 1)
+                state["terminated"].add(args[3])
+        if parse_json:
+            return []
+        return subprocess.CompletedProcess(args, 0)
+
+    monkeypatch.setattr(garbage_collect.destroy, "cloudcli", cloudcli)
+    assert sorted(garbage_collect.main("EU", max_workers=3)) == name_prefixes
+    assert state["max_running"] == 3 and len(state["terminated"]) == 20
+    assert len([args for args in calls if args[:2] == ("network", "delete")]) == 4
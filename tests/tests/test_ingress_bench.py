@@ -0,0 +1,53 @@
+import threading
+import itertools
+import http.server
+
+import pytest
+
+from kamatera_rke2_kubernetes_terraform_example_tests import ingress_bench, util
+
+
+class DemoHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    pods = None
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            body = f'{next(self.pods)}\n'.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def demo_server():
+    DemoHandler.pods = itertools.cycle(["demo-a", "demo-b"])
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), DemoHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_run_summary(demo_server):
+    port = demo_server.server_address[1]
+    summary = ingress_bench.run(["127.0.0.1"], concurrency=4, duration_seconds=0.5, port=port).get_summary()
+    assert summary["requests"] > 0 and summary["errors"] == {}
+    assert set(summary["pods"]) == {"demo-a", "demo-b"}
+    assert summary["latency_ms"]["p50"] <= summary["latency_ms"]["p95"] <= summary["latency_ms"]["p99"]
+    assert util.percentile([1, 2, 3, 4], 50) == 2
+
+
+def test_curl_unique_demo_pods(demo_server):
+    port = demo_server.server_address[1]
+    assert util.curl_unique_demo_pods(["127.0.0.1"], ["demo-a", "demo-b"], port=port, timeout_seconds=5) == {
+        "127.0.0.1": {"demo-a", "demo-b"}
+    }
+    with pytest.raises(AssertionError, match="unexpected pod name"):
+        util.curl_unique_demo_pods(["127.0.0.1"], ["demo-a", "demo-c"], port=port, timeout_seconds=0.5)
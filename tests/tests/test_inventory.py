@@ -0,0 +1,124 @@
+import subprocess
+
+import pytest
+
+from kamatera_rke2_kubernetes_terraform_example_tests import inventory, destroy
+
+
+def get_fake_cloudcli(servers, networks, calls):
+
+    def cloudcli(*args, parse_json=False, run=False, **kwargs):
+        calls.append(args[:2])
+        if args[:2] == ("server", "list"):
+            return [{"name": name, "power": "on", "datacenter": "EU"} for name in servers]
+        elif args[:2] == ("server", "info"):
+            name_prefix = args[3][:-2].replace("\\", "")
+            return [
+                {"name": name, "networks": [{"network": "wan-eu", "ips": [ip]}, *([{"network": "lan-123-private", "ips": ["172.16.0.1"]}] if name.startswith("a") else [])]}
+                for name, ip in servers.items() if name.startswith(name_prefix)
+            ]
+        elif args[:2] == ("network", "list"):
+            return [network for network in networks if network["datacenter"] == args[3]]
+        elif args[:2] == ("server", "terminate"):
+            servers.pop(args[3])
+        return subprocess.CompletedProcess(args, 0)
+
+    return cloudcli
+
+
+@pytest.fixture()
+def fake_cloud(monkeypatch):
+    servers = {"a1-controlplane1": "1.1.1.1", "a1-worker1": "1.1.1.2", "a10-controlplane1": "1.1.1.3", "b1-controlplane1": "2.2.2.1"}
+    networks = [
+        {"datacenter": "EU", "names": ["lan-1-a1-private"], "vlanId": 1, "ids": ["n1"]},
+        {"datacenter": "EU", "names": ["lan-2-b1-private"], "vlanId": 2, "ids": ["n2"]},
+        {"datacenter": "US-NY2", "names": ["lan-3-a1-private"], "vlanId": 3, "ids": ["n3"]},
+    ]
+    calls = []
+    monkeypatch.setattr(destroy, "cloudcli", get_fake_cloudcli(servers, networks, calls))
+    monkeypatch.setattr(inventory.config, "INVENTORY_TTL_SECONDS", 60)
+    inventory.invalidate()
+    yield servers, networks, calls
+    inventory.invalidate()
+
+
+def test_cache_hits(fake_cloud):
+    servers, networks, calls = fake_cloud
+    assert [server["name"] for server in inventory.list_servers("a1-")] == ["a1-controlplane1", "a1-worker1"]
+    assert [server["name"] for server in inventory.list_servers("b1-")] == ["b1-controlplane1"]
+    assert len(inventory.list_servers()) == 4
+    assert calls == [("server", "list")]
+    # a fetch of a prefix serves lookups of longer prefixes and exact names
+    assert sorted(inventory.get_servers("a1")) == ["a1-controlplane1", "a1-worker1", "a10-controlplane1"]
+    assert inventory.get_server_ip("a1-worker1", "wan", name_prefix="a1-") == "1.1.1.2"
+    assert inventory.get_server_ip("a10-controlplane1", "lan") == "172.16.0.1"
+    assert inventory.get_server_ips("a1-controlplane1", "other", name_prefix="a1") == []
+    assert calls == [("server", "list"), ("server", "info")]
+    # but not lookups of shorter or different prefixes
+    inventory.get_servers("b1-")
+    assert calls[-1] == ("server", "info") and len(calls) == 3
+    assert [network["ids"] for network in inventory.list_networks("EU", "a1-")] == [["n1"]]
+    assert len(inventory.list_networks("EU")) == 2
+    assert calls[-1] == ("network", "list") and len(calls) == 4
+    # ttl_seconds=0 forces a fetch
+    inventory.list_servers("a1-", ttl_seconds=0)
+    assert len(calls) == 5
+
+
+def test_prefix_filtering(fake_cloud):
+    assert [server["name"] for server in inventory.list_servers("a1-")] == ["a1-controlplane1", "a1-worker1"]
+    assert sorted(inventory.get_servers("a1-")) == ["a1-controlplane1", "a1-worker1"]
+    assert list(inventory.get_servers("a10-")) == ["a10-controlplane1"]
+    with pytest.raises(AssertionError, match="server not found: a1-worker2"):
+        inventory.get_server("a1-worker2", name_prefix="a1-")
+    with pytest.raises(AssertionError, match="no lan ip for server b1-controlplane1"):
+        inventory.get_server_ip("b1-controlplane1", "lan")
+    assert [network["ids"] for network in inventory.list_networks("US-NY2", "a1-")] == [["n3"]]
+    assert inventory.list_networks("US-NY2", "b1-") == []
+
+
+def test_invalidate_after_create_and_terminate(fake_cloud):
+    servers, networks, calls = fake_cloud
+    assert len(inventory.get_servers("a1-")) == 2 and len(inventory.list_servers("a1-")) == 2
+    inventory.get_servers("b1-")
+    inventory.list_networks("EU")
+    servers["a1-worker2"] = "1.1.1.4"
+    assert len(inventory.list_servers("a1-")) == 2 and "a1-worker2" not in inventory.get_servers("a1-")
+    inventory.invalidate("a1-")
+    assert len(inventory.list_servers("a1-")) == 3
+    assert inventory.get_server_ip("a1-worker2", "wan", name_prefix="a1-") == "1.1.1.4"
+    calls.clear()
+    # servers and networks of other prefixes are still cached
+    inventory.get_servers("b1-")
+    inventory.list_networks("EU")
+    assert calls == []
+    destroy.terminate_servers("a1-", servers=[{"name": "a1-worker2"}])
+    assert calls == [("server", "terminate")]
+    assert "a1-worker2" not in inventory.get_servers("a1-") and len(inventory.list_servers("a1-")) == 2
+    inventory.get_servers("b1-")
+    assert calls == [("server", "terminate"), ("server", "info"), ("server", "list")]
+    # networks are invalidated per datacenter
+    inventory.list_networks("US-NY2")
+    networks.pop(0)
+    inventory.invalidate("a1-", "EU")
+    assert len(inventory.list_networks("EU")) == 1
+    inventory.list_networks("US-NY2")
+    assert calls.count(("network", "list")) == 2
+    inventory.invalidate()
+    inventory.list_networks("US-NY2")
+    assert calls.count(("network", "list")) == 3
+
+
+def test_server_ips_from_refetched_entry(fake_cloud):
+    servers, networks, calls = fake_cloud
+    assert inventory.get_server_ip("a1-worker1", "wan", name_prefix="a1-") == "1.1.1.2"
+    servers["a1-worker1"] = "1.1.1.5"
+    # ttl_seconds=0 returns the ips of the new fetch, not of the older cached fetch of the shorter prefix
+    assert inventory.get_server_ip("a1-worker1", "wan", ttl_seconds=0) == "1.1.1.5"
+    assert inventory.get_server_ip("a1-worker1", "wan", name_prefix="a1-", ttl_seconds=0) == "1.1.1.5"
+    assert calls.count(("server", "info")) == 3
+    # expired fetches are dropped
+    for entry in inventory._servers_info.values():
+        entry["time"] -= 120
+    inventory.get_servers("b1-")
+    assert list(inventory._servers_info) == ["b1-"]
@@ -0,0 +1,186 @@
+import json
+import time
+import threading
+
+import pytest
+
+from click.testing import CliRunner
+
+from kamatera_rke2_kubernetes_terraform_example_tests import k8s_api, util, cli, daemon
+
+from .fake_k8s_api import FakeK8sApi
+from .fake_bin import install_fake_bin
+
+
+FAKE_KUBECTL = '''
+import os
+import sys
+import json
+with open(os.environ["FAKE_KUBECTL_CALLS"], "a") as f:
+    f.write(json.dumps([sys.argv[1:], sys.stdin.read() if "-" in sys.argv or "--filename=-" in sys.argv else None]) + "\\n")
+if "json" in sys.argv:
+    print(json.dumps({"items": []}))
+'''
+
+
+def get_node(name, ready=True, labels=None):
+    return {
+        "kind": "Node",
+        "metadata": {"name": name, "labels": labels or {}},
+        "status": {"conditions": [{"type": "Ready", "status": "True" if ready else "False"}]},
+    }
+
+
+def get_pod(name, phase, namespace="demo"):
+    return {"kind": "Pod", "metadata": {"name": name, "namespace": namespace}, "status": {"phase": phase}}
+
+
+def test_client_reuses_connection(tmp_path):
+    with FakeK8sApi() as fake:
+        fake.put("nodes", get_node("controlplane1"))
+        client = k8s_api.Client(fake.write_kubeconfig(tmp_path / "kubeconfig"))
+        start_time = time.time()
+        for _ in range(100):
+            assert [n["metadata"]["name"] for n in client.list("nodes")["items"]] == ["controlplane1"]
+        print(f'per call latency: {(time.time() - start_time) * 10:.3f}ms')
+        client.apply({"apiVersion": "apps/v1", "kind": "Deployment", "metadata": {"name": "demo", "namespace": "demo"}, "spec": {"replicas": 2}})
+        client.scale("deploy", "demo", 0, "demo")
+        assert client.get("deployments", "demo", "demo")["spec"]["replicas"] == 0
+        client.delete("deployment", "demo", "demo")
+        assert not client.exists("deployment", "demo", "demo")
+        assert client.delete("deployment", "demo", "demo", ignore_not_found=True) is None
+        assert fake.connections == 1
+
+
+def test_kubectl_wrapper(tmp_path, monkeypatch):
+    with FakeK8sApi() as fake:
+        kubeconfig = fake.write_kubeconfig(tmp_path / "kubeconfig")
+        monkeypatch.setattr(util, "get_kubeconfig", lambda: kubeconfig)
+        fake.put("nodes", get_node("controlplane1"))
+        fake.put("nodes", get_node("worker1", ready=False, labels={"role": "autoscaler"}))
+        fake.put("pods", get_pod("demo-1", "Running"))
+        fake.put("pods", get_pod("demo-2", "Pending"))
+        assert util.kubectl_node_count() == (2, 1)
+        assert util.kubectl_node_count("role=autoscaler") == (1, 0)
+        assert util.kubectl_pods_count("demo") == (2, 1)
+        util.kubectl("apply", "-f", "-", input='{"kind": "Namespace", "metadata": {"name": "test"}}')
+        assert util.kubectl("get", "namespace", "test", parse_json=True)["metadata"]["name"] == "test"
+        util.kubectl("delete", "namespace", "test", "--ignore-not-found", "--wait")
+        assert util.kubectl("get", "namespaces", parse_json=True)["items"] == []
+        assert util.kubectl_native("logs", "-n", "kube-system", "deployment/cluster-autoscaler") is NotImplemented
+
+
+def test_kubectl_fallback(tmp_path, monkeypatch):
+    install_fake_bin(tmp_path, monkeypatch, "kubectl", FAKE_KUBECTL)
+    monkeypatch.setenv("FAKE_KUBECTL_CALLS", str(tmp_path / "calls.jsonl"))
+    with FakeK8sApi() as fake:
+        kubeconfig = fake.write_kubeconfig(tmp_path / "kubeconfig")
+        monkeypatch.setattr(util, "get_kubeconfig", lambda: kubeconfig)
+        configmap = '{"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": "foo"}}'
+        # resources and kinds which the native client doesn't support are handled by the kubectl binary, without retries
+        start_time = time.time()
+        util.kubectl("delete", "configmap", "foo")
+        util.kubectl("scale", "statefulset", "x", "--replicas=1")
+        util.kubectl("scale", "deployment/x", "--replicas=1")
+        assert util.kubectl("get", "configmaps", parse_json=True) == {"items": []}
+        assert util.kubectl("apply", "-f", "-", run=True, input=configmap).returncode == 0
+        assert util.kubectl("apply", "-f", "-", run=True, input='{"kind": "Namespace", "metadata": {"name": "test"}}\n---\n' + configmap).returncode == 0
+        assert time.time() - start_time < 5
+        calls = [json.loads(line) for line in open(tmp_path / "calls.jsonl")]
+        assert [args for args, _ in calls] == [
+            ["delete", "configmap", "foo"], ["scale", "statefulset", "x", "--replicas=1"], ["scale", "deployment/x", "--replicas=1"],
+            ["get", "configmaps", "-o", "json"], ["apply", "-f", "-"], ["apply", "-f", "-"],
+        ]
+        assert calls[4][1] == configmap
+        # none of the objects of a partially supported apply are applied natively
+        assert ("namespaces", None, "test") not in fake.objects
+        assert fake.requests == []
+
+
+def test_cli_kubectl_apply_stdin(tmp_path, monkeypatch):
+    install_fake_bin(tmp_path, monkeypatch, "kubectl", FAKE_KUBECTL)
+    monkeypatch.setenv("FAKE_KUBECTL_CALLS", str(tmp_path / "calls.jsonl"))
+    monkeypatch.setattr(daemon, "SOCKET_PATH", str(tmp_path / "daemon.sock"))
+    namespace = '{"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "test"}}'
+    configmap = '{"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": "foo"}}'
+    with FakeK8sApi() as fake:
+        kubeconfig = fake.write_kubeconfig(tmp_path / "kubeconfig")
+        monkeypatch.setattr(util, "get_kubeconfig", lambda: kubeconfig)
+        # without input the kubectl binary reads stdin
+        assert util.kubectl_native("apply", "-f", "-") is NotImplemented
+        start_time = time.time()
+        result = CliRunner().invoke(cli.main, ["kubectl", "--", "apply", "-f", "-"], input=namespace)
+        assert result.exit_code == 0 and "namespace/test serverside-applied\n" in result.output
+        assert ("namespaces", None, "test") in fake.objects
+        result = CliRunner().invoke(cli.main, ["kubectl", "--", "apply", "--filename=-"], input=configmap)
+        assert result.exit_code == 0, result.output
+        assert time.time() - start_time < 5
+        assert [json.loads(line) for line in open(tmp_path / "calls.jsonl")] == [[["apply", "--filename=-"], configmap]]
+
+
+def test_wait_for_k8s_watch(tmp_path, monkeypatch):
+    with FakeK8sApi() as fake:
+        kubeconfig = fake.write_kubeconfig(tmp_path / "kubeconfig")
+        monkeypatch.setattr(util, "get_kubeconfig", lambda: kubeconfig)
+        fake.put("nodes", get_node("controlplane1"))
+        fake.put("nodes", get_node("worker1", ready=False))
+
+        def update_nodes():
+            time.sleep(0.5)
+            fake.put("nodes", get_node("worker1"))
+
+        threading.Thread(target=update_nodes).start()
+        start_time = time.time()
+        util.wait_for_node_count(2, 2, timeout_seconds=10, progress=None)
+        assert time.time() - start_time < 2
+
+
+def test_watch_objects_relist(tmp_path):
+    with FakeK8sApi() as fake:
+        fake.put("nodes", get_node("worker1", ready=False))
+        client = k8s_api.Client(fake.write_kubeconfig(tmp_path / "kubeconfig"))
+        events = k8s_api.watch_objects(client, "nodes", timeout_seconds=1)
+        event_type, _, objects = next(events)
+        assert event_type == "SYNC" and util.count_nodes(objects.values()) == (1, 0)
+        fake.put("nodes", get_node("worker1"))
+        fake.compact()
+        # watch from the listed resourceVersion fails with 410 Gone, so the objects are relisted
+        event_type, _, objects = next(events)
+        assert event_type == "SYNC" and util.count_nodes(objects.values()) == (1, 1)
+        fake.put("nodes", get_node("worker2"))
+        event_type, obj, objects = next(events)
+        assert event_type == "ADDED" and obj["metadata"]["name"] == "worker2" and len(objects) == 2
+
+
+def test_wait_for_stability(tmp_path, monkeypatch):
+    with FakeK8sApi() as fake:
+        kubeconfig = fake.write_kubeconfig(tmp_path / "kubeconfig")
+        monkeypatch.setattr(util, "get_kubeconfig", lambda: kubeconfig)
+        fake.put("nodes", get_node("worker1"))
+        fake.put("pods", get_pod("demo-1", "Running"))
+
+        def flap():
+            time.sleep(0.3)
+            fake.put("nodes", get_node("worker1", ready=False))
+            time.sleep(0.3)
+            fake.put("nodes", get_node("worker1"))
+
+        threading.Thread(target=flap).start()
+        start_time = time.time()
+        transitions = util.wait_for_stability(
+            "test", {"node": ("nodes", None, util.get_node_state), "pod": ("pods", "demo", util.get_pod_state)},
+            lambda objects: util.count_nodes(objects["node"]) == (1, 1) and util.count_pods(objects["pod"]) == (1, 1),
+            quiet_seconds=1, timeout_seconds=10,
+        )
+        assert time.time() - start_time >= 1.6
+        assert [(name, key, new_state) for _, name, key, _, new_state in transitions] == [
+            ("node", "worker1", "ready=False unschedulable=False"),
+            ("node", "worker1", "ready=True unschedulable=False"),
+        ]
+        fake.put("pods", get_pod("demo-2", "Pending"))
+        with pytest.raises(AssertionError, match="unstable"):
+            util.wait_for_stability(
+                "test", {"pod": ("pods", "demo", util.get_pod_state)},
+                lambda objects: util.count_pods(objects["pod"]) == (1, 1),
+                quiet_seconds=1, timeout_seconds=0.5,
+            )
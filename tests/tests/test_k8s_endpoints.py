@@ -0,0 +1,109 @@
+import json
+import socket
+
+from kamatera_rke2_kubernetes_terraform_example_tests import k8s_api, util
+
+from .fake_k8s_api import FakeK8sApi
+
+
+RKE2_KUBECONFIG = '''
+apiVersion: v1
+clusters:
+- cluster:
+    server: http://127.0.0.1:{port}
+  name: default
+contexts:
+- context:
+    cluster: default
+    user: default
+  name: default
+current-context: default
+kind: Config
+users:
+- name: default
+  user:
+    token: fake
+'''
+
+
+def get_closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def write_kubeconfig(path, ports):
+    with open(path, "w") as f:
+        json.dump({
+            "clusters": [
+                {"name": "default" if i == 0 else f"default@controlplane{i + 1}", "cluster": {"server": f"http://127.0.0.1:{port}"}}
+                for i, port in enumerate(ports)
+            ],
+            "contexts": [{"name": "default", "context": {"cluster": "default", "user": "default"}}],
+            "current-context": "default",
+            "users": [{"name": "default", "user": {"token": "fake"}}],
+        }, f)
+    return str(path)
+
+
+def test_endpoint_selection(tmp_path, monkeypatch):
+    dead_port = get_closed_port()
+    with FakeK8sApi() as fake1, FakeK8sApi() as fake2:
+        for fake in (fake1, fake2):
+            fake.put("namespaces", {"metadata": {"name": "default"}})
+        client = k8s_api.Client(write_kubeconfig(tmp_path / "kubeconfig", [fake1.port, fake2.port, dead_port]))
+        assert [server.port for server in client.servers] == [fake1.port, fake2.port, dead_port]
+        # controlplane1 is not ready, requests go to the only ready server
+        fake2.proxied["/readyz"] = "ok"
+        assert client.get("namespaces", "default")["metadata"]["name"] == "default"
+        assert client.server.port == fake2.port
+        assert client.server_latencies[f"127.0.0.1:{fake1.port}"] is None and client.server_latencies[f"127.0.0.1:{dead_port}"] is None
+        assert [path for _, path, _ in fake2.requests] == ["/readyz", "/api/v1/namespaces/default"]
+        # fails over mid-run when the selected server goes down
+        fake1.proxied["/readyz"] = "ok"
+        fake2.server.shutdown()
+        fake2.server.server_close()
+        client.close()
+        assert client.get("namespaces", "default")["metadata"]["name"] == "default"
+        assert client.server.port == fake1.port
+        # the fastest ready server is preferred
+        monkeypatch.setattr(client, "probe", lambda server: {fake1.port: 0.2, fake2.port: 0.05, dead_port: 0.01}[server.port])
+        assert client.select_server().port == dead_port
+        assert client.select_server(client.server).port == fake2.port
+
+
+def test_ha_kubeconfig(tmp_path, monkeypatch):
+    tfdir = tmp_path / "tfdir"
+    (tfdir / "02-k8s").mkdir(parents=True)
+    (tfdir / "02-k8s" / "taints.auto.tfvars.json").write_text(json.dumps({"controlplane_node_names": ["controlplane1", "controlplane2", "controlplane3"]}))
+    monkeypatch.setattr(util.workspace, "get_tfdir", lambda: str(tfdir))
+    inventory_servers = {"test-controlplane1": {}, "test-controlplane2": {}, "test-worker1": {}}
+    monkeypatch.setattr(util.inventory, "get_servers", lambda name_prefix: inventory_servers)
+    monkeypatch.setattr(util.inventory, "get_server_ip", lambda *args, **kwargs: "127.0.0.1")
+    monkeypatch.setattr(util, "get_ssh_config", lambda *args: "ssh_config")
+    with FakeK8sApi() as fake:
+        fetches = []
+
+        class SSHPool:
+
+            def fetch(self, host, remote_path):
+                fetches.append((host, remote_path))
+                return RKE2_KUBECONFIG.format(port=fake.port).encode()
+
+        monkeypatch.setattr(util, "get_ssh_pool", lambda ssh_config: SSHPool())
+        kubeconfig = util.get_kubeconfig("test")
+        assert fetches == [("test-controlplane1", "/etc/rancher/rke2/rke2.yaml")]
+        data = k8s_api.yaml.load(open(kubeconfig))
+        assert [(cluster["name"], cluster["cluster"]["server"]) for cluster in data["clusters"]] == [
+            ("default", f"http://127.0.0.1:{fake.port}"), ("default@controlplane2", f"http://127.0.0.1:{fake.port}"),
+        ]
+        assert [context["name"] for context in data["contexts"]] == ["default", "default@controlplane2"]
+        assert data["current-context"] == "default" and data["users"][0]["user"]["token"] == "fake"
+        # reused while the servers didn't change and are verified by the CA
+        assert util.get_kubeconfig("test") == kubeconfig and len(fetches) == 1
+        inventory_servers["test-controlplane3"] = {}
+        util.get_kubeconfig("test")
+        assert len(fetches) == 2 and len(k8s_api.yaml.load(open(kubeconfig))["clusters"]) == 3
+    # servers are not reachable, it might be a new cluster
+    util.get_kubeconfig("test")
+    assert len(fetches) == 3
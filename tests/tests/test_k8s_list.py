@@ -0,0 +1,86 @@
+import time
+import tracemalloc
+
+from kamatera_rke2_kubernetes_terraform_example_tests import k8s_api, util
+
+from .fake_k8s_api import FakeK8sApi
+from .test_k8s_api import get_node, get_pod
+
+
+def get_synthetic_node(i):
+    # roughly the size of a real node object, most of it in a few large fields to keep the object cheap to generate
+    return {
+        "kind": "Node",
+        "metadata": {
+            "name": f"worker{i}",
+            "labels": {"role": "worker", "kubernetes.io/hostname": f"worker{i}"},
+            "annotations": {"rke2.io/external-ip": f"10.{i // 65536}.{i // 256 % 256}.{i % 256}", "data": "x" * 4000},
+        },
+        "status": {
+            "conditions": [{"type": "Ready", "status": "True" if i % 10 else "False", "message": "x" * 200}],
+            "images": "x" * 4000,
+        },
+    }
+
+
+def get_synthetic_pod(i):
+    return {
+        "kind": "Pod",
+        "metadata": {"name": f"demo-{i}", "namespace": "demo", "labels": {"app": "demo"}, "annotations": {"data": "x" * 1000}},
+        "spec": {"nodeName": f"worker{i % 5000}", "containers": "x" * 1000},
+        "status": {"phase": "Running" if i % 3 else "Pending"},
+    }
+
+
+def test_paginated_summaries(tmp_path, monkeypatch):
+    with FakeK8sApi() as fake:
+        kubeconfig = fake.write_kubeconfig(tmp_path / "kubeconfig")
+        monkeypatch.setattr(util, "get_kubeconfig", lambda: kubeconfig)
+        for i in range(7):
+            fake.put("nodes", get_node(f"worker{i}", ready=i % 2 == 0, labels={"role": "autoscaler" if i < 3 else "worker"}))
+            fake.put("pods", get_pod(f"demo-{i}", "Running" if i < 5 else "Pending"))
+        client = k8s_api.get_client(kubeconfig)
+        assert [node["metadata"]["name"] for node in client.list_items("nodes", limit=3)] == [f"worker{i}" for i in range(7)]
+        assert [query.get("continue") for _, path, query in fake.requests if path == "/api/v1/nodes"] == [None, "3", "6"]
+        nodes = client.list_summaries("nodes", k8s_api.NodeSummary, label_selector="role=autoscaler", limit=2)
+        assert [(node.name, node.ready) for node in nodes] == [("worker0", True), ("worker1", False), ("worker2", True)]
+        # the selectors are applied by the server
+        assert ("GET", "/api/v1/nodes", {"labelSelector": "role=autoscaler", "limit": "2", "continue": "2"}) in fake.requests
+        monkeypatch.setattr(util.config, "K8S_LIST_PAGE_SIZE", 2)
+        assert util.kubectl_node_count() == (7, 4)
+        assert util.kubectl_pods_count("demo") == (7, 5)
+        assert [pod.name for pod in util.list_pod_summaries("demo", field_selector="status.phase=Pending")] == ["demo-5", "demo-6"]
+
+
+def measure_peak(func):
+    tracemalloc.start()
+    try:
+        start_time = time.time()
+        res = func()
+        return res, tracemalloc.get_traced_memory()[1], time.time() - start_time
+    finally:
+        tracemalloc.stop()
+
+
+def test_list_memory_benchmark(tmp_path, monkeypatch):
+    # synthetic lists of 5,000 nodes and 50,000 pods, memory per poll should stay flat as the cluster grows
+    with FakeK8sApi() as fake:
+        kubeconfig = fake.write_kubeconfig(tmp_path / "kubeconfig")
+        monkeypatch.setattr(util, "get_kubeconfig", lambda: kubeconfig)
+        peaks = {}
+        for num_nodes, num_pods in [(1000, 10000), (5000, 50000)]:
+            fake.generated = {"nodes": (num_nodes, get_synthetic_node), "pods": (num_pods, get_synthetic_pod)}
+            (nodes, peaks["nodes", num_nodes], seconds) = measure_peak(util.kubectl_node_count)
+            assert nodes == (num_nodes, num_nodes - num_nodes // 10)
+            print(f'{num_nodes} nodes: peak {peaks["nodes", num_nodes] / 1024 / 1024:.1f}MB, {seconds:.2f} seconds')
+            (pods, peaks["pods", num_pods], seconds) = measure_peak(lambda: util.kubectl_pods_count("demo"))
+            assert pods == (num_pods, num_pods - (num_pods + 2) // 3)
+            print(f'{num_pods} pods: peak {peaks["pods", num_pods] / 1024 / 1024:.1f}MB, {seconds:.2f} seconds')
+        # the peak is dominated by a single page (in the client and in the fake server), not by the number of objects
+        assert peaks["nodes", 5000] < peaks["nodes", 1000] * 1.5
+        assert peaks["pods", 50000] < peaks["pods", 10000] * 1.5
+        fake.generated = {"nodes": (5000, get_synthetic_node)}
+        client = k8s_api.get_client(kubeconfig)
+        _, full_list_peak, _ = measure_peak(lambda: util.count_nodes(client.list("nodes")["items"]))
+        print(f'5000 nodes full list: peak {full_list_peak / 1024 / 1024:.1f}MB')
+        assert peaks["nodes", 5000] * 5 < full_list_peak
@@ -0,0 +1,57 @@
+import subprocess
+
+import pytest
+
+from kamatera_rke2_kubernetes_terraform_example_tests import kamatera_api, destroy, inventory
+
+from .fake_kamatera_api import FakeKamateraApi
+
+
+def test_client(monkeypatch):
+    with FakeKamateraApi(command_polls=2) as fake:
+        for name in ["p-controlplane1", "p-worker1", "other-worker1"]:
+            fake.add_server(name)
+        client = kamatera_api.Client(fake.url, "client-id", "secret", max_concurrency=4, retry_sleep_seconds=0)
+        for _ in range(20):
+            assert len(client.list_servers()) == 3
+        assert fake.connections == 1
+        assert sorted(s["name"] for s in client.server_info("p-.*")) == ["p-controlplane1", "p-worker1"]
+        # rate limited requests are retried and the concurrency limit is reduced
+        fake.rate_limit_responses = 2
+        monkeypatch.setattr(kamatera_api.time, "sleep", lambda seconds: None)
+        assert len(client.list_servers()) == 3
+        assert client.limiter.limit < client.limiter.max_concurrency
+        # command queue is polled until the terminate commands are complete
+        assert client.server_terminate("p-.*") == [1, 2]
+        assert [path for _, path in fake.requests].count("/service/queue") == 2
+        assert [s["name"] for s in client.list_servers()] == ["other-worker1"]
+        with pytest.raises(kamatera_api.ApiError) as e:
+            client.server_terminate("missing")
+        assert e.value.status == 404
+        with pytest.raises(kamatera_api.ApiError) as e:
+            kamatera_api.Client(fake.url, "client-id", "wrong").list_servers()
+        assert e.value.status == 401
+
+
+def test_cloudcli_shim(monkeypatch):
+    with FakeKamateraApi() as fake:
+        for i in range(30):
+            fake.add_server(f"p-worker{i}", power="on" if i % 2 else "off")
+        fake.networks["EU"] = [{"vlanId": 1, "ids": ["n1"], "names": ["p-private"]}]
+        fake.subnets[1] = [{"subnetId": 10}]
+        client = kamatera_api.Client(fake.url, "client-id", "secret", max_concurrency=5)
+        monkeypatch.setattr(kamatera_api, "_client", client)
+        monkeypatch.setattr(destroy.config, "KAMATERA_NATIVE_API", True)
+        # the cloudcli binary is not installed, all calls must be handled by the native client
+        monkeypatch.setenv("PATH", "")
+        assert destroy.cloudcli("server", "list", parse_json=True)[0]["name"] == "p-worker0"
+        assert destroy.cloudcli("server", "terminate", "--name", "missing", "--force", "--wait", run=True).returncode == 1
+        with pytest.raises(subprocess.CalledProcessError):
+            destroy.cloudcli("server", "terminate", "--name", "missing", "--force", "--wait")
+        inventory.invalidate()
+        result = destroy.TeardownResult(retry_sleep_seconds=0)
+        assert destroy.terminate_servers("p-", result, max_workers=10) == []
+        assert destroy.terminate_networks("EU", "p-", result) == []
+        assert fake.servers == {}
+        assert len(result.deleted) == 32 and "network n1" in result.deleted and "subnet 10" in result.deleted
+        assert fake.max_in_flight <= 5
@@ -0,0 +1,42 @@
+import json
+
+from kamatera_rke2_kubernetes_terraform_example_tests import registry_mirror, util
+
+from .fake_k8s_api import FakeK8sApi
+
+
+def get_event(name, message, reason="Pulled"):
+    return {"metadata": {"name": name, "namespace": "default"}, "reason": reason, "message": message}
+
+
+def test_registry_mirror_metrics(tmp_path, monkeypatch):
+    with FakeK8sApi() as fake:
+        kubeconfig = fake.write_kubeconfig(tmp_path / "kubeconfig")
+        monkeypatch.setattr(util, "get_kubeconfig", lambda: kubeconfig)
+        for i, message in enumerate([
+            'Successfully pulled image "nginx:latest" in 12.5s (12.5s including waiting). Image size: 72188133 bytes.',
+            'Successfully pulled image "nginx:latest" in 850ms (850ms including waiting)',
+            'Successfully pulled image "nginx:latest" in 1m2.5s (1m2.5s including waiting)',
+            'Successfully pulled image "busybox:latest" in 2.1s (2.1s including waiting)',
+            'Container image "nginx:latest" already present on machine',
+        ]):
+            fake.put("events", get_event(f"event{i}", message))
+        fake.put("events", get_event("pulling", 'Pulling image "nginx:latest"', reason="Pulling"))
+        output = []
+        metrics = registry_mirror.main(print_function=output.append)
+        assert metrics["proxy"] is None and output[0] == "Registry mirror is not deployed"
+        assert metrics["pulls"]["pulls"] == 4 and metrics["pulls"]["already_present"] == 1
+        assert metrics["pulls"]["images"]["nginx:latest"] == {"count": 3, "p50": 12.5, "p95": 62.5, "max": 62.5}
+        assert metrics["pulls"]["pull_seconds"]["max"] == 62.5
+        fake.proxied["/api/v1/namespaces/kube-system/services/registry-mirror:debug/proxy/debug/vars"] = {
+            "registry": {"proxy": {
+                "blobs": {"Requests": 20, "Hits": 15, "Misses": 5, "BytesPulled": 1000, "BytesPushed": 4000},
+                "manifests": {"Requests": 0, "Hits": 0, "Misses": 0, "BytesPulled": 0, "BytesPushed": 0},
+            }},
+        }
+        output = []
+        metrics = registry_mirror.main(output=str(tmp_path / "metrics.json"), print_function=output.append)
+        assert metrics["proxy"]["blobs"] == {"requests": 20, "hits": 15, "misses": 5, "hit_rate": 0.75, "bytes_pulled": 1000}
+        assert metrics["proxy"]["manifests"]["hit_rate"] is None
+        assert output[0] == "blobs: 20 requests, 15 hits, 5 misses, hit rate 75.0%, 1000 bytes pulled from upstream"
+        assert json.load(open(tmp_path / "metrics.json")) == metrics
@@ -0,0 +1,98 @@
+import json
+import subprocess
+
+import pytest
+
+from kamatera_rke2_kubernetes_terraform_example_tests import scale_workers, util, destroy, inventory, k8s_api
+
+from .fake_bin import install_fake_bin
+
+
+FAKE_CLOUDCLI = '''
+import os
+import re
+import sys
+import json
+import fcntl
+state_file = os.environ["FAKE_CLOUDCLI_STATE"]
+# workers are created / terminated in parallel
+lock_file = open(state_file + ".lock", "w")
+fcntl.flock(lock_file, fcntl.LOCK_EX)
+servers = json.load(open(state_file))
+args = sys.argv[1:]
+options = {args[i][2:]: args[i + 1] for i in range(len(args) - 1) if args[i].startswith("--") and not args[i + 1].startswith("--")}
+if args[:2] == ["server", "list"]:
+    print(json.dumps([{"name": name, "power": "on"} for name in servers]))
+elif args[:2] == ["server", "info"]:
+    print(json.dumps([
+        {"name": name, "id": server["id"], "networks": [{"network": "wan-us-ny2", "ips": ["1.2.3.4"]}]}
+        for name, server in servers.items() if re.match(options["name"], name)
+    ]))
+elif args[:2] == ["server", "create"]:
+    servers[options["name"]] = {"id": f"id-{options['name']}", "args": args, "script": open(options["script-file"]).read()}
+elif args[:2] == ["server", "terminate"]:
+    servers.pop(options["name"])
+with open(state_file, "w") as f:
+    json.dump(servers, f)
+'''
+
+
+def test_scale_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(destroy.config, "KAMATERA_NATIVE_API", False)
+    monkeypatch.setattr(destroy.config, "KAMATERA_API_CLIENT_ID", "id")
+    monkeypatch.setattr(destroy.config, "KAMATERA_API_SECRET", "secret")
+    install_fake_bin(tmp_path, monkeypatch, "cloudcli", FAKE_CLOUDCLI)
+    state_file = tmp_path / "cloudcli.json"
+    state_file.write_text(json.dumps({"test-controlplane1": {"id": "id1"}, "test-worker1": {"id": "id2"}, "test-worker2": {"id": "id3"}}))
+    monkeypatch.setenv("FAKE_CLOUDCLI_STATE", str(state_file))
+    tfdir = tmp_path / "tfdir"
+    for stack in ("01-rke2", "02-k8s"):
+        (tfdir / stack).mkdir(parents=True)
+    (tfdir / "server_startup_script.sh").write_text("echo startup\n")
+    (tfdir / ".cluster_token").write_text("token123\n")
+    (tfdir / "01-rke2" / "ktb.auto.tfvars.json").write_text(json.dumps({"servers": {"controlplane1": {}, "worker1": {}, "worker2": {}, "worker4": {}}}))
+    (tfdir / "02-k8s" / "ktb.auto.tfvars.json").write_text(json.dumps({"registry_mirror_enabled": True}))
+    (tfdir / "02-k8s" / "autoscaler.auto.tfvars.json").write_text(json.dumps({
+        "name_prefix": "test", "image_id": "image1", "datacenter_id": "US-NY2", "private_network_name": "lan-123-test-private",
+        "rke2_version": "v1.33.1+rke2r1", "private_ip_prefix": "172.16.", "servers_ssh_port": 22, "rke2_config": "node-name: $NODE_NAME\n",
+        "with_bastion": True, "rke2_artifact_cache_url": "http://172.16.0.2:52080",
+    }))
+    monkeypatch.setattr(util.workspace, "get_tfdir", lambda: str(tfdir))
+    monkeypatch.setattr(util, "get_ssh_pubkeys", lambda: "ssh-rsa AAAA")
+    monkeypatch.setattr(util, "list_node_summaries", lambda: [k8s_api.NodeSummary(name, True) for name in ("worker3", "worker5")])
+    kubectl_calls = []
+    drain_returncode = 1
+
+    def kubectl(*args, **kwargs):
+        kubectl_calls.append(args)
+        return subprocess.CompletedProcess(["kubectl", *args], drain_returncode if args[0] == "drain" else 0)
+
+    monkeypatch.setattr(util, "kubectl", kubectl)
+    inventory.invalidate()
+    output = []
+    assert scale_workers.main(add=2, print_function=output.append) == ["worker3", "worker5"]
+    servers = json.loads(state_file.read_text())
+    args = servers["test-worker3"]["args"]
+    assert args[args.index("--cpu") + 1] == "2B" and args[args.index("--ram") + 1] == "4096" and args[args.index("--disk") + 1] == "size=100"
+    assert "name=lan-123-test-private,ip=auto" in args and args[args.index("--image") + 1] == "image1"
+    script = servers["test-worker5"]["script"]
+    assert "export NODE_NAME=worker5" in script and "export CLUSTER_TOKEN=token123" in script
+    assert "/etc/rancher/rke2/registries-mirror.yaml" in script and "export SSS_ARTIFACT_CACHE_URL=http://172.16.0.2:52080" in script
+    assert script.strip().endswith("bash /root/server_startup_script.sh rke2 172.16. 22 agent v1.33.1+rke2r1 bm9kZS1uYW1lOiAkTk9ERV9OQU1FCg== yes")
+    records = json.loads((tfdir / "scaled_workers.json").read_text())
+    assert records["worker3"]["id"] == "id-test-worker3" and records["worker3"]["extra_server"]["role_config"] == {"rke2_type": "agent"}
+    assert records["worker3"]["terraform_import"] == "terraform import 'kamatera_server.servers[\"worker3\"]' id-test-worker3"
+    assert output[-3].startswith("Added 2 workers in ")
+    # nothing is removed if the nodes can't be drained
+    with pytest.raises(AssertionError, match="failed to drain nodes"):
+        scale_workers.main(remove=5, print_function=output.append)
+    assert len(json.loads(state_file.read_text())) == 5 and len(json.loads((tfdir / "scaled_workers.json").read_text())) == 2
+    drain_returncode = 0
+    kubectl_calls.clear()
+    # only the workers added by scale-workers are removed
+    assert sorted(scale_workers.main(remove=5, print_function=output.append)) == ["worker3", "worker5"]
+    assert sorted(json.loads(state_file.read_text())) == ["test-controlplane1", "test-worker1", "test-worker2"]
+    assert [call[:1] for call in kubectl_calls] == [("drain",), ("delete",)]
+    assert sorted(kubectl_calls[0][1:3]) == ["worker3", "worker5"] and kubectl_calls[0][3:5] == ("--ignore-daemonsets", "--delete-emptydir-data")
+    assert kubectl_calls[1][:2] == ("delete", "nodes") and sorted(kubectl_calls[1][2:4]) == ["worker3", "worker5"]
+    assert json.loads((tfdir / "scaled_workers.json").read_text()) == {}
@@ -0,0 +1,53 @@
+import json
+
+from kamatera_rke2_kubernetes_terraform_example_tests import util
+
+from .fake_bin import install_fake_bin
+
+
+# records the calls and runs the remote commands locally
+FAKE_SSH = '''
+import os
+import sys
+import json
+import subprocess
+
+args = sys.argv[1:]
+with open(os.path.join(os.path.dirname(__file__), "calls.jsonl"), "a") as f:
+    f.write(json.dumps(args) + "\\n")
+i = 0
+while args[i].startswith("-"):
+    i += 1 if args[i] in ("-N", "-f") else 2
+host, command = args[i], args[i + 1:]
+if command:
+    sys.exit(subprocess.run(["bash", "-c", command[0]], env={**os.environ, "NODE": host}).returncode)
+'''
+
+
+def test_ssh_pool(tmp_path, monkeypatch):
+    bin_path = install_fake_bin(tmp_path, monkeypatch, "ssh", FAKE_SSH)
+    ssh_config = tmp_path / "ssh_config"
+    ssh_config.write_text("".join(
+        f"Host test-{name}\n  HostName 10.0.0.{i}\n"
+        for i, name in enumerate(["bastion", "controlplane1", "worker1", "worker2"])
+    ) + util.get_ssh_multiplexing_config())
+    pool = util.SSHSessionPool(str(ssh_config), idle_timeout_seconds=60)
+    assert pool.get_hosts() == ["test-controlplane1", "test-worker1", "test-worker2"]
+    results = pool.run_on_nodes('echo "$NODE"; [ "$NODE" != test-worker2 ]', selector="test-worker*")
+    assert {host: (p.returncode, p.stdout.decode().strip()) for host, p in results.items()} == {
+        "test-worker1": (0, "test-worker1"), "test-worker2": (1, "test-worker2"),
+    }
+    assert list(pool.run_on_nodes("true", selector=lambda host: host.endswith("bastion"))) == ["test-bastion"]
+    (tmp_path / "local.txt").write_bytes(b"hello\x00world")
+    pool.push("test-worker1", str(tmp_path / "local.txt"), str(tmp_path / "remote.txt"))
+    assert pool.fetch("test-worker1", str(tmp_path / "remote.txt"), str(tmp_path / "fetched.txt")) == b"hello\x00world"
+    assert (tmp_path / "fetched.txt").read_bytes() == b"hello\x00world"
+    pool.close()
+    calls = [json.loads(line) for line in (bin_path / "calls.jsonl").read_text().splitlines()]
+    # all connections share the control masters of the generated ssh config
+    assert all(
+        "ControlMaster=auto" in call and "ControlPersist=60" in call and f"ControlPath={util.config.SSH_CONTROL_PATH}" in call
+        for call in calls
+    )
+    assert sorted(call[-1] for call in calls if "-O" in call) == ["test-bastion", "test-worker1", "test-worker2"]
+    assert pool.last_used == {}
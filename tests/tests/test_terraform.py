@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from kamatera_rke2_kubernetes_terraform_example_tests import terraform
+
+from .fake_bin import install_fake_bin
+
+
+FAKE_TERRAFORM = '''
+import os
+import sys
+import json
+
+calls_path = os.path.join(os.path.dirname(__file__), "calls.json")
+calls = json.load(open(calls_path)) if os.path.exists(calls_path) else []
+calls.append(sys.argv[1:])
+json.dump(calls, open(calls_path, "w"))
+scenario = json.load(open(os.path.join(os.path.dirname(__file__), "scenario.json")))
+for event in scenario[min(len(calls), len(scenario)) - 1]["events"]:
+    print(json.dumps(event), flush=True)
+sys.exit(scenario[min(len(calls), len(scenario)) - 1]["returncode"])
+'''
+
+
+def get_resource_event(event_type, address, elapsed_seconds=None):
+    hook = {"resource": {"addr": address}, "action": "create"}
+    if elapsed_seconds is not None:
+        hook["elapsed_seconds"] = elapsed_seconds
+    return {"type": event_type, "@message": f"{address}: {event_type}", "hook": hook}
+
+
+def get_error_event(summary, address=None, detail=""):
+    return {"type": "diagnostic", "@level": "error", "diagnostic": {"severity": "error", "summary": summary, "detail": detail, "address": address}}
+
+
+@pytest.fixture
+def fake_terraform(tmp_path, monkeypatch):
+    bin_path = install_fake_bin(tmp_path, monkeypatch, "terraform", FAKE_TERRAFORM)
+
+    def set_scenario(scenario):
+        (bin_path / "scenario.json").write_text(json.dumps(scenario))
+
+    def get_calls():
+        return json.loads((bin_path / "calls.json").read_text())
+
+    return set_scenario, get_calls
+
+
+def test_apply_retries_failed_resources(fake_terraform, tmp_path):
+    set_scenario, get_calls = fake_terraform
+    init_worker = 'terraform_data.init_rke2["worker1"]'
+    set_scenario([
+        {"returncode": 1, "events": [
+            get_resource_event("apply_start", "kamatera_server.servers"),
+            get_resource_event("apply_complete", "kamatera_server.servers", 120),
+            get_resource_event("apply_start", init_worker),
+            get_resource_event("apply_errored", init_worker, 30),
+            get_error_event("local-exec provisioner error: exit status 255", init_worker),
+        ]},
+        {"returncode": 0, "events": [
+            get_resource_event("apply_start", init_worker),
+            get_resource_event("apply_complete", init_worker, 40),
+        ]},
+        {"returncode": 0, "events": [
+            get_resource_event("apply_start", "terraform_data.kubeconfig"),
+            get_resource_event("apply_complete", "terraform_data.kubeconfig", 5),
+            {"type": "change_summary", "changes": {"add": 1}},
+        ]},
+    ])
+    durations = terraform.apply_with_retries(str(tmp_path), "apply", retry_sleep_seconds=0)
+    assert get_calls() == [
+        ["apply", "-auto-approve", "-json"],
+        ["apply", "-auto-approve", "-json", f"-target={init_worker}"],
+        ["apply", "-auto-approve", "-json"],
+    ]
+    assert durations == {"kamatera_server.servers": 120, init_worker: 70, "terraform_data.kubeconfig": 5}
+
+
+def test_apply_fatal_error(fake_terraform, tmp_path):
+    set_scenario, get_calls = fake_terraform
+    set_scenario([{"returncode": 1, "events": [get_error_event("Unsupported argument")]}])
+    with pytest.raises(Exception, match="fatal error in apply: Unsupported argument"):
+        terraform.apply_with_retries(str(tmp_path), "apply", retry_sleep_seconds=0)
+    assert len(get_calls()) == 1
+
+
+def test_classify_error():
+    for summary in [
+        "Error: status code 401: invalid credentials", "403 Forbidden", "Error: quota exceeded for servers in datacenter EU",
+        "failed to create server: insufficient balance", "Error: Invalid value for variable",
+    ]:
+        assert terraform.classify_error(summary) == "fatal", summary
+    for summary in [
+        "Error: 503 Service Unavailable", "local-exec provisioner error", "Error: exit status 255",
+        "Error: timeout waiting for kca0401abcd-worker403 after 403 seconds",
+        "error waiting for server: the request was unauthorized by a proxy, try again",
+    ]:
+        assert terraform.classify_error(summary) == "retryable", summary
+
+
+def test_apply_ignores_error_detail(fake_terraform, tmp_path):
+    # the detail of provisioner errors is the command output, it's not used to classify the error
+    set_scenario, get_calls = fake_terraform
+    set_scenario([
+        {"returncode": 1, "events": [get_error_event("local-exec provisioner error", detail="curl: (22) The requested URL returned error: 403\nquota exceeded")]},
+        {"returncode": 0, "events": []},
+    ])
+    terraform.apply_with_retries(str(tmp_path), "apply", retry_sleep_seconds=0)
+    assert len(get_calls()) == 2
@@ -0,0 +1,83 @@
+import json
+import time
+import concurrent.futures
+
+from kamatera_rke2_kubernetes_terraform_example_tests import tracing, util, destroy, terraform
+
+from .fake_bin import install_fake_bin
+
+
+FAKE_CLOUDCLI = '''
+import sys
+sys.exit(1 if "fail" in sys.argv else 0)
+'''
+
+
+def test_tracing(tmp_path, monkeypatch):
+    install_fake_bin(tmp_path, monkeypatch, "cloudcli", FAKE_CLOUDCLI)
+    monkeypatch.setattr(destroy.config, "KAMATERA_NATIVE_API", False)
+    monkeypatch.setattr(destroy.config, "KAMATERA_API_CLIENT_ID", "id")
+    monkeypatch.setattr(destroy.config, "KAMATERA_API_SECRET", "secret")
+    tracer = tracing.start(str(tmp_path / "trace.json"))
+    results = iter([Exception("not yet"), False, True])
+
+    def condition():
+        res = next(results)
+        if isinstance(res, Exception):
+            raise res
+        return res and destroy.cloudcli("server", "list", run=True).returncode == 0
+
+    try:
+        with tracing.span("run", scenario="test"):
+            util.wait_for("condition", condition, timeout_seconds=30, poll_seconds=0, retry_on_exception=True, print_function=lambda *args: None)
+            util.wait_all([
+                util.Wait(f"wait {i}", lambda i=i, **kwargs: tracing.add_span(f"work {i}", time.time() - 1, time.time()))
+                for i in range(2)
+            ], print_function=lambda *args: None)
+            with concurrent.futures.ThreadPoolExecutor(2) as executor:
+                list(executor.map(tracing.propagate(lambda arg: destroy.cloudcli("server", arg, run=True)), ["info", "fail"]))
+            terraform.handle_event(terraform.ApplyResult(), {"type": "apply_complete", "hook": {"resource": {"addr": "kamatera_server.servers[\"controlplane1\"]"}, "elapsed_seconds": 120}}, {}, lambda *args: None)
+    finally:
+        output = []
+        assert tracing.finish(print_function=output.append) is tracer
+    spans = {span.id: span for span in tracer.spans}
+    [run] = [span for span in spans.values() if span.name == "run"]
+    [wait_for] = [span for span in spans.values() if span.name == "wait_for"]
+    assert wait_for.parent_id == run.id and wait_for.outcome == "ok"
+    assert wait_for.attributes == {"description": "condition", "timeout_seconds": 30, "attempts": 3}
+    attempts = [span for span in spans.values() if span.parent_id == wait_for.id]
+    assert [(span.attributes["attempt"], span.outcome, span.attributes.get("met")) for span in attempts] == [(1, "error", None), (2, "ok", False), (3, "ok", True)]
+    # the retried condition's spans are children of its attempt
+    [cloudcli] = [span for span in spans.values() if span.parent_id == attempts[2].id]
+    assert (cloudcli.name, cloudcli.attributes) == ("cloudcli", {"args": "('server', 'list')"})
+    # spans in other threads keep their parent
+    works = [span for span in spans.values() if span.name.startswith("work ")]
+    assert len(works) == 2 and all(spans[spans[span.parent_id].parent_id].name == "wait_all" for span in works)
+    assert all(span.thread_id != run.thread_id for span in works)
+    threaded = [span for span in spans.values() if span.name == "cloudcli" and span.parent_id == run.id]
+    assert sorted(span.attributes["args"] for span in threaded) == ["('server', 'fail')", "('server', 'info')"]
+    [terraform_span] = [span for span in spans.values() if span.name.startswith("terraform ")]
+    assert terraform_span.parent_id == run.id and round(terraform_span.duration_seconds) == 120
+    trace = json.load(open(tmp_path / "trace.json"))
+    complete_events = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert len(complete_events) == len(spans)
+    assert {event["name"] for event in trace["traceEvents"] if event["ph"] == "M"} == {"thread_name"}
+    assert output[0] == f'Trace written to {tmp_path / "trace.json"}'
+    assert output[2].strip().startswith("120.0s terraform kamatera_server.servers")
+    assert "Total time by span name:" in output
+
+
+def test_tracing_disabled():
+    assert not tracing.is_enabled()
+
+    @tracing.traced("noop", ("value",))
+    def noop(value):
+        return value
+
+    assert tracing.span("noop") is tracing.NOOP_SPAN and tracing.current_span() is tracing.NOOP_SPAN
+    start_time = time.time()
+    for i in range(100000):
+        with tracing.span("noop"):
+            noop(i)
+    assert time.time() - start_time < 2
+    assert tracing.finish() is None
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from kamatera_rke2_kubernetes_terraform_example_tests import util
+
+
+def get_wait(description, seconds, fail=False):
+    start_time = time.time()
+
+    def condition():
+        if time.time() - start_time > seconds:
+            assert not fail, f"{description} failed"
+            return True
+        return False
+
+    return util.Wait(description, lambda **kwargs: util.wait_for(description, condition, poll_seconds=0.05, **kwargs))
+
+
+def test_wait_all_runs_concurrently():
+    start_time = time.time()
+    waits = util.wait_all([get_wait("a", 0.3), get_wait("b", 0.4), get_wait("c", 0.2)], timeout_seconds=5)
+    assert time.time() - start_time < 0.8
+    assert [wait.status for wait in waits] == ["met", "met", "met"]
+
+
+def test_wait_all_cancels_on_failure():
+    waits = [get_wait("slow", 30), get_wait("failing", 0.2, fail=True)]
+    start_time = time.time()
+    with pytest.raises(AssertionError, match="failing failed"):
+        util.wait_all(waits, timeout_seconds=60)
+    assert time.time() - start_time < 5
+    assert [wait.status for wait in waits] == ["cancelled", "failed"]
+
+
+def test_wait_all_shared_timeout():
+    with pytest.raises(AssertionError, match="timeout waiting for: slow"):
+        util.wait_all([get_wait("slow", 30), get_wait("fast", 0.1)], timeout_seconds=0.5)
+
+
+def test_wait_any():
+    wait = util.wait_any([get_wait("slow", 30), get_wait("failing", 0.1, fail=True), get_wait("fast", 0.3)], timeout_seconds=5)
+    assert wait.description == "fast"
+
+
+def test_wait_all_stream_output():
+    def run(print_function, **kwargs):
+        print_function("Error: quota exceeded\ndetails of the error")
+        print_function("done")
+
+    output = []
+    waits = util.wait_all([util.Wait("apply", run, stream_output=True), get_wait("poll", 0.1)], timeout_seconds=5, print_function=output.append)
+    assert [line for line in output if line.startswith("[apply]")] == ["[apply] Error: quota exceeded\n[apply] details of the error", "[apply] done"]
+    assert not any(line.startswith("[poll]") for line in output)
+    assert waits[0].last_message == "done"
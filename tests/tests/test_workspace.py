@@ -0,0 +1,65 @@
+import os
+import time
+import threading
+import contextlib
+
+import pytest
+
+from kamatera_rke2_kubernetes_terraform_example_tests import config, workspace, util, scheduler, k8s_demo_app
+
+
+def test_workspace_isolation(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WORKSPACES_DIR", str(tmp_path))
+    assert util.get_kubeconfig() == os.path.join(workspace.ROOT_TFDIR, ".kubeconfig")
+    with workspace.use("kca1") as tfdir:
+        assert tfdir == str(tmp_path / "kca1")
+        assert os.path.exists(os.path.join(tfdir, "01-rke2", "main.tf"))
+        assert os.path.exists(os.path.join(tfdir, "server_startup_script.sh"))
+        assert util.get_kubeconfig() == os.path.join(tfdir, ".kubeconfig")
+        with open(os.path.join(tfdir, "01-rke2", "terraform.tfstate"), "w") as f:
+            f.write("{}")
+        seen = []
+        waits = [util.Wait("workspace", lambda **kwargs: seen.append(workspace.get_name_prefix()))]
+        util.wait_all(waits, timeout_seconds=5)
+        assert seen == ["kca1"]
+    assert workspace.get_tfdir() == workspace.ROOT_TFDIR
+    # recreating an existing workspace keeps its state
+    with workspace.use("kca1") as tfdir:
+        assert os.path.exists(os.path.join(tfdir, "01-rke2", "terraform.tfstate"))
+    assert workspace.list_workspaces() == ["kca1"]
+    workspace.remove("kca1")
+    assert workspace.list_workspaces() == []
+
+
+def test_scheduler(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WORKSPACES_DIR", str(tmp_path))
+    scenarios = scheduler.load_scenarios()
+    assert len(scenarios) == 5 and scenarios[0].env["K8S_VERSION"] == "1.35"
+    lock = threading.Lock()
+    in_flight = []
+    max_in_flight = []
+
+    @contextlib.contextmanager
+    def assert_demo_app(extra_servers=None, options=None, name_prefix=None):
+        assert options.use_workspace and not options.use_existing_name_prefix
+        with workspace.use(name_prefix):
+            with lock:
+                in_flight.append(name_prefix)
+                max_in_flight.append(len(in_flight))
+            try:
+                time.sleep(0.2)
+                assert options.datacenter_id != "IL", "failed in IL"
+            finally:
+                with lock:
+                    in_flight.remove(name_prefix)
+            yield
+
+    monkeypatch.setattr(k8s_demo_app, "assert_demo_app", assert_demo_app)
+    scenarios_file = tmp_path / "scenarios.json"
+    scenarios_file.write_text('[' + ",".join(
+        f'{{"name": "s{i}", "env": {{"DATACENTER_ID": "{"EU" if i else "IL"}"}}}}' for i in range(5)
+    ) + ']')
+    with pytest.raises(Exception, match="Scenarios failed: s0$"):
+        scheduler.main(str(scenarios_file), max_clusters=2)
+    assert max(max_in_flight) == 2
+    assert len(workspace.list_workspaces()) == 5